@@ -10,10 +10,12 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-# SDL2 libraries
-import sdl2.ext
-from .screen import FrameBuffer
-from .env import SDL2Environment
+# LSD package imports. SDL2 and the modules that need it are only imported 
+# when they are first used, which keeps importing LSD fast for processes
+# that do not render at all or only use part of the package.
+from .cache import DEFAULT_SHAPE_CACHE_SIZE, DEFAULT_IMAGE_CACHE_SIZE
+from . import profiling
+import importlib
 import os
 import sys
 
@@ -25,8 +27,36 @@ __author__ = 'Daniel Schreij'
 # The variable to hold the sdl2environment object
 current_sdl2_environment = None
 
-def create_window(resolution, title="SDL2 Display Window", fullscreen=False):
+# Classes that are available as LSD.<name>, with the module they are in
+_lazy_attributes = {
+	"FrameBuffer": ".screen",
+	"FrameSequence": ".sequence",
+	"SDL2Environment": ".env",
+	"HeadlessEnvironment": ".env",
+}
+
+def __getattr__(name):
+	""" Imports the module of a class in _lazy_attributes on first access. """
+	module = _lazy_attributes.get(name)
+	if module is None:
+		raise AttributeError("module {!r} has no attribute {!r}".format(
+			__name__, name))
+	value = getattr(importlib.import_module(module, __name__), name)
+	globals()[name] = value
+	return value
+
+# Module level __getattr__ only exists since Python 3.7
+if sys.version_info < (3, 7):
+	from .screen import FrameBuffer
+	from .sequence import FrameSequence
+	from .env import SDL2Environment, HeadlessEnvironment
+
+def create_window(resolution, title="SDL2 Display Window", fullscreen=False,
+	shape_cache_size=DEFAULT_SHAPE_CACHE_SIZE, image_cache_size=DEFAULT_IMAGE_CACHE_SIZE):
 	global current_sdl2_environment
+	import sdl2.ext
+	from .env import SDL2Environment, HeadlessEnvironment
+	from .resources import TrackingSpriteFactory
 	if type(resolution) != tuple and len(resolution) != 2:
 		raise TypeError("Please make sure the resolution variable is a tuple with (width,height)")
 	(width, height) = resolution
@@ -65,39 +95,90 @@ def create_window(resolution, title="SDL2 Display Window", fullscreen=False):
 	renderer = sdl2.ext.Renderer(window, flags=rendererflags)
 	renderer.clear(0)
 	renderer.present()
-	# Create sprite factory to create textures with later
-	texture_factory = sdl2.ext.SpriteFactory(renderer=renderer)
+	# Create sprite factory to create textures with later. It registers them
+	# with the resource tracker of the environment.
+	texture_factory = TrackingSpriteFactory(renderer=renderer)
 	# Create sprite factory to create surfaces with later
 	surface_factory = sdl2.ext.SpriteFactory(sdl2.ext.SOFTWARE)
 
 	# Create an environment object that contains all necessary objects, functions
 	# and other information to work with the window interface.
 	sdl2env = SDL2Environment(window, resolution, renderer, texture_factory, 
-		surface_factory, __version__)
+		surface_factory, __version__, shape_cache_size=shape_cache_size,
+		image_cache_size=image_cache_size)
 	current_sdl2_environment= sdl2env
 	window.refresh()
 	return sdl2env
 
+def create_headless_environment(resolution, shape_cache_size=DEFAULT_SHAPE_CACHE_SIZE,
+	image_cache_size=DEFAULT_IMAGE_CACHE_SIZE):
+	""" Creates an environment that renders offscreen.
+
+	It uses SDL's dummy video driver and a software renderer without vsync, so
+	stimuli can be rendered as fast as the CPU allows on machines without a 
+	display (e.g. render servers or CI). Read the results out with 
+	FrameBuffer.to_array() or FrameBuffer.save(). Use destroy_window() to clean
+	up afterwards.
+	"""
+	global current_sdl2_environment
+	import sdl2.ext
+	from .env import SDL2Environment, HeadlessEnvironment
+	from .resources import TrackingSpriteFactory
+	if type(resolution) != tuple and len(resolution) != 2:
+		raise TypeError("Please make sure the resolution variable is a tuple with (width,height)")
+
+	# The video driver can only be chosen before the video subsystem starts
+	os.environ["SDL_VIDEODRIVER"] = "dummy"
+	sdl2.ext.init()
+
+	window = sdl2.ext.Window("LSD headless", size=resolution, 
+		flags=sdl2.SDL_WINDOW_HIDDEN)
+
+	# A software renderer does not wait for the vertical retrace when presenting
+	rendererflags = sdl2.SDL_RENDERER_SOFTWARE | sdl2.SDL_RENDERER_TARGETTEXTURE
+	renderer = sdl2.ext.Renderer(window, flags=rendererflags)
+	texture_factory = TrackingSpriteFactory(renderer=renderer)
+	surface_factory = sdl2.ext.SpriteFactory(sdl2.ext.SOFTWARE)
+
+	sdl2env = HeadlessEnvironment(window, resolution, renderer, texture_factory,
+		surface_factory, __version__, shape_cache_size=shape_cache_size,
+		image_cache_size=image_cache_size)
+	current_sdl2_environment = sdl2env
+	return sdl2env
+
 def destroy_window(sdl2env=None):
 	global current_sdl2_environment
+	if sdl2env is None:
+		sdl2env = current_sdl2_environment
+	# Cached textures become invalid once the renderer is gone
+	if not sdl2env is None:
+		sdl2env.invalidate_caches()
 	current_sdl2_environment = None
 	del(current_sdl2_environment)
+	import sdl2.ext
 	sdl2.ext.quit()
 
 # Decorator
 def inject_sdl_environment(func):
+	# Calls of the drawing and stimulus functions are recorded by an active
+	# LSD.profiling.Profiler
+	profiled = func.__module__.endswith(('.drawing', '.stimuli'))
 	@wraps(func)
 	def wrapped(*args, **kwargs):
 		global current_sdl2_environment
 		if "sdl2env" not in kwargs:
 			kwargs['sdl2env'] = current_sdl2_environment
+		if profiled and not profiling.active is None:
+			return profiling.active.call(func, args, kwargs)
 		return func(*args, **kwargs)
 	return wrapped
 
 @inject_sdl_environment
 def create_framebuffer(*args, **kwargs):
+	from .env import SDL2Environment
+	from .screen import FrameBuffer
 	sdl2env = kwargs.get('sdl2env', None)
-	if type(sdl2env) == SDL2Environment:
+	if isinstance(sdl2env, SDL2Environment):
 		if len(args):
 			return FrameBuffer(*args, **kwargs)
 		else:
@@ -105,6 +186,21 @@ def create_framebuffer(*args, **kwargs):
 	else:
 		raise EnvironmentError("SDL2 is not initialized yet! Create a window first")
 
+@inject_sdl_environment
+def create_geometry_batch(*args, **kwargs):
+	""" Creates a GeometryBatch that draws in the current environment. """
+	from .geometry import GeometryBatch
+	return GeometryBatch(*args, **kwargs)
 
+@inject_sdl_environment
+def create_display_list(*args, **kwargs):
+	""" Creates a DisplayList that records drawing in the current environment.
+	"""
+	from .displaylist import DisplayList
+	return DisplayList(*args, **kwargs)
 
-
+@inject_sdl_environment
+def create_stimulus_pool(*args, **kwargs):
+	""" Creates a StimulusPool that renders in the current environment. """
+	from .pool import StimulusPool
+	return StimulusPool(*args, **kwargs)
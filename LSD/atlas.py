@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Texture atlas that packs many small textures into a few large ones.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+
+# LSD package imports
+from .texture import TextureHandle
+
+# misc
+import ctypes
+import weakref
+
+# Default dimensions of an atlas page
+DEFAULT_ATLAS_PAGE_SIZE = (2048, 2048)
+
+class ShelfPacker(object):
+	""" Places rectangles on horizontal shelves of a fixed size area.
+
+	A rectangle is put on the first shelf that is high enough and has enough
+	room left. If there is no such shelf, a new shelf is opened below the
+	last one. Space is never reclaimed; TextureAtlas.repack() builds new
+	packers to get rid of the holes left by removed rectangles.
+
+	Parameters
+	----------
+	width, height: int
+		The dimensions of the area to pack the rectangles in.
+	padding: int, optional
+		Empty pixels to keep between the rectangles, to prevent neighbouring
+		textures from bleeding into each other when they are scaled.
+	"""
+
+	def __init__(self, width, height, padding=1):
+		self.width = width
+		self.height = height
+		self.padding = padding
+		# Every shelf is a list of [y, height, x of the free space]
+		self.shelves = []
+		self.used_area = 0
+
+	def insert(self, w, h):
+		""" Returns the (x, y) position for a w x h rectangle, or None if it
+		does not fit anymore. """
+		pw, ph = w + self.padding, h + self.padding
+		for shelf in self.shelves:
+			y, shelf_h, x = shelf
+			if ph <= shelf_h and x + pw <= self.width:
+				shelf[2] += pw
+				self.used_area += w*h
+				return x, y
+		# Open a new shelf below the last one
+		y = self.shelves[-1][0] + self.shelves[-1][1] if self.shelves else 0
+		if y + ph > self.height or pw > self.width:
+			return None
+		self.shelves.append([y, ph, pw])
+		self.used_area += w*h
+		return 0, y
+
+class AtlasRegion(object):
+	""" The location of one texture in the atlas. """
+
+	__slots__ = ('page', 'rect', 'source', 'key')
+
+	def __init__(self, page, rect, source, key):
+		self.page = page
+		self.rect = rect
+		self.source = source
+		self.key = key
+
+class AtlasHandle(TextureHandle):
+	""" A TextureHandle that draws a region of an atlas page.
+
+	The sprite and srcrect are looked up in the region every time, so the
+	handle stays valid when the atlas is repacked.
+	"""
+
+	__slots__ = ('region',)
+
+	def __init__(self, region, x=None, y=None, opacity=255, center=None, angle=0,
+		flip=sdl2.SDL_FLIP_NONE):
+		self.region = region
+		self.x = x
+		self.y = y
+		self.opacity = opacity
+		self.center = center
+		self.angle = angle
+		self.flip = flip
+
+	@property
+	def sprite(self):
+		return self.region.page.sprite
+
+	@property
+	def srcrect(self):
+		return self.region.rect
+
+class AtlasPage(object):
+	""" One large target texture of the atlas with its packer. """
+
+	def __init__(self, sprite, padding):
+		self.sprite = sprite
+		self.packer = ShelfPacker(sprite.size[0], sprite.size[1], padding)
+		self.regions = []
+
+class TextureAtlas(object):
+	""" Packs shape textures and images into a few large target textures.
+
+	Adding a texture copies its pixels to a free region of one of the atlas
+	pages and returns an AtlasHandle that FrameBuffer.add() draws with the
+	region as source rect. Many different stimuli then share a handful of
+	textures, which saves the renderer a texture switch for every copy.
+
+	Parameters
+	----------
+	sdl2env: SDL2Environment
+		The environment whose renderer creates the pages.
+	page_size: tuple, optional
+		The (width, height) of every atlas page.
+	padding: int, optional
+		Empty pixels between the packed textures.
+	"""
+
+	def __init__(self, sdl2env, page_size=DEFAULT_ATLAS_PAGE_SIZE, padding=1):
+		self.environment = sdl2env
+		self.page_size = page_size
+		self.padding = padding
+		self.pages = []
+		self._regions = {}
+
+	def __len__(self):
+		return len(self._regions)
+
+	def __contains__(self, key):
+		return key in self._regions
+
+	def add(self, texture, key=None):
+		""" Copies a texture to the atlas.
+
+		Parameters
+		----------
+		texture: TextureHandle or sdl2.ext.TextureSprite
+			The texture to pack. The position, opacity and rotation of a
+			TextureHandle are carried over to the returned handle.
+		key: hashable, optional
+			Identifies the texture in the atlas. Defaults to the texture itself,
+			so adding a texture again (e.g. an identical circle that came from
+			the shape cache) returns a handle to the region it already has.
+
+		Returns
+		-------
+		AtlasHandle: handle to the region of the texture in the atlas
+		"""
+		sprite = getattr(texture, 'sprite', texture)
+		srcrect = getattr(texture, 'srcrect', None)
+		if key is None:
+			key = (ctypes.addressof(sprite.texture), srcrect)
+
+		region = self._regions.get(key)
+		# Make sure the region was not made for a texture that has since been
+		# destroyed and whose memory address is now in use by a new one.
+		if not region is None and region.source() is not sprite:
+			self.remove(key)
+			region = None
+		if region is None:
+			if srcrect is None:
+				srcrect = (0, 0) + tuple(sprite.size)
+			page, rect = self._allocate(srcrect[2], srcrect[3])
+			self._blit(sprite.texture, srcrect, page.sprite.texture, rect)
+			region = AtlasRegion(page, rect, weakref.ref(sprite), key)
+			page.regions.append(region)
+			self._regions[key] = region
+
+		if isinstance(texture, TextureHandle):
+			return AtlasHandle(region, x=texture.x, y=texture.y,
+				opacity=texture.opacity, center=texture.center,
+				angle=texture.angle, flip=texture.flip)
+		return AtlasHandle(region)
+
+	def add_image(self, image_path):
+		""" Loads an image file into the atlas and returns its handle. """
+		region = self._regions.get(image_path)
+		if region is None:
+			sprite = self.environment.image_cache.texture(image_path)
+			return self.add(sprite, key=image_path)
+		return AtlasHandle(region)
+
+	def get(self, key):
+		""" Returns a handle for the region stored under key, or None. """
+		region = self._regions.get(key)
+		return None if region is None else AtlasHandle(region)
+
+	def remove(self, key):
+		""" Removes a texture from the atlas. Its space is only reclaimed when
+		the atlas is repacked. """
+		region = self._regions.pop(key, None)
+		if not region is None:
+			region.page.regions.remove(region)
+
+	def repack(self):
+		""" Packs all regions into new pages, largest first, to get rid of the
+		holes left by removed textures. Existing handles stay valid. """
+		# The old pages stay alive until all regions have been copied
+		old_pages = self.pages
+		self.pages = []
+		regions = sorted(self._regions.values(),
+			key=lambda r: (r.rect[3], r.rect[2]), reverse=True)
+		for region in regions:
+			page, rect = self._allocate(region.rect[2], region.rect[3])
+			self._blit(region.page.sprite.texture, region.rect,
+				page.sprite.texture, rect)
+			region.page, region.rect = page, rect
+			page.regions.append(region)
+		return self
+
+	def clear(self):
+		""" Removes all textures and pages from the atlas. """
+		self._regions.clear()
+		self.pages = []
+
+	def occupancy(self):
+		""" Returns a report on how well the pages are used.
+
+		Returns
+		-------
+		dict: with for every page the number of regions, the area that is
+		in use by regions and the fraction of the page that this area covers,
+		and the area that was packed but has since been freed.
+		"""
+		pages = []
+		for page in self.pages:
+			total = page.packer.width * page.packer.height
+			used = sum(r.rect[2]*r.rect[3] for r in page.regions)
+			pages.append({
+				"regions": len(page.regions),
+				"used_area": used,
+				"freed_area": page.packer.used_area - used,
+				"occupancy": used / total,
+			})
+		return {
+			"page_count": len(self.pages),
+			"page_size": self.page_size,
+			"regions": len(self._regions),
+			"pages": pages,
+		}
+
+	def _allocate(self, w, h):
+		""" Finds room for a w x h region, opening a new page if needed. """
+		if w + self.padding > self.page_size[0] or h + self.padding > self.page_size[1]:
+			raise ValueError("Texture of {}x{} does not fit in an atlas page of "
+				"{}".format(w, h, self.page_size))
+		for page in self.pages:
+			pos = page.packer.insert(w, h)
+			if not pos is None:
+				return page, pos + (w, h)
+		page = self._new_page()
+		return page, page.packer.insert(w, h) + (w, h)
+
+	def _new_page(self):
+		sprite = self.environment.texture_factory.create_sprite(
+			size=self.page_size,
+			access=sdl2.SDL_TEXTUREACCESS_TARGET
+		)
+		sdl2.SDL_SetTextureBlendMode(sprite.texture, sdl2.SDL_BLENDMODE_BLEND)
+
+		# Start out fully transparent
+		renderer = self.environment.renderer
+		if sdl2.SDL_SetRenderTarget(renderer.sdlrenderer, sprite.texture) != 0:
+			raise Exception("Could not set atlas page as rendering target: "
+				"{}".format(sdl2.SDL_GetError()))
+		renderer.clear((0, 0, 0, 0))
+		if sdl2.SDL_SetRenderTarget(renderer.sdlrenderer, None) != 0:
+			raise Exception("Could not free atlas page as rendering target: "
+				"{}".format(sdl2.SDL_GetError()))
+
+		page = AtlasPage(sprite, self.padding)
+		self.pages.append(page)
+		return page
+
+	def _blit(self, src_texture, srcrect, dst_texture, dstrect):
+		""" Copies the pixels of srcrect of a texture unaltered to dstrect of
+		a page. """
+		sdlrenderer = self.environment.renderer.sdlrenderer
+
+		# Copy without blending and alpha modulation, so the page gets the
+		# exact pixel values of the source. Restore the state afterwards.
+		blend_mode = sdl2.SDL_BlendMode()
+		alpha = ctypes.c_uint8()
+		sdl2.SDL_GetTextureBlendMode(src_texture, ctypes.byref(blend_mode))
+		sdl2.SDL_GetTextureAlphaMod(src_texture, ctypes.byref(alpha))
+		sdl2.SDL_SetTextureBlendMode(src_texture, sdl2.SDL_BLENDMODE_NONE)
+		sdl2.SDL_SetTextureAlphaMod(src_texture, 255)
+
+		if sdl2.SDL_SetRenderTarget(sdlrenderer, dst_texture) != 0:
+			raise Exception("Could not set atlas page as rendering target: "
+				"{}".format(sdl2.SDL_GetError()))
+		sdl2.SDL_RenderCopy(sdlrenderer, src_texture, sdl2.SDL_Rect(*srcrect),
+			sdl2.SDL_Rect(*dstrect))
+		if sdl2.SDL_SetRenderTarget(sdlrenderer, None) != 0:
+			raise Exception("Could not free atlas page as rendering target: "
+				"{}".format(sdl2.SDL_GetError()))
+
+		sdl2.SDL_SetTextureBlendMode(src_texture, blend_mode.value)
+		sdl2.SDL_SetTextureAlphaMod(src_texture, alpha.value)
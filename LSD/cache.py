@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Caches for rasterized textures.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import os
+
+# Default memory budget of the shape texture cache: 64 MB
+DEFAULT_SHAPE_CACHE_SIZE = 64*1024*1024
+# Default memory budget of the tessellated mesh cache: 16 MB
+DEFAULT_MESH_CACHE_SIZE = 16*1024*1024
+# Default memory budget of the ring coverage mask cache: 16 MB
+DEFAULT_MASK_CACHE_SIZE = 16*1024*1024
+# Default memory budget of the grids, envelopes and carriers of stimuli: 64 MB
+DEFAULT_STIMULUS_CACHE_SIZE = 64*1024*1024
+# Default memory budget of both the decoded surfaces and the uploaded textures 
+# of the image cache: 256 MB
+DEFAULT_IMAGE_CACHE_SIZE = 256*1024*1024
+
+def texture_bytes(size, bytes_per_pixel=4):
+	""" Estimate the amount of memory a texture of `size` occupies. """
+	return int(size[0]) * int(size[1]) * bytes_per_pixel
+
+class TextureCache(object):
+	""" A memory bounded store of rasterized textures with LRU eviction.
+
+	Textures are stored under a key built from the normalized drawing
+	parameters, so that drawing an identical shape twice only rasterizes it
+	once. If adding a texture makes the cache exceed `max_bytes`, the least
+	recently used textures are dropped until it fits again. Dropping an entry
+	does not destroy its texture directly: it is released when the last
+	TextureHandle referring to it is garbage collected.
+
+	Parameters
+	----------
+	max_bytes: int, optional
+		The memory budget of the cache in bytes. A value of 0 disables caching.
+	"""
+
+	def __init__(self, max_bytes=DEFAULT_SHAPE_CACHE_SIZE):
+		self._entries = OrderedDict()
+		self.max_bytes = max_bytes
+		self.used_bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	@property
+	def max_bytes(self):
+		return self._max_bytes
+
+	@max_bytes.setter
+	def max_bytes(self, value):
+		if type(value) != int or value < 0:
+			raise ValueError("max_bytes needs to be a positive int")
+		self._max_bytes = value
+		if hasattr(self, 'used_bytes'):
+			self._evict()
+
+	def get(self, key):
+		""" Returns the sprite stored under key, or None if it is absent. """
+		entry = self._entries.pop(key, None)
+		if entry is None:
+			self.misses += 1
+			return None
+		# Re-insert to mark as most recently used
+		self._entries[key] = entry
+		self.hits += 1
+		return entry[0]
+
+	def put(self, key, sprite, nbytes=None):
+		""" Stores sprite under key, evicting old entries if necessary.
+
+		Textures that are larger than the complete budget are not stored.
+		"""
+		if nbytes is None:
+			nbytes = texture_bytes(sprite.size)
+		if nbytes > self._max_bytes:
+			return sprite
+		self.discard(key)
+		self._entries[key] = (sprite, nbytes)
+		self.used_bytes += nbytes
+		self._evict()
+		return sprite
+
+	def discard(self, key):
+		""" Removes the entry stored under key, if there is one. """
+		entry = self._entries.pop(key, None)
+		if not entry is None:
+			self.used_bytes -= entry[1]
+
+	def remove(self, sprite):
+		""" Removes all entries that hold sprite. """
+		for key in [key for key, (s, _) in self._entries.items() if s is sprite]:
+			self.discard(key)
+
+	def trim(self, nbytes):
+		""" Drops the least recently used entries until at least nbytes are
+		dropped or the cache is empty. Returns the number of bytes dropped. """
+		dropped = 0
+		while dropped < nbytes and self._entries:
+			_, (_, size) = self._entries.popitem(last=False)
+			self.used_bytes -= size
+			self.evictions += 1
+			dropped += size
+		return dropped
+
+	def invalidate(self):
+		""" Drops all entries.
+
+		This needs to be called before the renderer that created the textures
+		is destroyed, as the textures cannot be used after that.
+		"""
+		self._entries.clear()
+		self.used_bytes = 0
+
+	def stats(self):
+		""" Returns a dict with the usage statistics of the cache. """
+		return {
+			"entries": len(self._entries),
+			"used_bytes": self.used_bytes,
+			"max_bytes": self._max_bytes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+		}
+
+	def _evict(self):
+		while self.used_bytes > self._max_bytes and self._entries:
+			_, (_, nbytes) = self._entries.popitem(last=False)
+			self.used_bytes -= nbytes
+			self.evictions += 1
+
+class ImageCache(object):
+	""" Cache of decoded and uploaded image files.
+
+	Decoded surfaces and uploaded textures are kept in two separate LRU
+	stores, each with its own byte budget: the surfaces are needed for 
+	textured polygons (and to upload a texture again without decoding), 
+	the textures for everything that is copied by the renderer. Entries are
+	keyed on the absolute path and modification time of the file, so an 
+	image that changes on disk is loaded again.
+
+	Parameters
+	----------
+	texture_factory: sdl2.ext.SpriteFactory
+		Factory that uploads surfaces to textures.
+	surface_factory: sdl2.ext.SpriteFactory
+		Factory that decodes image files to surfaces.
+	max_bytes: int, optional
+		The budget of both the surface and the texture store in bytes.
+	"""
+
+	def __init__(self, texture_factory, surface_factory,
+		max_bytes=DEFAULT_IMAGE_CACHE_SIZE):
+		self.texture_factory = texture_factory
+		self.surface_factory = surface_factory
+		self.surfaces = TextureCache(max_bytes)
+		self.textures = TextureCache(max_bytes)
+
+	def key(self, image_path):
+		""" Returns the cache key of an image file. """
+		image_path = os.path.abspath(image_path)
+		return (image_path, os.stat(image_path).st_mtime)
+
+	def surface(self, image_path):
+		""" Returns the image as a SoftwareSprite, decoding it only if it is not
+		in the cache. """
+		key = self.key(image_path)
+		sprite = self.surfaces.get(key)
+		if sprite is None:
+			sprite = self.add_surface(key, 
+				self.surface_factory.from_image(image_path))
+		return sprite
+
+	def add_surface(self, key, sprite):
+		""" Stores an image that has been decoded elsewhere under key. """
+		return self.surfaces.put(key, sprite, 
+			sprite.surface.pitch * sprite.surface.h)
+
+	def add_texture(self, key, sprite):
+		""" Uploads an image that has been decoded elsewhere (a SoftwareSprite)
+		and stores its texture under key. """
+		return self.textures.put(key, self.texture_factory.from_surface(
+			sprite.surface))
+
+	def has_texture(self, image_path):
+		""" Checks if the image is uploaded, without counting a hit or miss. """
+		return self.key(image_path) in self.textures
+
+	def texture(self, image_path):
+		""" Returns the image as a TextureSprite, uploading (and decoding) it 
+		only if it is not in the cache. """
+		key = self.key(image_path)
+		sprite = self.textures.get(key)
+		if sprite is None:
+			sprite = self.texture_factory.from_surface(
+				self.surface(image_path).surface)
+			self.textures.put(key, sprite)
+		return sprite
+
+	def invalidate(self):
+		""" Drops all cached surfaces and textures. """
+		self.surfaces.invalidate()
+		self.textures.invalidate()
+
+	def stats(self):
+		""" Returns the usage statistics of both stores. """
+		return {
+			"surfaces": self.surfaces.stats(),
+			"textures": self.textures.stats(),
+		}
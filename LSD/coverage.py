@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Anti-aliased coverage masks of rings and arcs, computed from signed distances.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# LSD package imports
+from .util import np
+
+def ellipse_distance(x, y, rx, ry):
+	""" Approximate signed distance of the points (x, y) to the outline of an
+	ellipse with radii rx and ry around the origin: negative inside, positive
+	outside. It is exact for circles and close enough for anti-aliasing
+	ellipses that are not extremely elongated. """
+	if rx == ry:
+		return np.sqrt(x*x + y*y) - rx
+	k0 = np.sqrt((x/rx)**2 + (y/ry)**2)
+	k1 = np.sqrt((x/(rx*rx))**2 + (y/(ry*ry))**2)
+	# k1 is 0 at the center, which is min(rx, ry) away from the outline
+	return np.where(k1 > 0, k0*(k0 - 1)/np.maximum(k1, 1e-12),
+		-min(rx, ry)).astype(np.float32)
+
+def sector_distance(x, y, start, end):
+	""" Approximate signed distance of the points (x, y) to the sector from
+	start to end (degrees, clockwise from the positive x-axis, as in sdlgfx),
+	measured perpendicular to its nearest edge. """
+	span = (end - start) % 360
+	if span == 0:
+		return None
+	rho = np.sqrt(x*x + y*y)
+	rel = (np.degrees(np.arctan2(y, x)) - start) % 360
+	inside = rel <= span
+	# Angle to the nearest edge of the sector
+	angle = np.where(inside, np.minimum(rel, span - rel),
+		np.minimum(rel - span, 360 - rel))
+	distance = rho*np.sin(np.radians(np.minimum(angle, 90)))
+	return np.where(inside, -distance, distance).astype(np.float32)
+
+def ring_coverage(rx, ry, penwidth, size, center, start=0, end=360, aa=True):
+	""" Computes the coverage of every pixel by a ring (or, with start and
+	end, an arc) of width penwidth around an ellipse with radii rx and ry.
+
+	All pixels are computed in one vectorized pass. The outline of the ring
+	is at distance penwidth/2 of the ellipse, and pixels on the edge are
+	partially covered.
+
+	Parameters
+	----------
+	rx, ry: int
+		The radii of the center line of the ring.
+	penwidth: int
+		The width of the ring.
+	size: (int, int)
+		The width and height of the mask.
+	center: (int, int)
+		The pixel the ring is centered on.
+	start, end: float, optional
+		The angles the arc starts and ends at.
+	aa: bool, optional
+		Anti-alias the edges. Otherwise pixels are covered completely or not at
+		all.
+
+	Returns
+	-------
+	numpy.ndarray: a (height, width) uint8 array with the coverage as alpha
+	values between 0 and 255.
+	"""
+	width, height = size
+	x = np.arange(width, dtype=np.float32)[np.newaxis, :] - center[0]
+	y = np.arange(height, dtype=np.float32)[:, np.newaxis] - center[1]
+	distance = np.abs(ellipse_distance(x, y, rx, ry)) - penwidth/2.0
+	if (end - start) % 360:
+		distance = np.maximum(distance, sector_distance(x, y, start, end))
+	if aa:
+		alpha = np.clip(0.5 - distance, 0.0, 1.0)*255 + 0.5
+	else:
+		alpha = np.where(distance <= 0.0, 255, 0)
+	return alpha.astype(np.uint8)
+
+def colorize(alpha, color):
+	""" Returns an RGBA32 (height, width, 4) array with color as its RGB
+	values and alpha as its alpha channel. """
+	pixels = np.empty(alpha.shape + (4,), dtype=np.uint8)
+	pixels[..., 0] = color.r
+	pixels[..., 1] = color.g
+	pixels[..., 2] = color.b
+	pixels[..., 3] = alpha
+	return pixels
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Recordable and replayable lists of drawing operations.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+import sdl2.ext
+
+# LSD package imports
+from .util import *
+from .texture import PlacementSet
+from .text import TextHandle
+from .screen import FrameBuffer, command_bounds, union_bounds
+
+# misc
+import io
+import json
+
+# The LSD.drawing functions whose calls can be recorded
+RECORDABLE_FUNCTIONS = ('circle', 'ellipse', 'arc', 'image', 'circles', 'ellipses',
+	'rects', 'ttf_text')
+
+# Version of the file format written by DisplayList.save()
+DISPLAY_LIST_FORMAT = 1
+
+class DisplayList(object):
+	""" A sequence of drawing operations that is recorded once and can be
+	replayed into any FrameBuffer of the same environment.
+
+	Every recorded drawing function is called once, which validates and
+	converts its arguments and rasterizes its textures, and its result is
+	stored as ready-made draw commands. Replaying the list with
+	FrameBuffer.replay() only submits those commands, so rebuilding an
+	identical display costs a single loop over the operations.
+
+	Lists that only contain drawing function calls and clears can be saved
+	to a JSON file with save() and loaded again with load(), which records
+	the calls anew in the environment it is loaded into.
+
+	Parameters
+	----------
+	sdl2env: SDL2Environment
+		The environment the textures are created in.
+	"""
+
+	def __init__(self, sdl2env=None):
+		self.environment = check_sdl2env(sdl2env)
+		# Description of every operation, from which the list can be saved
+		self._entries = []
+		# The operations as (kind, value, bounds) tuples for FrameBuffer.replay
+		self._operations = []
+		# The handles of the operations, which keep their textures alive
+		self._resources = []
+		# The number of entries that cannot be saved
+		self._unserializable = 0
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __repr__(self):
+		return "DisplayList(operations={}, commands={})".format(len(self),
+			sum(len(value) for kind, value, _ in self._operations
+			if kind == 'copy'))
+
+	@property
+	def serializable(self):
+		""" Whether the list can be saved with save(). """
+		return self._unserializable == 0
+
+	def operations(self):
+		""" Returns the recorded operations as (kind, value, bounds) tuples. """
+		return self._operations
+
+	def clear(self, color=None):
+		""" Records clearing the buffer, with its background color if color is
+		None. """
+		if not color is None:
+			c = sdl2.ext.convert_to_color(color)
+			color = (c.r, c.g, c.b, c.a)
+		self._entries.append(('clear', color))
+		self._operations.append(('clear', color, None))
+		return self
+
+	def draw(self, function, *args, **kwargs):
+		""" Calls a drawing function and records the result at the position
+		it was drawn at.
+
+		Parameters
+		----------
+		function: str or callable
+			One of the functions in RECORDABLE_FUNCTIONS, or its name.
+		args, kwargs:
+			The arguments for the function. The environment of the list is
+			passed as sdl2env.
+
+		Returns
+		-------
+		The TextureHandle, PlacementSet or TextHandle the function returned
+		"""
+		name = getattr(function, '__name__', function)
+		if not name in RECORDABLE_FUNCTIONS:
+			raise ValueError("Cannot record {}; only calls of {} can be "
+				"recorded".format(name, ", ".join(RECORDABLE_FUNCTIONS)))
+		kwargs.pop('sdl2env', None)
+		args = [_freeze(arg) for arg in args]
+		kwargs = dict((key, _freeze(value)) for key, value in kwargs.items())
+
+		from . import drawing
+		result = getattr(drawing, name)(*args, sdl2env=self.environment,
+			**kwargs)
+		self._entries.append(('draw', name, args, kwargs))
+		self._record(result)
+		return result
+
+	def add(self, texture, **kwargs):
+		""" Records a placement like FrameBuffer.add(). Lists with placements
+		of textures that were not drawn by draw() cannot be saved. """
+		self._unserializable += 1
+		self._entries.append(('add', None))
+		self._record_commands([FrameBuffer._placement(texture, **kwargs)],
+			texture)
+		return self
+
+	def add_geometry(self, batch):
+		""" Records drawing a GeometryBatch. The batch is drawn as it is at
+		replay time. Lists with geometry cannot be saved. """
+		self._unserializable += 1
+		self._entries.append(('geometry', None))
+		self._operations.append(('geometry', batch, None))
+		return self
+
+	def save(self, path):
+		""" Writes the recorded operations to a JSON file. """
+		if not self.serializable:
+			raise ValueError("The display list contains placements or geometry "
+				"that cannot be saved")
+		entries = []
+		for entry in self._entries:
+			if entry[0] == 'clear':
+				entries.append({"op": "clear", "color": entry[1]})
+			else:
+				_, name, args, kwargs = entry
+				entries.append({"op": "draw", "function": name,
+					"args": [_encode(arg) for arg in args],
+					"kwargs": dict((key, _encode(value)) for key, value in
+						kwargs.items())})
+		data = {
+			"format": DISPLAY_LIST_FORMAT,
+			"lsd_version": self.environment.lsd_version,
+			"entries": entries,
+		}
+		with io.open(path, 'w', encoding='utf-8') as fp:
+			fp.write(json.dumps(data, ensure_ascii=False))
+		return self
+
+	@classmethod
+	def load(cls, path, sdl2env=None):
+		""" Reads a list written by save() and records it in sdl2env. """
+		with io.open(path, encoding='utf-8') as fp:
+			data = json.load(fp)
+		if data.get("format") != DISPLAY_LIST_FORMAT:
+			raise ValueError("Unsupported display list format: "
+				"{}".format(data.get("format")))
+		display_list = cls(sdl2env)
+		for entry in data["entries"]:
+			if entry["op"] == "clear":
+				display_list.clear(entry["color"])
+			elif entry["op"] == "draw":
+				display_list.draw(entry["function"],
+					*[_decode(arg) for arg in entry["args"]],
+					**dict((str(key), _decode(value)) for key, value in
+						entry["kwargs"].items()))
+			else:
+				raise ValueError("Unknown display list operation: "
+					"{}".format(entry["op"]))
+		return display_list
+
+	def _record(self, result):
+		if isinstance(result, PlacementSet):
+			self._record_commands(result.commands(), result)
+		elif isinstance(result, TextHandle):
+			self._resources.append(result)
+			bounds = (result.x, result.y, result.size[0]+1, result.size[1]+1)
+			self._operations.append(('text', result, bounds))
+		else:
+			self._record_commands([FrameBuffer._placement(result)], result)
+
+	def _record_commands(self, commands, resource):
+		""" Appends draw commands, merging them with the previous operation
+		if that was a copy too, so they are submitted together. """
+		self._resources.append(resource)
+		bounds = union_bounds(command_bounds(command) for command in commands)
+		if self._operations and self._operations[-1][0] == 'copy':
+			_, previous, previous_bounds = self._operations.pop()
+			commands = previous + commands
+			bounds = union_bounds(b for b in (previous_bounds, bounds)
+				if not b is None)
+		self._operations.append(('copy', commands, bounds))
+
+def _freeze(value):
+	""" Copies arrays, so that changing them after recording has no effect. """
+	if not np is None and isinstance(value, np.ndarray):
+		return value.copy()
+	return value
+
+def _encode(value):
+	""" Converts an argument of a drawing function to a JSON value. """
+	if not np is None:
+		if isinstance(value, np.ndarray):
+			return {"ndarray": value.tolist(), "dtype": str(value.dtype)}
+		if isinstance(value, np.generic):
+			return value.item()
+	if isinstance(value, sdl2.ext.Color):
+		return [value.r, value.g, value.b, value.a]
+	if isinstance(value, (list, tuple)):
+		return [_encode(v) for v in value]
+	if value is None or isinstance(value, (bool, int, float, str)):
+		return value
+	try:
+		# Python 2 strings and longs
+		if isinstance(value, (unicode, long)):
+			return value
+	except NameError:
+		pass
+	raise ValueError("Cannot save argument {!r}".format(value))
+
+def _decode(value):
+	if isinstance(value, dict) and "ndarray" in value:
+		require_numpy("DisplayList.load")
+		return np.array(value["ndarray"], dtype=value["dtype"])
+	return value
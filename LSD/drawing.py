@@ -19,13 +19,15 @@ import sdl2.ext
 from sdl2 import sdlgfx
 
 # LSD package imports
-from . import inject_sdl_environment
+from . import inject_sdl_environment, profiling, coverage
 from .util import *
+from .texture import TextureHandle, PlacementSet
+from .vertices import vertex_pointers
+from .text import TextHandle
 
 # misc
 from functools import wraps
 import ctypes
-import time
 
 def check_common_params(func):
 	""" Decorator that type and value checks the most common parameters such as
@@ -33,46 +35,68 @@ def check_common_params(func):
 
 	@wraps(func)
 	def wrapped(*args, **kwargs):
-		# Check if x and y are numeric, if supplied.
-		x = kwargs.get('x', None)
-		y = kwargs.get('y', None)
-		if x: kwargs['x'] = check_int_value(x)
-		if y: kwargs['y'] = check_int_value(y)
-
-		center = kwargs.get('center', None)
-		if center and not bool(center):
-			raise TypeError("Center needs to be a boolean value")
-
-		# Check for invalid penwidth values, and make sure the value is an int
-		penwidth = kwargs.pop('penwidth', None)
-		if penwidth:
-			kwargs['penwidth'] = check_int_value(penwidth, min_value=1, 
-				varname="Penwidth")
-		
-		# Check if sdl2env is passed (implicitly or explicitly)
-		# This function simply raises an error if an sdl2env object hasn't been
-		# passed.
-		check_sdl2env(kwargs.get('sdl2env', None))
-
-		# convert possible opacity values to the right scale
-		opacity = kwargs.pop('opacity', 255)
-		if opacity:
-			kwargs['opacity'] = convert_opacity(opacity)
-		
-		rotation = kwargs.pop('rotation', None)
-		if rotation:
-			kwargs['rotation'] = check_int_value(penwidth, varname="Rotation")
-
-		# Check for the presence of the flip variable
-		kwargs['flip'] = get_sdl_flip_value(kwargs.pop('flip', None))
-
+		kwargs = profiling.timed('validation', _check_common_kwargs, kwargs)
 		return func(*args, **kwargs)
 	return wrapped
 
+def _check_common_kwargs(kwargs):
+	""" Checks and converts the parameters for check_common_params. """
+	# Check if x and y are numeric, if supplied.
+	x = kwargs.get('x', None)
+	y = kwargs.get('y', None)
+	if x: kwargs['x'] = check_int_value(x)
+	if y: kwargs['y'] = check_int_value(y)
+
+	center = kwargs.get('center', None)
+	if center and not bool(center):
+		raise TypeError("Center needs to be a boolean value")
+
+	# Check for invalid penwidth values, and make sure the value is an int
+	penwidth = kwargs.pop('penwidth', None)
+	if penwidth:
+		kwargs['penwidth'] = check_int_value(penwidth, min_value=1, 
+			varname="Penwidth")
+	
+	# Check if sdl2env is passed (implicitly or explicitly)
+	# This function simply raises an error if an sdl2env object hasn't been
+	# passed.
+	check_sdl2env(kwargs.get('sdl2env', None))
+
+	# convert possible opacity values to the right scale
+	opacity = kwargs.pop('opacity', 255)
+	if opacity:
+		kwargs['opacity'] = convert_opacity(opacity)
+	
+	rotation = kwargs.pop('rotation', None)
+	if rotation:
+		kwargs['rotation'] = check_int_value(penwidth, varname="Rotation")
+
+	# Check for the presence of the flip variable
+	kwargs['flip'] = get_sdl_flip_value(kwargs.pop('flip', None))
+	return kwargs
+
+def _shape_texture(sdl2env, key, cache, rasterize, *args):
+	""" Returns the texture stored under key in the shape cache, or creates it
+	by calling rasterize(sdl2env, *args) if it is not there yet. """
+	texture = sdl2env.shape_cache.get(key) if cache else None
+	if texture is None:
+		# Textures rasterized in earlier sessions may be on disk
+		render_cache = sdl2env.render_cache if cache else None
+		if not render_cache is None:
+			texture = profiling.timed('upload', render_cache.load, key)
+		if texture is None:
+			texture = profiling.timed('rasterization', rasterize, sdl2env, 
+				*args)
+			if not render_cache is None:
+				render_cache.store(key, texture)
+		if cache:
+			sdl2env.shape_cache.put(key, texture)
+	return texture
+
 @inject_sdl_environment
 @check_common_params
 def circle(radius, color, x=None, y=None, opacity=1.0, fill=True, aa=False, penwidth=1, 
-	rotation_center=None, rotation=0, flip=None, center=True, **kwargs):
+	rotation_center=None, rotation=0, flip=None, center=True, cache=True, **kwargs):
 	# Make sure all spatial parameters are ints
 	
 	# Check for invalid r values, and make sure the value is an int
@@ -81,12 +105,37 @@ def circle(radius, color, x=None, y=None, opacity=1.0, fill=True, aa=False, penw
 	color = sdl2.ext.convert_to_color(color)
 	
 	sdl2env = kwargs.get('sdl2env')
+
+	# Identical circles share the same texture, so only rasterize if no
+	# texture has been created for these parameters yet.
+	key = ('circle', r, (color.r, color.g, color.b, color.a), opacity, 
+		bool(fill), bool(aa), penwidth)
+	target_texture = _shape_texture(sdl2env, key, cache, _rasterize_circle, r, 
+		color, opacity, fill, aa, penwidth)
+	c_width, c_height = target_texture.size
+
+	# Translate coordinates if circle should be centered
+	if center and x and y:
+		x, y = int(x - c_width/2), int(y - c_height/2) 
+
+	# Return a placement of the (possibly shared) texture
+	return TextureHandle(target_texture, x=x, y=y, opacity=opacity, 
+		center=rotation_center, angle=rotation, flip=flip)
+
+def _rasterize_circle(sdl2env, r, color, opacity, fill, aa, penwidth):
+	""" Draws a circle on a new target texture and returns its sprite. """
 	# alias the sdlrenderer
 	sdlrenderer = sdl2env.renderer.sdlrenderer	
 
 	# Calculate the required dimensions for the target texture
 	outer_r, inner_r = int(r+penwidth*.5), int(r-penwidth*.5)
 
+	# Thick anti-aliased rings are computed from their coverage, with an
+	# extra pixel around them for the anti-aliased edge
+	if aa and not fill and penwidth > 1 and not np is None:
+		size = (2*outer_r+3, 2*outer_r+3)
+		return _rasterize_ring(sdl2env, r, r, penwidth, size, color, opacity)
+
 	# Calculate the required dimensions of the texture we are
 	# going to draw the circle on. Add 1 pixel to account for division
 	# errors (i.e. dividing an odd number of pixels)
@@ -121,14 +170,10 @@ def circle(radius, color, x=None, y=None, opacity=1.0, fill=True, aa=False, penw
 				sdlgfx.circleRGBA(sdlrenderer, r, r, r, color.r, color.g, color.b, 
 					opacity)
 		else:
-			# Create the circle texture, and make sure it can be a rendering
-			# target by setting the correct access flag.
-			circle_sprite = sdl2env.texture_factory.create_software_sprite(
-				size=(c_width, c_height)
-			)
-
-			# Create a renderer to draw to the circle sprite
-			sprite_renderer = sdl2.ext.Renderer(circle_sprite)
+			# Get a recycled surface with a software renderer to draw the 
+			# circle on
+			scratch = sdl2env.resource_pool.acquire_scratch((c_width, c_height))
+			circle_sprite, sprite_renderer = scratch
 
 			# Determine the optimal color key to use for this operation
 			colorkey_color = determine_optimal_colorkey(color)
@@ -156,28 +201,10 @@ def circle(radius, color, x=None, y=None, opacity=1.0, fill=True, aa=False, penw
 						sdlgfx.aacircleRGBA(sprite_renderer.sdlrenderer, outer_r,
 							outer_r, inner_r+i, color.r, color.g, color.b, 255)
 
-			# Optimize drawing of transparent pixels
-			sdl2.SDL_SetSurfaceRLE(circle_sprite.surface, 1)
-
-			# Convert the colorkey to a format understandable by the 
-			# SDL_SetColorKey function
-			colorkey = sdl2.SDL_MapRGB(circle_sprite.surface.format, 
-				colorkey_color.r, colorkey_color.g, colorkey_color.b)
-
-			# Set transparency color key
-			sdl2.SDL_SetColorKey(circle_sprite.surface, sdl2.SDL_TRUE, colorkey)
-
-			# Create a texture from the circle sprite
-			circle_texture = sdl2env.texture_factory.from_surface(
-				circle_sprite.surface
-			)
-			
-			# Perform the blitting operation
-			sdl2env.renderer.copy( circle_texture, dstrect=(0, 0, c_width, c_height))
-
-			# Cleanup
-			del(circle_sprite)
-			del(sprite_renderer)
+			# Copy everything but the colorkey to the target texture
+			_copy_colorkeyed(sdl2env, scratch, (c_width, c_height), 
+				colorkey_color)
+			sdl2env.resource_pool.release_scratch(scratch)
 
 	# Set the desired transparency value to the texture
 	sdl2.SDL_SetTextureAlphaMod(target_texture.texture, opacity)
@@ -187,34 +214,49 @@ def circle(radius, color, x=None, y=None, opacity=1.0, fill=True, aa=False, penw
 	if sdl2.SDL_SetRenderTarget(sdlrenderer, None) != 0:
 		raise Exception("Could not free circle texture as rendering target: "
 			"{}".format(sdl2.SDL_GetError()))
-
-	# Translate coordinates if circle should be centered
-	if center and x and y:
-		x, y = int(x - c_width/2), int(y - c_height/2) 
-
-	# Set the relevant information in the target texture object
-	target_texture.x = x
-	target_texture.y = y
-	target_texture.opacity = opacity
-	target_texture.center = rotation_center
-	target_texture.angle = rotation
-	target_texture.flip = flip
 	return target_texture
 		
 @inject_sdl_environment
 @check_common_params
 def ellipse(x_radius, y_radius, color, x=0, y=0, opacity=1.0, fill=True, aa=False, 
-	penwidth=1, rotation=0, rotation_center=None, flip=None, center=True, **kwargs):
+	penwidth=1, rotation=0, rotation_center=None, flip=None, center=True, cache=True,
+	**kwargs):
 	# Make sure all spatial parameters are ints
 	rx = check_int_value(x_radius, min_value=1, varname="x_radius")
 	ry = check_int_value(y_radius, min_value=1, varname="y_radius")
 
+	color = sdl2.ext.convert_to_color(color)
+
 	sdl2env = kwargs.get('sdl2env')
+
+	# Identical ellipses share the same texture, so only rasterize if no
+	# texture has been created for these parameters yet.
+	key = ('ellipse', rx, ry, (color.r, color.g, color.b, color.a), opacity, 
+		bool(fill), bool(aa), penwidth)
+	target_texture = _shape_texture(sdl2env, key, cache, _rasterize_ellipse, rx, 
+		ry, color, opacity, fill, aa, penwidth)
+	width, height = target_texture.size
+
+	# Translate coordinates if ellipse should be centered
+	if center and x and y:
+		x, y = int(x - width/2), int(y - height/2) 
+
+	# Return a placement of the (possibly shared) texture
+	return TextureHandle(target_texture, x=x, y=y, opacity=opacity, 
+		center=rotation_center, angle=rotation, flip=flip)
+
+def _rasterize_ellipse(sdl2env, rx, ry, color, opacity, fill, aa, penwidth):
+	""" Draws an ellipse on a new target texture and returns its sprite. """
 	# alias the sdlrenderer
 	sdlrenderer = sdl2env.renderer.sdlrenderer	
 
 	width, height = 2*(rx+penwidth)+1, 2*(ry+penwidth)+1
 
+	# Thick anti-aliased rings are computed from their coverage
+	if aa and not fill and penwidth > 1 and not np is None:
+		return _rasterize_ring(sdl2env, rx, ry, penwidth, (width, height),
+			color, opacity)
+
 	# Create the target texture
 	target_texture = sdl2env.texture_factory.create_sprite(
 		size=(width, height),
@@ -226,8 +268,6 @@ def ellipse(x_radius, y_radius, color, x=0, y=0, opacity=1.0, fill=True, aa=Fals
 		raise Exception("Could not set circle texture as rendering target: "
 			"{}".format(sdl2.SDL_GetError()))
 
-	color = sdl2.ext.convert_to_color(color)
-
 	start_rx = rx - int(penwidth/2)
 	start_ry = ry - int(penwidth/2)
 	if start_rx < 1 or start_ry < 1:
@@ -245,13 +285,10 @@ def ellipse(x_radius, y_radius, color, x=0, y=0, opacity=1.0, fill=True, aa=Fals
 		else:
 			sdlgfx.ellipseRGBA(sdlrenderer, rx, ry, rx, ry, color.r, color.g, color.b, opacity)
 	else:
-		# Create the circle texture, and make sure it can be a rendering
-		# target by setting the correct access flag.
-		ellipse_sprite = sdl2env.texture_factory.create_software_sprite(
-			size=(width, height),
-		)
-		# Create a renderer to draw to the circle sprite
-		sprite_renderer = sdl2.ext.Renderer(ellipse_sprite)
+		# Get a recycled surface with a software renderer to draw the 
+		# ellipse on
+		scratch = sdl2env.resource_pool.acquire_scratch((width, height))
+		ellipse_sprite, sprite_renderer = scratch
 
 		# Determine the optimal color key to use for this operation
 		colorkey_color = determine_optimal_colorkey(color)
@@ -283,52 +320,249 @@ def ellipse(x_radius, y_radius, color, x=0, y=0, opacity=1.0, fill=True, aa=Fals
 						ry+penwidth, rx-int(penwidth/2)+i, ry-int(penwidth/2)+i, 
 						color.r, color.g, color.b, opacity)
 		
-		# Optimize drawing of transparent pixels
-		sdl2.SDL_SetSurfaceRLE(ellipse_sprite.surface, 1)
+		# Copy everything but the colorkey to the target texture
+		_copy_colorkeyed(sdl2env, scratch, (width, height), colorkey_color)
+		sdl2env.resource_pool.release_scratch(scratch)
 
-		# Convert the colorkey to a format understandable by the 
-		# SDL_SetColorKey function
-		colorkey = sdl2.SDL_MapRGB(ellipse_sprite.surface.format, 
-			colorkey_color.r, colorkey_color.g, colorkey_color.b)
+		# Set the desired transparency value to the texture
+	sdl2.SDL_SetTextureAlphaMod(target_texture.texture, opacity)
+	sdl2.SDL_SetTextureBlendMode(target_texture.texture, sdl2.SDL_BLENDMODE_BLEND)
 
-		# Set transparency color key
-		sdl2.SDL_SetColorKey(ellipse_sprite.surface, sdl2.SDL_TRUE, colorkey)
+	# Free texture as render target
+	if sdl2.SDL_SetRenderTarget(sdlrenderer, None) != 0:
+		raise Exception("Could not free circle texture as rendering target: "
+			"{}".format(sdl2.SDL_GetError()))
+	return target_texture
 
-		# Create a texture from the circle sprite
-		ellipse_tex = sdl2env.texture_factory.from_surface(
-			ellipse_sprite.surface
-		)
+def _rasterize_ring(sdl2env, rx, ry, penwidth, size, color, opacity, start=0,
+	end=360, aa=True):
+	""" Creates a texture with an anti-aliased ring (or arc) from its coverage
+	mask, centered in a texture of size. Masks do not depend on the color, so
+	they are kept in the environment's mask cache. """
+	key = (rx, ry, penwidth, tuple(size), start, end, bool(aa))
+	alpha = sdl2env.mask_cache.get(key)
+	if alpha is None:
+		alpha = coverage.ring_coverage(rx, ry, penwidth, size, 
+			(size[0]//2, size[1]//2), start, end, aa)
+		sdl2env.mask_cache.put(key, alpha, alpha.nbytes)
 
-		sdl2env.renderer.copy( ellipse_tex, dstrect=(0, 0, width, height))
+	target_texture = sdl2env.texture_factory.create_sprite(
+		size=size,
+		pformat=sdl2.SDL_PIXELFORMAT_RGBA32,
+		access=sdl2.SDL_TEXTUREACCESS_TARGET
+	)
+	profiling.timed('upload', _upload_pixels, target_texture, 
+		coverage.colorize(alpha, color))
+	sdl2.SDL_SetTextureAlphaMod(target_texture.texture, opacity)
+	sdl2.SDL_SetTextureBlendMode(target_texture.texture, sdl2.SDL_BLENDMODE_BLEND)
+	return target_texture
 
-		# Cleanup
-		del(ellipse_sprite)
-		del(sprite_renderer)
+def _copy_colorkeyed(sdl2env, scratch, size, colorkey_color):
+	""" Copies a scratch surface to the current render target, leaving out the
+	pixels that have colorkey_color. The pixels go through a surface and a 
+	texture from the resource pool, instead of a new texture every time. """
+	sprite, sprite_renderer = scratch
+	# The renderer is reused, so make sure it has drawn everything
+	sdl2.SDL_RenderFlush(sprite_renderer.sdlrenderer)
+	surface = sprite.surface
+	rect = sdl2.SDL_Rect(0, 0, size[0], size[1])
+
+	# Optimize drawing of transparent pixels
+	sdl2.SDL_SetSurfaceRLE(surface, 1)
+	# Convert the colorkey to a format understandable by the SDL_SetColorKey
+	# function and set it as transparency color key
+	colorkey = sdl2.SDL_MapRGB(surface.format, colorkey_color.r, 
+		colorkey_color.g, colorkey_color.b)
+	sdl2.SDL_SetColorKey(surface, sdl2.SDL_TRUE, colorkey)
+
+	# Blitting to a cleared surface with an alpha channel turns the colorkey
+	# into transparent pixels
+	pool = sdl2env.resource_pool
+	converted = pool.acquire_surface(size, sdl2.SDL_PIXELFORMAT_ARGB8888, 
+		round_up=True)
+	texture = pool.acquire_texture(size, sdl2.SDL_PIXELFORMAT_ARGB8888, 
+		round_up=True)
+	try:
+		sdl2.SDL_FillRect(converted.surface, rect, 0)
+		if sdl2.SDL_BlitSurface(surface, rect, converted.surface, None) != 0:
+			raise Exception("Could not blit shape surface: "
+				"{}".format(sdl2.SDL_GetError()))
+		if sdl2.SDL_UpdateTexture(texture.texture, rect, 
+			converted.surface.pixels, converted.surface.pitch) != 0:
+			raise Exception("Could not upload shape surface: "
+				"{}".format(sdl2.SDL_GetError()))
+		sdl2env.renderer.copy(texture, srcrect=(0, 0) + tuple(size), 
+			dstrect=(0, 0) + tuple(size))
+	finally:
+		pool.release_surface(converted)
+		pool.release_texture(texture)
+
+def _rasterize_rect(sdl2env, w, h, color, opacity, fill, penwidth):
+	""" Draws a rectangle on a new target texture and returns its sprite. """
+	# alias the sdlrenderer
+	sdlrenderer = sdl2env.renderer.sdlrenderer	
 
-		# Set the desired transparency value to the texture
+	if not fill and 2*penwidth > min(w, h):
+		raise ValueError("Penwidth to large for a rect with these dimensions")
+
+	# Create the target texture
+	target_texture = sdl2env.texture_factory.create_sprite(
+		size=(w, h),
+		access=sdl2.SDL_TEXTUREACCESS_TARGET
+	)
+
+	# Set target texture as render target (from now on sdlrenderer draws on this texture)
+	if sdl2.SDL_SetRenderTarget(sdlrenderer, target_texture.texture) != 0:
+		raise Exception("Could not set rect texture as rendering target: "
+			"{}".format(sdl2.SDL_GetError()))
+
+	if fill:
+		sdlgfx.boxRGBA(sdlrenderer, 0, 0, w-1, h-1, color.r, color.g, color.b, 
+			opacity)
+	else:
+		# Draw the border inwards, one pixel wide rectangle at a time
+		for i in range(penwidth):
+			sdlgfx.rectangleRGBA(sdlrenderer, i, i, w-1-i, h-1-i, color.r, 
+				color.g, color.b, opacity)
+
+	# Set the desired transparency value to the texture
 	sdl2.SDL_SetTextureAlphaMod(target_texture.texture, opacity)
 	sdl2.SDL_SetTextureBlendMode(target_texture.texture, sdl2.SDL_BLENDMODE_BLEND)
 
 	# Free texture as render target
 	if sdl2.SDL_SetRenderTarget(sdlrenderer, None) != 0:
-		raise Exception("Could not free circle texture as rendering target: "
+		raise Exception("Could not free rect texture as rendering target: "
 			"{}".format(sdl2.SDL_GetError()))
+	return target_texture
 
-	# Translate coordinates if circle should be centered
-	if center and x and y:
-		x, y = int(x - width/2), int(y - height/2) 
+def _batch_placements(params, xs, ys, opacity, center, make_texture):
+	""" Rasterizes every distinct row of params once with make_texture and 
+	returns the PlacementSet for all items. """
+	unique, index = np.unique(params, axis=0, return_inverse=True)
+	index = index.reshape(-1)
+	sprites = [make_texture([int(v) for v in row]) for row in unique]
+	if center and len(sprites):
+		sizes = np.array([sprite.size for sprite in sprites], dtype=np.int64)
+		xs = np.trunc(xs - sizes[index, 0]/2).astype(np.int64)
+		ys = np.trunc(ys - sizes[index, 1]/2).astype(np.int64)
+	return PlacementSet(sprites, index, xs, ys, opacity)
+
+def _check_batch_params(xs, ys, colors, opacity, penwidth):
+	""" Validates and converts the parameters shared by the batch functions. """
+	n = len(xs)
+	xs = check_int_array(xs, n, varname="x")
+	ys = check_int_array(ys, n, varname="y")
+	colors = convert_to_colors(colors, n)
+	opacity = convert_opacities(opacity, n)
+	penwidth = check_int_value(penwidth, min_value=1, varname="Penwidth")
+	return n, xs, ys, colors, opacity, penwidth
 
-	# Set the relevant information in the target texture object
-	target_texture.x = x
-	target_texture.y = y
-	target_texture.opacity = opacity
-	target_texture.center = rotation_center
-	target_texture.angle = rotation
-	target_texture.flip = flip
-	return target_texture
+@inject_sdl_environment
+def circles(xs, ys, radii, colors, opacity=1.0, fill=True, aa=False, penwidth=1,
+	center=True, cache=True, **kwargs):
+	""" Draws many circles at once.
+
+	All array parameters are validated and converted in one vectorized pass,
+	and every distinct combination of radius, color and opacity is only
+	rasterized once.
+
+	Parameters
+	----------
+	xs, ys: sequence or numpy.ndarray
+		The coordinates of the circles.
+	radii: int, sequence or numpy.ndarray
+		The radius of every circle, or one radius for all circles.
+	colors: color, sequence of colors or numpy.ndarray
+		One color for all circles, a color per circle, or an (n, 3) or (n, 4)
+		array with RGB(A) values.
+	opacity: float, int or numpy.ndarray, optional
+		One opacity value for all circles, or one per circle.
+
+	The other parameters have the same meaning as in circle().
+
+	Returns
+	-------
+	PlacementSet: the placements, to be passed to FrameBuffer.add_placements()
+	"""
+	require_numpy("drawing.circles")
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	n, xs, ys, colors, opacity, penwidth = profiling.timed('validation',
+		_check_batch_params, xs, ys, colors, opacity, penwidth)
+	radii = check_int_array(radii, n, min_value=1, varname="radius")
+
+	def make_texture(row):
+		r, color, op = row[0], sdl2.ext.Color(*row[1:5]), row[5]
+		key = ('circle', r, tuple(row[1:5]), op, bool(fill), bool(aa), penwidth)
+		return _shape_texture(sdl2env, key, cache, _rasterize_circle, r, color, 
+			op, fill, aa, penwidth)
+
+	params = np.column_stack((radii, colors, opacity))
+	return _batch_placements(params, xs, ys, opacity, center, make_texture)
+
+@inject_sdl_environment
+def ellipses(xs, ys, x_radii, y_radii, colors, opacity=1.0, fill=True, aa=False,
+	penwidth=1, center=True, cache=True, **kwargs):
+	""" Draws many ellipses at once.
+
+	See circles() for a description of the parameters; x_radii and y_radii
+	can both be a single value or contain a radius per ellipse.
+
+	Returns
+	-------
+	PlacementSet: the placements, to be passed to FrameBuffer.add_placements()
+	"""
+	require_numpy("drawing.ellipses")
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	n, xs, ys, colors, opacity, penwidth = profiling.timed('validation',
+		_check_batch_params, xs, ys, colors, opacity, penwidth)
+	x_radii = check_int_array(x_radii, n, min_value=1, varname="x_radius")
+	y_radii = check_int_array(y_radii, n, min_value=1, varname="y_radius")
+
+	def make_texture(row):
+		rx, ry, color, op = row[0], row[1], sdl2.ext.Color(*row[2:6]), row[6]
+		key = ('ellipse', rx, ry, tuple(row[2:6]), op, bool(fill), bool(aa), 
+			penwidth)
+		return _shape_texture(sdl2env, key, cache, _rasterize_ellipse, rx, ry, 
+			color, op, fill, aa, penwidth)
+
+	params = np.column_stack((x_radii, y_radii, colors, opacity))
+	return _batch_placements(params, xs, ys, opacity, center, make_texture)
 
 @inject_sdl_environment
-def rect(x, y, w, h, color, opacity=1.0, fill=True, border_radius=0, penwidth=1):
+def rects(xs, ys, widths, heights, colors, opacity=1.0, fill=True, penwidth=1,
+	center=False, cache=True, **kwargs):
+	""" Draws many rectangles at once.
+
+	See circles() for a description of the parameters; widths and heights
+	can both be a single value or contain a value per rectangle. Unlike the
+	circles and ellipses, the rectangles are positioned by their top left
+	corner unless center is True.
+
+	Returns
+	-------
+	PlacementSet: the placements, to be passed to FrameBuffer.add_placements()
+	"""
+	require_numpy("drawing.rects")
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	n, xs, ys, colors, opacity, penwidth = profiling.timed('validation',
+		_check_batch_params, xs, ys, colors, opacity, penwidth)
+	widths = check_int_array(widths, n, min_value=1, varname="width")
+	heights = check_int_array(heights, n, min_value=1, varname="height")
+
+	def make_texture(row):
+		w, h, color, op = row[0], row[1], sdl2.ext.Color(*row[2:6]), row[6]
+		key = ('rect', w, h, tuple(row[2:6]), op, bool(fill), penwidth)
+		return _shape_texture(sdl2env, key, cache, _rasterize_rect, w, h, color,
+			op, fill, penwidth)
+
+	params = np.column_stack((widths, heights, colors, opacity))
+	return _batch_placements(params, xs, ys, opacity, center, make_texture)
+
+@inject_sdl_environment
+def rect(x, y, w, h, color, opacity=1.0, fill=True, border_radius=0, penwidth=1,
+		**kwargs):
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	sdlrenderer = sdl2env.renderer.sdlrenderer
 	# Make sure all spatial parameters are ints
 	x, y, w, h = map(int, (x, y, w, h))
 
@@ -351,7 +585,7 @@ def rect(x, y, w, h, color, opacity=1.0, fill=True, border_radius=0, penwidth=1)
 		y_s = range(start_y,start_y+penwidth)
 		w_s = range(start_w+2*penwidth, start_w, -2)
 		h_s = range(start_h+2*penwidth, start_h, -2)
-		rects = zip(x_s,y_s,w_s,h_s)
+		rects = list(zip(x_s,y_s,w_s,h_s))
 	else:
 		rects = [(x,y,w,h)]
 
@@ -370,10 +604,11 @@ def rect(x, y, w, h, color, opacity=1.0, fill=True, border_radius=0, penwidth=1)
 			else:
 				sdl2.sdlgfx.rectangleRGBA(sdlrenderer, x, y, x+w, y+h, 
 					color.r, color.g, color.b, int(opacity*255))
-	return self
 
 @inject_sdl_environment
-def line(x1, y1, x2, y2, color, opacity=1.0, aa=False, width=1):
+def line(x1, y1, x2, y2, color, opacity=1.0, aa=False, width=1, **kwargs):
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	sdlrenderer = sdl2env.renderer.sdlrenderer
 	# Make sure all spatial parameters are ints
 	x1, y1, x2, y2 = map(int, (x1, y1, x2, y2))
 
@@ -382,91 +617,134 @@ def line(x1, y1, x2, y2, color, opacity=1.0, aa=False, width=1):
 		raise ValueError("Line width cannot be smaller than 1px")
 
 	if width > 1:
-		return sdl2.sdlgfx.thickLineRGBA(self.sdl_renderer, x1, y1, x2, y2, 
+		return sdl2.sdlgfx.thickLineRGBA(sdlrenderer, x1, y1, x2, y2, 
 			width, color.r, color.g, color.b, int(opacity*255))
 	if not aa:
-		return sdl2.sdlgfx.lineRGBA(self.sdl_renderer, x1, y1, x2, y2, 
+		return sdl2.sdlgfx.lineRGBA(sdlrenderer, x1, y1, x2, y2, 
 			color.r, color.g, color.b, int(opacity*255))
 	else:
-		return sdl2.sdlgfx.aalineRGBA(self.sdl_renderer, x1, y1, x2, y2, 
+		return sdl2.sdlgfx.aalineRGBA(sdlrenderer, x1, y1, x2, y2, 
 			color.r, color.g, color.b, int(opacity*255))
 
 @inject_sdl_environment
-def text(x, y, text, color, opacity=1.0):
+def text(x, y, text, color, opacity=1.0, **kwargs):
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	sdlrenderer = sdl2env.renderer.sdlrenderer
 	# Make sure all spatial parameters are ints
 	x,y = int(x), int(y)
 
 	# Make sure the passed text is of type 'bytes'
 	text = sdl2.ext.compat.byteify(text, 'utf8')
-	print(text)
 
 	color = sdl2.ext.convert_to_color(color)
-	sdl2.sdlgfx.stringRGBA(self.sdl_renderer, x, y, text, color.r, color.g, color.b, self.opacity(opacity))
-	return self
+	sdl2.sdlgfx.stringRGBA(sdlrenderer, x, y, text, color.r, color.g, color.b, int(opacity*255))
 
 @inject_sdl_environment
-def arc(x, y, r, start, end, color, opacity=1.0, penwidth=1):
-	# Make sure all spatial parameters are ints
-	x, y, r = map(int, (x, y, r))
+def ttf_text(text, font_path, size, color, x=0, y=0, opacity=1.0, wrap_width=None,
+	**kwargs):
+	""" Lays out text in a TrueType font.
+
+	Glyphs are rasterized once per font and size into a glyph atlas, and the
+	layout of every (text, wrap_width) is cached, so drawing the same text 
+	again does not rasterize anything.
+
+	Parameters
+	----------
+	text: str
+		The text. Newlines start a new line.
+	font_path: str
+		The path to the TrueType font file.
+	size: int
+		The point size.
+	wrap_width: int, optional
+		Break lines between words so they are not wider than this.
+
+	Returns
+	-------
+	TextHandle: the text at (x, y), to be passed to FrameBuffer.add_text()
+	"""
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	# Only opacity sets the transparency, as RGB colors get an alpha of 0
+	color = sdl2.ext.convert_to_color(color)
+	alpha = convert_opacity(opacity)
+	layout = sdl2env.font(font_path, size).layout(text, wrap_width)
+	return TextHandle(layout, check_int_value(x), check_int_value(y), 
+		(color.r, color.g, color.b, alpha))
 
+@inject_sdl_environment
+@check_common_params
+def arc(x, y, r, start, end, color, opacity=1.0, penwidth=1, aa=False, 
+	cache=True, **kwargs):
+	""" Draws an arc of a circle with radius r around (x, y), from start to end
+	(degrees, clockwise from the positive x-axis).
+
+	Returns
+	-------
+	TextureHandle: placement of the arc's texture
+	"""
+	require_numpy("drawing.arc")
+	r = check_int_value(r, min_value=1, varname="r")
+	start, end = float(start), float(end)
 	color = sdl2.ext.convert_to_color(color)
-	if penwidth != 1:
-		if penwidth < 1:
-			raise ValueError("Penwidth cannot be smaller than 1")
-		if penwidth > 1:
-			penwidth = int(penwidth)
-		start_r = r - int(penwidth/2)
-		if start_r < 1:
-			raise ValueError("Penwidth to large for a circle with this radius")
-		r_s = range(start_r,start_r+penwidth)
-	else:
-		r_s = [r]
 
-	if not r_s is None:
-		for r in r_s:
-			sdl2.sdlgfx.arcRGBA(self.sdl_renderer, x, y, r, start, end,  color.r, color.g, color.b, int(opacity*255))
-	return self
+	sdl2env = kwargs.get('sdl2env')
+
+	key = ('arc', r, start, end, (color.r, color.g, color.b, color.a), opacity,
+		bool(aa), penwidth)
+	target_texture = _shape_texture(sdl2env, key, cache, _rasterize_arc, r,
+		start, end, color, opacity, aa, penwidth)
+	width, height = target_texture.size
+	return TextureHandle(target_texture, x=int(x) - width//2, 
+		y=int(y) - height//2, opacity=opacity)
+
+def _rasterize_arc(sdl2env, r, start, end, color, opacity, aa, penwidth):
+	""" Creates a texture with an arc from its coverage mask. """
+	size = 2*int(r + penwidth*.5) + 3
+	return _rasterize_ring(sdl2env, r, r, penwidth, (size, size), color, 
+		opacity, start, end, aa)
 
 @inject_sdl_environment
-def pie(x, y, r, start, end, color, opacity=1.0, fill=True):
+def pie(x, y, r, start, end, color, opacity=1.0, fill=True, **kwargs):
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	sdlrenderer = sdl2env.renderer.sdlrenderer
 	# Make sure all spatial parameters are ints
 	x, y, r = map(int, (x, y, r))
 
 	color = sdl2.ext.convert_to_color(color)
 	if fill:
-		return sdl2.sdlgfx.filledPieRGBA(self.sdl_renderer, x, y, r, start, end, color.r, color.g, color.b, int(opacity*255))
+		return sdl2.sdlgfx.filledPieRGBA(sdlrenderer, x, y, r, start, end, color.r, color.g, color.b, int(opacity*255))
 	else:
-		return sdl2.sdlgfx.pieRGBA(self.sdl_renderer, x, y, r, start, end, color.r, color.g, color.b, int(opacity*255))
-	return self
+		return sdl2.sdlgfx.pieRGBA(sdlrenderer, x, y, r, start, end, color.r, color.g, color.b, int(opacity*255))
 
 @inject_sdl_environment
-def trigon(x1, y1, x2, y2, x3, y3, color, opacity=1.0, fill=True, aa=False):
+def trigon(x1, y1, x2, y2, x3, y3, color, opacity=1.0, fill=True, aa=False,
+		**kwargs):
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	sdlrenderer = sdl2env.renderer.sdlrenderer
 	# Make sure all spatial parameters are ints
 	x1, y1, x2, y2, x3, y3 = map(int, (x1, y1, x2, y2, x3, y3))
 
 	color = sdl2.ext.convert_to_color(color)
 	if fill:
-		return sdl2.sdlgfx.filledTrigonRGBA(self.sdl_renderer, x1, y1, x2, y2, x3, y3, color.r, color.g, color.b, int(opacity*255))
+		return sdl2.sdlgfx.filledTrigonRGBA(sdlrenderer, x1, y1, x2, y2, x3, y3, color.r, color.g, color.b, int(opacity*255))
 	elif aa:
-		return sdl2.sdlgfx.aatrigonRGBA(self.sdl_renderer, x1, y1, x2, y2, x3, y3, color.r, color.g, color.b, int(opacity*255))
+		return sdl2.sdlgfx.aatrigonRGBA(sdlrenderer, x1, y1, x2, y2, x3, y3, color.r, color.g, color.b, int(opacity*255))
 	else:
-		return sdl2.sdlgfx.trigonRGBA(self.sdl_renderer, x1, y1, x2, y2, x3, y3, color.r, color.g, color.b, int(opacity*255))
-	return self
+		return sdl2.sdlgfx.trigonRGBA(sdlrenderer, x1, y1, x2, y2, x3, y3, color.r, color.g, color.b, int(opacity*255))
 
 @inject_sdl_environment
-def polygon(vx, vy, color, opacity=1.0, fill=True, aa=False, texture=None):
+def polygon(vx, vy, color, opacity=1.0, fill=True, aa=False, texture=None, 
+	cache=True, **kwargs):
+	""" Draws a polygon on the current render target.
+
+	vx and vy can be sequences or NumPy arrays (C-contiguous int16 arrays are
+	passed to sdlgfx without copying). Alternatively, pass a VertexBuffer as
+	vx and None as vy.
+	"""
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	sdlrenderer = sdl2env.renderer.sdlrenderer
 	color = sdl2.ext.convert_to_color(color)
-	if len(vx) != len(vy):
-		raise ValueError('vx and vy do not have the same number of items')
-	n = len(vx)
-
-	# Make sure all coordinates are integers
-	vx = map(int,vx)
-	vy = map(int,vy)
-	# Cast the list to the appropriate ctypes vectors readable by
-	# the polygon functions
-	vx = ctypes.cast((sdl2.Sint16*n)(*vx), ctypes.POINTER(sdl2.Sint16))
-	vy = ctypes.cast((sdl2.Sint16*n)(*vy), ctypes.POINTER(sdl2.Sint16))
+	vx, vy, n, vertices = vertex_pointers(vx, vy)
 
 	if not texture is None:
 		if type(texture) == tuple and len(texture) == 3:
@@ -474,39 +752,126 @@ def polygon(vx, vy, color, opacity=1.0, fill=True, aa=False, texture=None):
 		if type(texture) == str:
 			img = texture
 			offset_x = offset_y = 0
-		sprite = self.environment.surface_factory.from_image(img)
-		sdl2.sdlgfx.texturedPolygon(self.sdl_renderer, vx, vy, n, sprite.surface, offset_x, offset_y)
+		# Only decode the image if it is not in the cache yet
+		if cache:
+			sprite = sdl2env.image_cache.surface(img)
+		else:
+			sprite = sdl2env.surface_factory.from_image(img)
+		sdl2.sdlgfx.texturedPolygon(sdlrenderer, vx, vy, n, sprite.surface, offset_x, offset_y)
 	elif fill:
-		sdl2.sdlgfx.filledPolygonRGBA(self.sdl_renderer, vx, vy, n, color.r, color.g, color.b, int(opacity*255))
+		sdl2.sdlgfx.filledPolygonRGBA(sdlrenderer, vx, vy, n, color.r, color.g, color.b, int(opacity*255))
 	elif aa:
-		sdl2.sdlgfx.aapolygonRGBA(self.sdl_renderer, vx, vy, n, color.r, color.g, color.b, int(opacity*255))
+		sdl2.sdlgfx.aapolygonRGBA(sdlrenderer, vx, vy, n, color.r, color.g, color.b, int(opacity*255))
 	else:
-		sdl2.sdlgfx.polygonRGBA(self.sdl_renderer, vx, vy, n, color.r, color.g, color.b, int(opacity*255))
-	return self
+		sdl2.sdlgfx.polygonRGBA(sdlrenderer, vx, vy, n, color.r, color.g, color.b, int(opacity*255))
 
 @inject_sdl_environment
-def bezier_curve(vx, vy, s, color, opacity=1.0):
+def bezier_curve(vx, vy, s, color, opacity=1.0, **kwargs):
+	""" Draws a bezier curve through the control points on the current render
+	target. The control points are accepted in the same forms as by polygon().
+	"""
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
 	color = sdl2.ext.convert_to_color(color)
-	if len(vx) != len(vy):
-		raise ValueError('vx and vy do not have the same number of items')
-	n = len(vx)
-
-	# Make sure all coordinates are integers
-	vx = map(int,vx)
-	vy = map(int,vy)
-	# Cast the list to the appropriate ctypes vectors readable by
-	# the polygon functions
-	vx = ctypes.cast((sdl2.Sint16*n)(*vx), ctypes.POINTER(sdl2.Sint16))
-	vy = ctypes.cast((sdl2.Sint16*n)(*vy), ctypes.POINTER(sdl2.Sint16))
+	vx, vy, n, vertices = vertex_pointers(vx, vy)
 
-	sdl2.sdlgfx.bezierRGBA(self.sdl_renderer, vx, vy, n, s, color.r, color.g, color.b, int(opacity*255))
-	return self
+	sdl2.sdlgfx.bezierRGBA(sdl2env.renderer.sdlrenderer, vx, vy, n, s, color.r, color.g, color.b, int(opacity*255))
 
 @inject_sdl_environment
-def image(x, y, image_path):
+def image(x, y, image_path, opacity=1.0, cache=True, **kwargs):
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
 	x,y = int(x), int(y)
 
-	image = self.environment.texture_factory.from_image(image_path)
-	image.position = (x,y)
-	self.spriterenderer.render(image)
-	return self
+	# Only read and decode the image if it is not in the cache yet
+	if cache:
+		image = sdl2env.image_cache.texture(image_path)
+	else:
+		image = sdl2env.texture_factory.from_image(image_path)
+	return TextureHandle(image, x=x, y=y, opacity=convert_opacity(opacity))
+
+@inject_sdl_environment
+def array(pixels, x=0, y=0, opacity=1.0, reuse=True, **kwargs):
+	""" Uploads a NumPy array of pixels to a texture.
+
+	RGBA and RGB arrays are handed to SDL_UpdateTexture as they are, without
+	any copies on the Python side (as long as they are C-contiguous).
+	Grayscale arrays are expanded to RGBA directly into the locked texture
+	memory.
+
+	Parameters
+	----------
+	pixels: numpy.ndarray
+		A uint8 array with shape (height, width, 4) (RGBA), (height, width, 3)
+		(RGB) or (height, width) (grayscale).
+	reuse: bool, optional
+		Upload into the persistent streaming texture that the environment 
+		keeps for arrays of this size and format, so that showing a new 
+		array every frame does not allocate a new texture. The contents of
+		the returned handle are then replaced by the next array of the same
+		size and format that is uploaded; pass False to get a texture of its 
+		own.
+
+	Returns
+	-------
+	TextureHandle: placement of the texture at (x, y)
+	"""
+	require_numpy("drawing.array")
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	x, y = int(x), int(y)
+
+	if not isinstance(pixels, np.ndarray) or pixels.dtype != np.uint8:
+		raise TypeError("pixels needs to be a uint8 NumPy array")
+	if pixels.ndim == 2 or (pixels.ndim == 3 and pixels.shape[2] == 4):
+		pformat = sdl2.SDL_PIXELFORMAT_RGBA32
+	elif pixels.ndim == 3 and pixels.shape[2] == 3:
+		pformat = sdl2.SDL_PIXELFORMAT_RGB24
+	else:
+		raise ValueError("pixels needs to have shape (h, w), (h, w, 3) or "
+			"(h, w, 4)")
+	height, width = pixels.shape[:2]
+
+	if reuse:
+		sprite = sdl2env.streaming_texture((width, height), pformat)
+	else:
+		sprite = _create_streaming_texture(sdl2env, (width, height), pformat)
+
+	if pixels.ndim == 2:
+		profiling.timed('upload', _upload_grayscale, sprite, pixels)
+	else:
+		# Rows may be padded, but the pixels within a row need to be adjacent
+		if pixels.strides[1:] != (pixels.shape[2], 1):
+			pixels = np.ascontiguousarray(pixels)
+		profiling.timed('upload', _upload_pixels, sprite, pixels)
+	return TextureHandle(sprite, x=x, y=y, opacity=convert_opacity(opacity))
+
+def _create_streaming_texture(sdl2env, size, pformat):
+	""" Creates a texture that can be updated every frame. """
+	sprite = sdl2env.texture_factory.create_sprite(
+		size=size,
+		pformat=pformat,
+		access=sdl2.SDL_TEXTUREACCESS_STREAMING
+	)
+	sdl2.SDL_SetTextureBlendMode(sprite.texture, sdl2.SDL_BLENDMODE_BLEND)
+	return sprite
+
+def _upload_pixels(sprite, pixels):
+	""" Copies an RGBA or RGB array into a texture. """
+	if sdl2.SDL_UpdateTexture(sprite.texture, None, 
+		ctypes.c_void_p(pixels.ctypes.data), pixels.strides[0]) != 0:
+		raise Exception("Could not upload array to texture: "
+			"{}".format(sdl2.SDL_GetError()))
+
+def _upload_grayscale(sprite, pixels):
+	""" Writes a grayscale array as RGBA pixels into a locked texture. """
+	height, width = pixels.shape
+	data, pitch = ctypes.c_void_p(), ctypes.c_int()
+	if sdl2.SDL_LockTexture(sprite.texture, None, ctypes.byref(data), 
+		ctypes.byref(pitch)) != 0:
+		raise Exception("Could not lock texture: {}".format(sdl2.SDL_GetError()))
+	try:
+		buf = (ctypes.c_uint8*(pitch.value*height)).from_address(data.value)
+		target = np.frombuffer(buf, dtype=np.uint8).reshape(height, 
+			pitch.value)[:, :width*4].reshape(height, width, 4)
+		target[..., :3] = pixels[..., np.newaxis]
+		target[..., 3] = 255
+	finally:
+		sdl2.SDL_UnlockTexture(sprite.texture)
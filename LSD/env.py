@@ -1,35 +1,147 @@
 import sdl2
+from .cache import TextureCache, ImageCache, DEFAULT_SHAPE_CACHE_SIZE, \
+	DEFAULT_IMAGE_CACHE_SIZE, DEFAULT_MESH_CACHE_SIZE, DEFAULT_MASK_CACHE_SIZE, \
+	DEFAULT_STIMULUS_CACHE_SIZE
+from .atlas import TextureAtlas
+from .resources import ResourcePool, ResourceTracker, TrackingSpriteFactory
+import warnings
+import weakref
+
+class cached_property(object):
+	""" A read-only property that is computed on first access and then
+	stored in the instance, so later accesses are plain attribute lookups. """
+
+	def __init__(self, function):
+		self.function = function
+		self.__doc__ = function.__doc__
+
+	def __get__(self, instance, owner):
+		if instance is None:
+			return self
+		value = self.function(instance)
+		instance.__dict__[self.function.__name__] = value
+		return value
+
+def _is_software_renderer(renderer):
+	info = sdl2.SDL_RendererInfo()
+	if sdl2.SDL_GetRendererInfo(renderer.sdlrenderer, info) != 0:
+		return False
+	return bool(info.flags & sdl2.SDL_RENDERER_SOFTWARE)
+
+def _free_pooled_textures(tracker, excess):
+	tracker.environment.resource_pool.clear()
+
+def _trim_shape_cache(tracker, excess):
+	tracker.environment.shape_cache.trim(excess)
+
+def _trim_image_textures(tracker, excess):
+	tracker.environment.image_cache.textures.trim(excess)
 
 class SDL2Environment(object):
 
-	def __init__(self, window, resolution, renderer, texture_factory, surface_factory, lsd_version):
+	# Whether the environment renders offscreen
+	headless = False
+
+	def __init__(self, window, resolution, renderer, texture_factory, surface_factory, lsd_version,
+		shape_cache_size=DEFAULT_SHAPE_CACHE_SIZE, image_cache_size=DEFAULT_IMAGE_CACHE_SIZE):
 		self.window = window
 		self.resolution = resolution
 		self.renderer = renderer
 		self.texture_factory = texture_factory
 		self.surface_factory = surface_factory
-		self.active_framebuffers = []
+		# The FrameBuffers that have not been collected or released yet
+		self.active_framebuffers = weakref.WeakSet()
 		self.lsd_version = lsd_version
 
-		# Get the rest of the info by quering SDL2 itself
-		# Only for screen 1 for now
+		# Cache for the textures of rasterized shapes (circles, ellipses)
+		self.shape_cache = TextureCache(shape_cache_size)
+		# Cache for the triangle meshes of tessellated shapes
+		self.mesh_cache = TextureCache(DEFAULT_MESH_CACHE_SIZE)
+		# Cache for the coverage masks of anti-aliased rings and arcs
+		self.mask_cache = TextureCache(DEFAULT_MASK_CACHE_SIZE)
+		# Cache for the grids, envelopes and carriers of LSD.stimuli
+		self.stimulus_cache = TextureCache(DEFAULT_STIMULUS_CACHE_SIZE)
+		# Cache for decoded and uploaded image files
+		self.image_cache = ImageCache(texture_factory, surface_factory, 
+			image_cache_size)
+		# Atlas to pack textures into (created on first use)
+		self._atlas = None
+		# Records the timing of every FrameBuffer.show() when enabled
+		self.frame_timer = None
+		# Writes every shown frame to disk when enabled
+		self.frame_recorder = None
+		# TrueType fonts with their glyph atlases, by (path, size)
+		self.fonts = {}
+		# Streaming textures for arrays, by (width, height, pixel format)
+		self.streaming_textures = {}
+		# Stores rasterized shapes on disk across sessions when enabled
+		self.render_cache = None
+		# Counts the textures that are alive and enforces the VRAM budget
+		self.resources = ResourceTracker(self)
+		self.resources.eviction_hooks.extend([_free_pooled_textures,
+			_trim_shape_cache, _trim_image_textures])
+		if isinstance(texture_factory, TrackingSpriteFactory):
+			texture_factory.tracker = self.resources
+		# Recycles textures and scratch surfaces
+		self.resource_pool = ResourcePool(self)
+		# Decodes images in the background (created on first use)
+		self._prefetcher = None
+		# The maximum number of prefetched images show() uploads each call
+		self.prefetch_uploads_per_show = 4
+		# Whether the backbuffer keeps its contents after a present, which 
+		# incremental FrameBuffers need to only copy their damaged regions.
+		# The software renderer draws on the window surface, which does; 
+		# accelerated renderers swap buffers of undefined contents.
+		self.persistent_backbuffer = _is_software_renderer(renderer)
+		# The FrameBuffer whose contents are on the backbuffer (a weakref)
+		self.presented_framebuffer = None
+
 		self.pysdl2_version = sdl2.__version__
 		self.sdl2_version = "{}.{}.{}".format(sdl2.version.SDL_MAJOR_VERSION, 
 			sdl2.version.SDL_MINOR_VERSION, sdl2.version.SDL_PATCHLEVEL)
 
-		self.cpu_count = sdl2.SDL_GetCPUCount()
-		self.display_count = sdl2.SDL_GetNumVideoDisplays()
+	# The rest of the info is queried from SDL2 itself when it is first needed
+
+	@cached_property
+	def cpu_count(self):
+		return sdl2.SDL_GetCPUCount()
+
+	@cached_property
+	def display_count(self):
+		return sdl2.SDL_GetNumVideoDisplays()
 
-		self.displays = []
+	@cached_property
+	def displays(self):
+		""" The current SDL_DisplayMode of every display. """
+		displays = []
 		for dispnum in range(self.display_count):
 			dispinfo = sdl2.SDL_DisplayMode()
 			res = sdl2.SDL_GetCurrentDisplayMode(dispnum, dispinfo)
 			if res == 0:
-				self.displays.append(dispinfo)
+				displays.append(dispinfo)
+		return displays
 
-		self.display_drivers = [sdl2.video.SDL_GetVideoDriver(i) for i in \
+	@cached_property
+	def display_drivers(self):
+		return [sdl2.video.SDL_GetVideoDriver(i) for i in \
 			range(sdl2.video.SDL_GetNumVideoDrivers())]
-		self.current_display_driver = sdl2.SDL_GetCurrentVideoDriver()
+
+	@cached_property
+	def current_display_driver(self):
+		return sdl2.SDL_GetCurrentVideoDriver()
+
+	@cached_property
+	def sprite_renderer(self):
+		""" A TextureSpriteRenderSystem for the renderer, shared by all 
+		FrameBuffers. """
+		return self.texture_factory.create_sprite_render_system()
+
+	def reset_display_info(self):
+		""" Forgets the queried display information, so that it is queried 
+		again, e.g. after a display has been connected. """
+		for name in ('display_count', 'displays', 'display_drivers',
+			'current_display_driver'):
+			self.__dict__.pop(name, None)
 
 	def __str__(self):
 		infostring = (""
@@ -67,7 +179,16 @@ class SDL2Environment(object):
 			"Display count":self.display_count,
 			"Window dimensions":self.window.size,
 			"Available display drivers":self.display_drivers,
+			"Shape cache":self.shape_cache.stats(),
+			"Image cache":self.image_cache.stats(),
+			"Mesh cache":self.mesh_cache.stats(),
+			"Mask cache":self.mask_cache.stats(),
+			"Stimulus cache":self.stimulus_cache.stats(),
+			"Resource pool":self.resource_pool.stats(),
+			"GPU resources":self.resources.stats(),
 		}
+		if not self.render_cache is None:
+			info["Render cache"] = self.render_cache.stats()
 
 		for dispnum, display in enumerate(self.displays):
 			cur_disp_info = {}
@@ -77,8 +198,197 @@ class SDL2Environment(object):
 
 		return info
 
+	@property
+	def shape_cache_hits(self):
+		return self.shape_cache.hits
+
+	@property
+	def shape_cache_misses(self):
+		return self.shape_cache.misses
+
+	@property
+	def atlas(self):
+		""" The TextureAtlas of this environment. """
+		if self._atlas is None:
+			self._atlas = TextureAtlas(self)
+		return self._atlas
+
+	def enable_frame_timing(self, capacity=None, tolerance=0.5, max_gap=None):
+		""" Starts recording the timing of every FrameBuffer.show().
+
+		Missed vsyncs are detected with the refresh rate of the display the
+		window is on. See FrameTimer for the parameters.
+
+		Returns
+		-------
+		FrameTimer: the recorder, which is also available as frame_timer
+		"""
+		from .timing import FrameTimer, DEFAULT_TIMING_CAPACITY
+		if capacity is None:
+			capacity = DEFAULT_TIMING_CAPACITY
+		self.frame_timer = FrameTimer(self.refresh_rate, capacity, tolerance,
+			max_gap)
+		return self.frame_timer
+
+	def disable_frame_timing(self):
+		""" Stops recording frame timing and returns the last FrameTimer. """
+		timer, self.frame_timer = self.frame_timer, None
+		return timer
+
+	def start_recording(self, path, format='png', queue_size=8):
+		""" Starts writing every frame that FrameBuffer.show() presents to 
+		the directory path. See FrameRecorder for the parameters.
+
+		Returns
+		-------
+		FrameRecorder: the recorder, which is also available as frame_recorder
+		"""
+		from .recording import FrameRecorder
+		self.stop_recording()
+		self.frame_recorder = FrameRecorder(self, path, format, queue_size)
+		return self.frame_recorder
+
+	def stop_recording(self):
+		""" Stops recording, waits until all frames are written and returns the
+		FrameRecorder. """
+		recorder, self.frame_recorder = self.frame_recorder, None
+		if not recorder is None:
+			recorder.stop()
+		return recorder
+
+	def enable_render_cache(self, directory=None, max_bytes=None):
+		""" Starts caching rasterized shapes on disk, so that later sessions
+		can load them instead of drawing them again. See RenderCache for the
+		parameters.
+
+		Returns
+		-------
+		RenderCache: the cache, which is also available as render_cache
+		"""
+		from .rendercache import RenderCache, DEFAULT_RENDER_CACHE_SIZE
+		if max_bytes is None:
+			max_bytes = DEFAULT_RENDER_CACHE_SIZE
+		self.render_cache = RenderCache(self, directory, max_bytes)
+		return self.render_cache
+
+	def disable_render_cache(self):
+		""" Stops using the on-disk cache; its files are kept. """
+		self.render_cache = None
+
+	@property
+	def refresh_rate(self):
+		""" The refresh rate of the display the window is on, or 0 if it is 
+		unknown. """
+		dispnum = sdl2.SDL_GetWindowDisplayIndex(self.window.window)
+		if 0 <= dispnum < len(self.displays):
+			return self.displays[dispnum].refresh_rate
+		return 0
+
+	def prefetch(self, paths, callback=None):
+		""" Starts decoding image files on background threads, so that drawing
+		them later only requires a texture copy. The decoded images are 
+		uploaded by FrameBuffer.show() or upload_prefetched().
+		
+		See ImagePrefetcher.prefetch() for the parameters.
+
+		Returns
+		-------
+		list: a concurrent.futures.Future per path
+		"""
+		if self._prefetcher is None:
+			from .prefetch import ImagePrefetcher
+			self._prefetcher = ImagePrefetcher(self.image_cache)
+		return self._prefetcher.prefetch(paths, callback)
+
+	def upload_prefetched(self, max_count=None):
+		""" Uploads prefetched images that have been decoded to textures and
+		returns how many were uploaded. """
+		if self._prefetcher is None:
+			return 0
+		return self._prefetcher.upload(max_count)
+
+	def prefetch_ready(self, paths):
+		""" Checks if all paths are decoded and uploaded. """
+		if self._prefetcher is None:
+			if isinstance(paths, (str, bytes)):
+				paths = [paths]
+			return all(self.image_cache.has_texture(path) for path in paths)
+		return self._prefetcher.ready(paths)
+
+	def streaming_texture(self, size, pformat):
+		""" Returns the persistent streaming texture for arrays of this size 
+		and pixel format, creating it if it does not exist yet. """
+		key = (size[0], size[1], pformat)
+		sprite = self.streaming_textures.get(key)
+		if sprite is None:
+			from .drawing import _create_streaming_texture
+			sprite = _create_streaming_texture(self, size, pformat)
+			self.streaming_textures[key] = sprite
+		return sprite
+
+	def font(self, font_path, size):
+		""" Returns the Font for font_path at size, opening it the first time."""
+		key = (font_path, size)
+		font = self.fonts.get(key)
+		if font is None:
+			from .text import Font
+			font = Font(self, font_path, size)
+			self.fonts[key] = font
+		return font
+
+	def set_vram_budget(self, nbytes):
+		""" Sets the maximum total size of LSD's textures in bytes (None for no
+		limit). See ResourceTracker. """
+		self.resources.budget = nbytes
+		self.resources._check_budget()
+
+	def forget_texture(self, sprite):
+		""" Removes a texture from all caches and pools of the environment. """
+		self.shape_cache.remove(sprite)
+		self.image_cache.textures.remove(sprite)
+		self.resource_pool.forget(sprite)
+		for key, streaming in list(self.streaming_textures.items()):
+			if streaming is sprite:
+				del self.streaming_textures[key]
+
+	def invalidate_caches(self):
+		""" Drops all cached textures. Needs to be called before the renderer
+		is destroyed. """
+		try:
+			self.stop_recording()
+		except Exception as e:
+			# The window still needs to be closed when frames were lost
+			warnings.warn(str(e), RuntimeWarning)
+		self.shape_cache.invalidate()
+		self.mesh_cache.invalidate()
+		self.mask_cache.invalidate()
+		self.stimulus_cache.invalidate()
+		self.streaming_textures.clear()
+		for font in self.fonts.values():
+			font.close()
+		self.fonts.clear()
+		if not self._prefetcher is None:
+			self._prefetcher.shutdown()
+			self._prefetcher = None
+		self.image_cache.invalidate()
+		if not self._atlas is None:
+			self._atlas.clear()
+		self.resource_pool.clear()
+
 	def get_available_display_drivers(self):
 		drivers = []
 		for vd in range(sdl2.SDL_GetNumVideoDrivers()):
 			drivers.append(sdl2.SDL_GetVideoDriver(vd))
-		return drivers
\ No newline at end of file
+		return drivers
+
+class HeadlessEnvironment(SDL2Environment):
+	""" Environment that renders offscreen with the dummy video driver and a
+	software renderer. Create it with LSD.create_headless_environment(). """
+
+	headless = True
+
+	@property
+	def refresh_rate(self):
+		""" Presenting is not synchronized to a display, so the refresh rate is
+		unknown. """
+		return 0
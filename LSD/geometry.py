@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Tessellation of shapes into triangle meshes for SDL_RenderGeometry.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+
+# LSD package imports
+from .util import *
+
+# misc
+import ctypes
+import math
+
+# Layout of SDL_Vertex: position (2 floats), color (4 bytes), tex_coord
+# (2 floats)
+if not np is None:
+	VERTEX_DTYPE = np.dtype([('x', np.float32), ('y', np.float32),
+		('r', np.uint8), ('g', np.uint8), ('b', np.uint8), ('a', np.uint8),
+		('u', np.float32), ('v', np.float32)])
+
+def segment_count(radius, angle=360):
+	""" The number of segments needed for a smooth curve: about one per two
+	pixels of arc length, with a minimum of 8 and a maximum of 512. """
+	length = 2*math.pi*radius*abs(angle)/360.0
+	return int(min(512, max(8, length/2)))
+
+def _arc_points(rx, ry, start, end, segments):
+	""" Points on an elliptical arc from start to end (degrees, clockwise from
+	the positive x-axis, as in sdlgfx). """
+	angles = np.radians(np.linspace(start, end, segments+1))
+	return np.column_stack((rx*np.cos(angles), ry*np.sin(angles)))
+
+def _fan(center, points, closed):
+	""" Vertices and indices of a triangle fan from center to points. """
+	n = len(points)
+	vertices = np.vstack((center, points))
+	first = np.arange(1, n if not closed else n+1)
+	second = first + 1
+	if closed:
+		second[-1] = 1
+	indices = np.column_stack((np.zeros_like(first), first, second))
+	return vertices, indices
+
+def _strip(outer, inner, closed):
+	""" Vertices and indices of the band between two point sequences of equal
+	length. """
+	n = len(outer)
+	vertices = np.vstack((outer, inner))
+	i = np.arange(n if closed else n-1)
+	j = (i + 1) % n
+	indices = np.vstack((
+		np.column_stack((i, j, n+i)),
+		np.column_stack((j, n+j, n+i)),
+	))
+	return vertices, indices
+
+def tessellate_ellipse(rx, ry, fill=True, penwidth=1, start=0, end=360,
+	pie=False):
+	""" Tessellates an ellipse, elliptical arc or pie around the origin.
+
+	Parameters
+	----------
+	rx, ry: float
+		The radii.
+	fill: bool, optional
+		Fill the shape. Otherwise a band of penwidth centered on the radii is
+		made.
+	start, end: float, optional
+		The angles (in degrees) of the part to tessellate.
+	pie: bool, optional
+		For partial outlines, also draw the two straight edges to the center.
+
+	Returns
+	-------
+	tuple: (vertices, indices), an (n, 2) float32 array and an (m, 3) int32
+		array of triangles
+	"""
+	full = abs(end - start) >= 360
+	if full:
+		end = start + 360
+	segments = segment_count(max(rx, ry), end - start)
+	if fill:
+		points = _arc_points(rx, ry, start, end, segments)
+		if full:
+			points = points[:-1]
+		vertices, indices = _fan((0, 0), points, full)
+	else:
+		half = penwidth/2.0
+		outer = _arc_points(rx+half, ry+half, start, end, segments)
+		inner = _arc_points(max(rx-half, 0), max(ry-half, 0), start, end,
+			segments)
+		if full:
+			outer, inner = outer[:-1], inner[:-1]
+		vertices, indices = _strip(outer, inner, full)
+		if pie and not full:
+			edges = [tessellate_thick_line(0, 0, p[0], p[1], penwidth) for p in
+				_arc_points(rx, ry, start, end, 1)]
+			vertices, indices = merge_meshes([(vertices, indices)] + edges)
+	return vertices.astype(np.float32), indices.astype(np.int32)
+
+def tessellate_thick_line(x1, y1, x2, y2, width):
+	""" Tessellates a line of the given width into a quad. """
+	dx, dy = x2 - x1, y2 - y1
+	length = math.hypot(dx, dy) or 1.0
+	# Offset perpendicular to the line
+	ox, oy = -dy/length*width/2.0, dx/length*width/2.0
+	vertices = np.array([(x1+ox, y1+oy), (x2+ox, y2+oy), (x2-ox, y2-oy),
+		(x1-ox, y1-oy)], dtype=np.float32)
+	indices = np.array([(0, 1, 2), (0, 2, 3)], dtype=np.int32)
+	return vertices, indices
+
+def _rounded_rect_points(w, h, radius, x=0, y=0):
+	""" The outline of a rounded rectangle, with the same number of points for
+	every radius (corners with radius 0 are repeated points). """
+	corner_segments = 8
+	centers = [(x+w-radius, y+h-radius, 0), (x+radius, y+h-radius, 90),
+		(x+radius, y+radius, 180), (x+w-radius, y+radius, 270)]
+	return np.vstack([_arc_points(radius, radius, angle, angle+90,
+		corner_segments) + (cx, cy) for cx, cy, angle in centers])
+
+def tessellate_rounded_rect(w, h, radius=0, fill=True, penwidth=1):
+	""" Tessellates a (rounded) rectangle with its top left corner at the
+	origin. An outline is drawn inwards from the edges. """
+	radius = min(radius, w/2.0, h/2.0)
+	outer = _rounded_rect_points(w, h, radius)
+	if fill:
+		vertices, indices = _fan((w/2.0, h/2.0), outer, True)
+	else:
+		if 2*penwidth >= min(w, h):
+			raise ValueError("Penwidth to large for a rect with these dimensions")
+		inner = _rounded_rect_points(w-2*penwidth, h-2*penwidth,
+			max(radius-penwidth, 0), penwidth, penwidth)
+		vertices, indices = _strip(outer, inner, True)
+	return vertices.astype(np.float32), indices.astype(np.int32)
+
+def merge_meshes(meshes):
+	""" Concatenates (vertices, indices) meshes into one. """
+	offset = 0
+	all_vertices, all_indices = [], []
+	for vertices, indices in meshes:
+		all_vertices.append(vertices)
+		all_indices.append(indices + offset)
+		offset += len(vertices)
+	return np.vstack(all_vertices), np.vstack(all_indices)
+
+class GeometryBatch(object):
+	""" Collects tessellated shapes and draws them with one SDL_RenderGeometry
+	call.
+
+	The meshes of the shapes are cached in the environment per shape
+	parameters, so adding a shape that has been drawn before only costs a
+	translation of its vertices. Add the batch to a FrameBuffer with
+	FrameBuffer.add_geometry(). Geometry is not anti-aliased. Requires SDL
+	2.0.18 or newer.
+
+	Parameters
+	----------
+	sdl2env: SDL2Environment
+		The environment to draw in.
+	"""
+
+	def __init__(self, sdl2env=None):
+		require_numpy("GeometryBatch")
+		self.environment = check_sdl2env(sdl2env)
+		self.clear()
+
+	def __len__(self):
+		return len(self._meshes)
+
+	def clear(self):
+		""" Removes all shapes from the batch. """
+		self._meshes = []
+		self._vertex_count = 0
+		self._vertices = None
+		return self
+
+	def circle(self, x, y, radius, color, opacity=1.0, fill=True, penwidth=1):
+		""" Adds a circle centered on (x, y). """
+		return self.ellipse(x, y, radius, radius, color, opacity, fill, penwidth)
+
+	def ellipse(self, x, y, x_radius, y_radius, color, opacity=1.0, fill=True,
+		penwidth=1):
+		""" Adds an ellipse centered on (x, y). """
+		mesh = self._mesh(('ellipse', x_radius, y_radius, bool(fill), penwidth),
+			tessellate_ellipse, x_radius, y_radius, fill, penwidth)
+		return self._add(mesh, x, y, color, opacity)
+
+	def arc(self, x, y, radius, start, end, color, opacity=1.0, penwidth=1):
+		""" Adds an arc around (x, y) from start to end (in degrees). """
+		mesh = self._mesh(('arc', radius, start, end, penwidth),
+			tessellate_ellipse, radius, radius, False, penwidth, start, end)
+		return self._add(mesh, x, y, color, opacity)
+
+	def pie(self, x, y, radius, start, end, color, opacity=1.0, fill=True,
+		penwidth=1):
+		""" Adds a pie around (x, y) from start to end (in degrees). """
+		mesh = self._mesh(('pie', radius, start, end, bool(fill), penwidth),
+			tessellate_ellipse, radius, radius, fill, penwidth, start, end, True)
+		return self._add(mesh, x, y, color, opacity)
+
+	def line(self, x1, y1, x2, y2, color, opacity=1.0, width=1):
+		""" Adds a line of the given width. """
+		mesh = self._mesh(('line', x2-x1, y2-y1, width), tessellate_thick_line,
+			0, 0, x2-x1, y2-y1, width)
+		return self._add(mesh, x1, y1, color, opacity)
+
+	def rect(self, x, y, w, h, color, opacity=1.0, fill=True, border_radius=0,
+		penwidth=1):
+		""" Adds a (rounded) rectangle with its top left corner at (x, y). """
+		mesh = self._mesh(('rect', w, h, border_radius, bool(fill), penwidth),
+			tessellate_rounded_rect, w, h, border_radius, fill, penwidth)
+		return self._add(mesh, x, y, color, opacity)
+
+	def vertices(self):
+		""" Returns all shapes as one array of SDL_Vertex structured values and
+		an array of indices. """
+		if self._vertices is None:
+			vertices = np.zeros(self._vertex_count, dtype=VERTEX_DTYPE)
+			if not self._meshes:
+				self._vertices = (vertices, np.zeros(0, dtype=np.int32))
+				return self._vertices
+			meshes = [mesh for mesh, _, _, _ in self._meshes]
+			vertex_counts = [len(mesh[0]) for mesh in meshes]
+			index_counts = [mesh[1].size for mesh in meshes]
+
+			# Translate the cached meshes to their positions in one go
+			positions = np.array([(x, y) for _, x, y, _ in self._meshes],
+				dtype=np.float32)
+			colors = np.array([color for _, _, _, color in self._meshes],
+				dtype=np.uint8)
+			mesh_vertices = np.vstack([mesh[0] for mesh in meshes])
+			vertices['x'] = mesh_vertices[:, 0] + np.repeat(positions[:, 0],
+				vertex_counts)
+			vertices['y'] = mesh_vertices[:, 1] + np.repeat(positions[:, 1],
+				vertex_counts)
+			for i, channel in enumerate('rgba'):
+				vertices[channel] = np.repeat(colors[:, i], vertex_counts)
+
+			# Offset the indices of every mesh by its first vertex
+			offsets = np.cumsum(vertex_counts) - vertex_counts
+			indices = np.concatenate([mesh[1].reshape(-1) for mesh in meshes])
+			indices = (indices + np.repeat(offsets, index_counts)).astype(
+				np.int32)
+			self._vertices = (vertices, indices)
+		return self._vertices
+
+	def render(self):
+		""" Draws the batch on the current render target. """
+		if not self._meshes:
+			return
+		vertices, indices = self.vertices()
+		sdlrenderer = self.environment.renderer.sdlrenderer
+		sdl2.SDL_SetRenderDrawBlendMode(sdlrenderer, sdl2.SDL_BLENDMODE_BLEND)
+		if sdl2.SDL_RenderGeometry(sdlrenderer, None,
+			vertices.ctypes.data_as(ctypes.POINTER(sdl2.SDL_Vertex)),
+			len(vertices), indices.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+			len(indices)) != 0:
+			raise Exception("Could not render geometry: "
+				"{}".format(sdl2.SDL_GetError()))
+
+	def _mesh(self, key, tessellate, *args):
+		""" Returns the mesh for key from the environment's mesh cache,
+		tessellating it if needed. """
+		cache = self.environment.mesh_cache
+		mesh = cache.get(key)
+		if mesh is None:
+			mesh = tessellate(*args)
+			cache.put(key, mesh, mesh[0].nbytes + mesh[1].nbytes)
+		return mesh
+
+	def _add(self, mesh, x, y, color, opacity):
+		# Like the drawing functions, only opacity sets the transparency: 
+		# convert_to_color gives RGB tuples and ints an alpha of 0
+		color = sdl2.ext.convert_to_color(color)
+		alpha = convert_opacity(opacity)
+		self._meshes.append((mesh, x, y, (color.r, color.g, color.b, alpha)))
+		self._vertex_count += len(mesh[0])
+		self._vertices = None
+		return self
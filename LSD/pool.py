@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-process pre-generation of stimuli.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+
+# LSD package imports
+from .util import *
+
+# misc
+import ctypes
+import multiprocessing
+import multiprocessing.sharedctypes
+
+# State of a worker process, set up by _init_worker
+_worker = {}
+
+def _init_worker(resolution, background_color, buffers, free_slots):
+	""" Creates the headless environment and framebuffer of a worker. """
+	from . import create_headless_environment, create_framebuffer
+	sdl2env = create_headless_environment(resolution)
+	_worker["environment"] = sdl2env
+	_worker["framebuffer"] = create_framebuffer(sdl2env=sdl2env,
+		background_color=background_color)
+	_worker["buffers"] = buffers
+	_worker["free_slots"] = free_slots
+
+def _render_task(task):
+	""" Draws one stimulus and copies its pixels to a free shared buffer.
+	Returns the index of the task and that of the buffer. """
+	index, function, args = task
+	framebuffer = _worker["framebuffer"]
+	framebuffer.clear()
+	function(framebuffer, *args)
+	framebuffer.flush()
+
+	slot = _worker["free_slots"].get()
+	try:
+		width = framebuffer.environment.resolution[0]
+		framebuffer._read_pixels(ctypes.addressof(_worker["buffers"][slot]),
+			width*4)
+	except:
+		_worker["free_slots"].put(slot)
+		raise
+	return index, slot
+
+class StimulusPool(object):
+	""" Renders stimuli in parallel in a pool of worker processes.
+
+	Every worker owns a headless environment with a software renderer and a
+	framebuffer. A stimulus is described by a function that draws on that
+	framebuffer with the LSD.drawing functions, e.g.
+
+		def search_display(framebuffer, n_items, seed):
+			...
+			framebuffer.add(LSD.drawing.circle(10, "#FF0000", x=x, y=y))
+
+	Workers copy the finished pixels to a buffer in shared memory, from which
+	the main process uploads them into a texture. As the workers are started
+	with the 'spawn' method, the functions need to be defined at the top
+	level of a module so they can be pickled.
+
+	Parameters
+	----------
+	sdl2env: SDL2Environment
+		The environment in which the textures are created.
+	processes: int, optional
+		The number of worker processes. Defaults to the CPU count of the
+		environment.
+	resolution: tuple, optional
+		The (width, height) of the stimuli. Defaults to the resolution of
+		the environment.
+	background_color: color, optional
+		The color the worker framebuffers are cleared with.
+	"""
+
+	def __init__(self, sdl2env=None, processes=None, resolution=None,
+		background_color=0):
+		self.environment = check_sdl2env(sdl2env)
+		if processes is None:
+			processes = self.environment.cpu_count
+		self.processes = check_int_value(processes, min_value=1,
+			varname="processes")
+		if resolution is None:
+			resolution = self.environment.resolution
+		self.resolution = tuple(resolution)
+
+		# Two shared buffers per worker, so a worker can continue with its next
+		# stimulus while the main process uploads the previous one
+		try:
+			context = multiprocessing.get_context("spawn")
+		except AttributeError:
+			context = multiprocessing
+		buffer_size = self.resolution[0] * self.resolution[1] * 4
+		self._buffers = [multiprocessing.sharedctypes.RawArray(ctypes.c_uint8,
+			buffer_size) for _ in range(2*self.processes)]
+		self._free_slots = context.Queue()
+		for slot in range(len(self._buffers)):
+			self._free_slots.put(slot)
+
+		self._pool = context.Pool(self.processes, _init_worker, (self.resolution,
+			background_color, self._buffers, self._free_slots))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def map(self, function, args_list, as_arrays=False):
+		""" Renders a stimulus for every item of args_list.
+
+		Parameters
+		----------
+		function: callable
+			Called in a worker as function(framebuffer, *args) to draw each
+			stimulus.
+		args_list: iterable
+			The arguments for every stimulus. Items that are not tuples are
+			passed as the single argument.
+		as_arrays: bool, optional
+			Return the stimuli as (height, width, 4) RGBA NumPy arrays instead
+			of textures.
+
+		Returns
+		-------
+		list: a TextureSprite (or array) for every item, in the order of
+			args_list
+		"""
+		if as_arrays:
+			require_numpy("StimulusPool.map(as_arrays=True)")
+		tasks = [(index, function, args if isinstance(args, tuple) else (args,))
+			for index, args in enumerate(args_list)]
+		results = [None]*len(tasks)
+		rendered = self._pool.imap_unordered(_render_task, tasks)
+		try:
+			for index, slot in rendered:
+				try:
+					if as_arrays:
+						results[index] = self._to_array(slot)
+					else:
+						results[index] = self._to_texture(slot)
+				finally:
+					# Hand the buffer back to the workers
+					self._free_slots.put(slot)
+		finally:
+			# After an error, the stimuli that are still rendered hold buffers
+			# too, which the next map() would wait for forever
+			self._drain(rendered)
+		return results
+
+	def close(self):
+		""" Stops the worker processes. """
+		if not self._pool is None:
+			self._pool.close()
+			self._pool.join()
+			self._pool = None
+
+	def _drain(self, rendered):
+		""" Waits for the remaining results of rendered and frees their 
+		buffers. """
+		while True:
+			try:
+				index, slot = next(rendered)
+			except StopIteration:
+				return
+			except Exception:
+				# A task that failed has freed its buffer itself
+				continue
+			self._free_slots.put(slot)
+
+	def _to_array(self, slot):
+		width, height = self.resolution
+		return np.frombuffer(self._buffers[slot], dtype=np.uint8).reshape(
+			height, width, 4).copy()
+
+	def _to_texture(self, slot):
+		width, height = self.resolution
+		sprite = self.environment.texture_factory.create_sprite(
+			size=self.resolution,
+			pformat=sdl2.SDL_PIXELFORMAT_RGBA32
+		)
+		if sdl2.SDL_UpdateTexture(sprite.texture, None, self._buffers[slot],
+			width*4) != 0:
+			raise Exception("Could not upload stimulus to texture: "
+				"{}".format(sdl2.SDL_GetError()))
+		sdl2.SDL_SetTextureBlendMode(sprite.texture, sdl2.SDL_BLENDMODE_BLEND)
+		return sprite
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Decoding of image files on background threads.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# misc
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
+import warnings
+
+class ImagePrefetcher(object):
+	""" Decodes images into the image cache ahead of time.
+
+	Decoding an image file to a surface does not need the renderer, so it is
+	done on a pool of worker threads. Uploading the surface to a texture does
+	need it and is therefore left to the main thread, which calls upload()
+	when it has time to spare (FrameBuffer.show() does so after presenting).
+
+	Parameters
+	----------
+	image_cache: ImageCache
+		The cache the decoded images and their textures are stored in.
+	workers: int, optional
+		The number of decoding threads.
+	"""
+
+	def __init__(self, image_cache, workers=None):
+		self.image_cache = image_cache
+		self._executor = ThreadPoolExecutor(max_workers=workers or 2)
+		# Futures of the images that are not uploaded yet, by cache key
+		self._pending = OrderedDict()
+
+	@property
+	def pending(self):
+		""" The number of images that are not uploaded yet. """
+		return len(self._pending)
+
+	def prefetch(self, paths, callback=None):
+		""" Starts decoding the image files in paths.
+
+		Parameters
+		----------
+		paths: str or list of str
+			The image files to load.
+		callback: callable, optional
+			Called with the future of every image as soon as it is decoded.
+			This happens on the decoding thread, so the callback should not
+			use the renderer.
+
+		Returns
+		-------
+		list: a concurrent.futures.Future per path, of which the result is the
+			decoded SoftwareSprite. Images of which the decoded surface is 
+			already in the cache get a future that is done immediately, and
+			files that cannot be read get a future that failed immediately.
+		"""
+		if isinstance(paths, (str, bytes)):
+			paths = [paths]
+		futures = []
+		for path in paths:
+			try:
+				key = self.image_cache.key(path)
+			except (IOError, OSError) as e:
+				# Missing or unreadable files fail their future, like images
+				# that cannot be decoded
+				future = Future()
+				future.set_exception(e)
+			else:
+				if key in self._pending:
+					future = self._pending[key][1]
+				elif key in self.image_cache.surfaces:
+					future = Future()
+					future.set_result(self.image_cache.surfaces.get(key))
+				else:
+					future = self._executor.submit(
+						self.image_cache.surface_factory.from_image, path)
+					self._pending[key] = (path, future)
+			if not callback is None:
+				future.add_done_callback(callback)
+			futures.append(future)
+		return futures
+
+	def upload(self, max_count=None):
+		""" Uploads decoded images to textures. Needs to be called from the 
+		main thread.
+
+		Parameters
+		----------
+		max_count: int, optional
+			The maximum number of textures to upload, to limit the time this 
+			takes. Defaults to all decoded images.
+
+		Returns
+		-------
+		int: the number of images that were uploaded
+		"""
+		uploaded = 0
+		for key, (path, future) in list(self._pending.items()):
+			if not max_count is None and uploaded >= max_count:
+				break
+			if not future.done():
+				continue
+			del(self._pending[key])
+			if future.exception() is None:
+				surface = future.result()
+				self.image_cache.add_surface(key, surface)
+				if not key in self.image_cache.surfaces:
+					warnings.warn("The decoded image {} does not fit in the "
+						"surface budget of the image cache, so it is not kept "
+						"after it is uploaded".format(path), RuntimeWarning)
+				# Upload the surface that was decoded, which might not be in
+				# the surface cache
+				if not key in self.image_cache.textures:
+					self.image_cache.add_texture(key, surface)
+				uploaded += 1
+		return uploaded
+
+	def ready(self, paths):
+		""" Uploads what has been decoded and checks whether all paths are in
+		the texture cache. """
+		if isinstance(paths, (str, bytes)):
+			paths = [paths]
+		if self._pending:
+			self.upload()
+		return all(self.image_cache.has_texture(path) for path in paths)
+
+	def shutdown(self):
+		""" Waits for the decoding threads to finish and stops them. """
+		self._executor.shutdown(wait=True)
+		self._pending.clear()
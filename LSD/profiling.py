@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of the drawing functions.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# misc
+from collections import OrderedDict
+import inspect
+import io
+import json
+import os
+import threading
+import timeit
+
+# The profiler that is recording, if any. The drawing decorators only check
+# this, so profiling costs nothing else while it is disabled.
+active = None
+
+# The phases a drawing call is split into; time that is not in any of these
+# counts as 'other'
+PHASES = ('validation', 'rasterization', 'upload')
+
+# Parameters that distinguish the variants of a primitive in the statistics
+VARIANT_PARAMETERS = ('fill', 'aa', 'penwidth', 'cache', 'reuse')
+
+def timed(phase, function, *args, **kwargs):
+	""" Calls function, attributing its duration to phase of the drawing call
+	that is being profiled. """
+	if active is None:
+		return function(*args, **kwargs)
+	return active.phase(phase, function, *args, **kwargs)
+
+def record_bytes(nbytes):
+	""" Attributes a texture allocation to the profiled drawing call. """
+	if not active is None:
+		active.add_bytes(nbytes)
+
+class Profiler(object):
+	""" Records call counts, durations and allocated texture bytes of the
+	LSD.drawing functions, per function and per variant of its parameters
+	(see VARIANT_PARAMETERS).
+
+	The duration of every call is split into the phases validation (of the
+	arguments), rasterization (drawing a shape on a new texture) and upload
+	(of pixels to textures), which exclude each other. Use it as a context
+	manager, or call start() and stop():
+
+		with LSD.profiling.Profiler() as profiler:
+			...
+		print(profiler.format_summary())
+		profiler.export_chrome_trace("trace.json")
+
+	The trace can be opened in chrome://tracing or Perfetto. Only one
+	profiler records at a time.
+
+	Parameters
+	----------
+	max_events: int, optional
+		The maximum number of trace events to keep; the statistics are kept
+		for all calls.
+	"""
+
+	def __init__(self, max_events=1000000):
+		self.max_events = max_events
+		self.clock = timeit.default_timer
+		self._signatures = {}
+		self.reset()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def reset(self):
+		""" Forgets all recorded calls. """
+		self.stats = OrderedDict()
+		self.events = []
+		self.dropped_events = 0
+		self._origin = self.clock()
+		self._local = threading.local()
+
+	def start(self):
+		""" Makes this the recording profiler. """
+		global active
+		active = self
+		return self
+
+	def stop(self):
+		""" Stops recording. """
+		global active
+		if active is self:
+			active = None
+		return self
+
+	def call(self, function, args, kwargs):
+		""" Calls a drawing function and records it. """
+		stack = self._stack()
+		record = {"phases": {}, "phase_stack": [], "bytes": 0}
+		stack.append(record)
+		start = self.clock()
+		try:
+			return function(*args, **kwargs)
+		finally:
+			end = self.clock()
+			stack.pop()
+			self._finish(function, kwargs, record, start, end)
+
+	def phase(self, phase, function, *args, **kwargs):
+		""" Calls function as part of phase of the current drawing call. """
+		stack = self._stack()
+		if not stack:
+			return function(*args, **kwargs)
+		record = stack[-1]
+		parent = record["phase_stack"][-1] if record["phase_stack"] else None
+		record["phase_stack"].append(phase)
+		start = self.clock()
+		try:
+			return function(*args, **kwargs)
+		finally:
+			elapsed = self.clock() - start
+			record["phase_stack"].pop()
+			phases = record["phases"]
+			phases[phase] = phases.get(phase, 0.0) + elapsed
+			# Phases exclude each other, so nested time only counts once
+			if not parent is None:
+				phases[parent] = phases.get(parent, 0.0) - elapsed
+			self._event(phase, "phase", start, elapsed)
+
+	def add_bytes(self, nbytes):
+		stack = self._stack()
+		if stack:
+			stack[-1]["bytes"] += nbytes
+
+	def summary(self):
+		""" Returns a dict per primitive and variant with the number of calls,
+		the total and mean duration and the time per phase (in seconds), and
+		the allocated texture bytes, sorted by total duration. """
+		rows = []
+		for (name, variant), stats in self.stats.items():
+			row = OrderedDict([("primitive", name), ("variant", variant)])
+			row.update(stats)
+			row["mean"] = stats["total"]/stats["calls"]
+			rows.append(row)
+		return sorted(rows, key=lambda row: -row["total"])
+
+	def format_summary(self):
+		""" Returns the summary as a text table, with times in ms. """
+		header = ("primitive", "variant", "calls", "total", "mean") + PHASES + \
+			("other", "bytes")
+		lines = []
+		for row in self.summary():
+			lines.append([row["primitive"], row["variant"], str(row["calls"])] +
+				["{:.3f}".format(row[column]*1000) for column in
+				("total", "mean") + PHASES + ("other",)] + [str(row["bytes"])])
+		widths = [max([len(header[i])] + [len(line[i]) for line in lines])
+			for i in range(len(header))]
+		def format_line(values):
+			return "  ".join(value.ljust(width) if i < 2 else
+				value.rjust(width) for i, (value, width) in
+				enumerate(zip(values, widths)))
+		return "\n".join([format_line(header)] + [format_line(line) for line in
+			lines])
+
+	def export_chrome_trace(self, path):
+		""" Writes the recorded calls and phases in the Chrome trace event
+		format. """
+		data = {"traceEvents": self.events, "displayTimeUnit": "ms"}
+		with io.open(path, 'w', encoding='utf-8') as fp:
+			fp.write(json.dumps(data))
+		return self
+
+	def _stack(self):
+		stack = getattr(self._local, 'stack', None)
+		if stack is None:
+			stack = self._local.stack = []
+		return stack
+
+	def _variant(self, function, kwargs):
+		defaults = self._signatures.get(function)
+		if defaults is None:
+			try:
+				parameters = inspect.signature(function).parameters.values()
+				defaults = dict((p.name, p.default) for p in parameters if
+					p.default is not p.empty)
+			except AttributeError:
+				# Python 2
+				spec = inspect.getargspec(getattr(function, '__wrapped__',
+					function))
+				defaults = dict(zip(spec.args[-len(spec.defaults or ()):],
+					spec.defaults or ()))
+			self._signatures[function] = defaults
+		return ",".join("{}={}".format(name, kwargs.get(name, defaults.get(name)))
+			for name in VARIANT_PARAMETERS if name in kwargs or name in defaults)
+
+	def _finish(self, function, kwargs, record, start, end):
+		name = function.__name__
+		variant = self._variant(function, kwargs)
+		duration = end - start
+		stats = self.stats.get((name, variant))
+		if stats is None:
+			stats = OrderedDict([("calls", 0), ("total", 0.0)] +
+				[(phase, 0.0) for phase in PHASES] + [("other", 0.0),
+				("bytes", 0)])
+			self.stats[(name, variant)] = stats
+		stats["calls"] += 1
+		stats["total"] += duration
+		phase_total = 0.0
+		for phase, elapsed in record["phases"].items():
+			stats[phase] = stats.get(phase, 0.0) + elapsed
+			phase_total += elapsed
+		stats["other"] += duration - phase_total
+		stats["bytes"] += record["bytes"]
+
+		args = dict(record["phases"])
+		args["variant"] = variant
+		args["bytes"] = record["bytes"]
+		self._event(name, "drawing", start, duration, args)
+
+	def _event(self, name, category, start, duration, args=None):
+		if len(self.events) >= self.max_events:
+			self.dropped_events += 1
+			return
+		event = {
+			"name": name,
+			"cat": category,
+			"ph": "X",
+			"ts": (start - self._origin)*1e6,
+			"dur": duration*1e6,
+			"pid": os.getpid(),
+			"tid": threading.current_thread().ident,
+		}
+		if args:
+			event["args"] = args
+		self.events.append(event)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Recording of presented frames on a background writer thread.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+
+# LSD package imports
+from .util import *
+
+# misc
+import ctypes
+import os
+import threading
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+# The formats a FrameRecorder can write
+RECORDING_FORMATS = ('raw', 'png', 'npz')
+
+# Seconds stop() waits for the writer thread to take the last frames
+STOP_TIMEOUT = 10.0
+
+class FrameRecorder(object):
+	""" Captures every shown FrameBuffer and writes it to disk in the
+	background.
+
+	Frames are read back into a fixed set of preallocated buffers and handed
+	to a writer thread through a bounded queue. If the writer cannot keep up
+	and no buffer is free, the frame is dropped and counted instead of
+	stalling the presentation. Frames that cannot be written (e.g. because
+	the disk is full) are counted as well, and stop() raises an exception
+	with the first error.
+
+	The recording is written to a directory with an index.csv that lists the
+	number, the show() timestamp and the file (or offset) of every frame,
+	and depending on format:
+
+		raw: all frames in frames.raw as consecutive RGBA images
+		png: every frame in its own PNG file (requires SDL2_image)
+		npz: every frame in its own compressed NumPy file
+
+	Parameters
+	----------
+	sdl2env: SDL2Environment
+		The environment whose frames are recorded.
+	path: str
+		The directory to write the recording to. It is created if needed.
+	format: str, optional
+		One of RECORDING_FORMATS.
+	queue_size: int, optional
+		The number of frames that can wait to be written.
+	"""
+
+	def __init__(self, sdl2env, path, format='png', queue_size=8):
+		require_numpy("FrameRecorder")
+		self.environment = check_sdl2env(sdl2env)
+		if not format in RECORDING_FORMATS:
+			raise ValueError("format needs to be one of {}".format(
+				RECORDING_FORMATS))
+		queue_size = check_int_value(queue_size, min_value=1, 
+			varname="queue_size")
+		self.path = path
+		self.format = format
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+		width, height = self.environment.resolution
+		self._free = queue.Queue()
+		for _ in range(queue_size):
+			self._free.put(np.empty((height, width, 4), dtype=np.uint8))
+		self._queue = queue.Queue(queue_size)
+
+		self.frame_count = 0
+		self.dropped_count = 0
+		self.written_count = 0
+		self.error_count = 0
+		self.error = None
+		self._index = open(os.path.join(path, "index.csv"), "w")
+		self._index.write("frame,timestamp,file\n")
+		self._raw = None
+		if format == 'raw':
+			self._raw = open(os.path.join(path, "frames.raw"), "wb")
+
+		self._writer = threading.Thread(target=self._write_frames)
+		self._writer.daemon = True
+		self._writer.start()
+
+	def capture(self, framebuffer, timestamp):
+		""" Reads framebuffer back and queues it for writing. Returns False if
+		the frame had to be dropped. """
+		number = self.frame_count
+		self.frame_count += 1
+		try:
+			pixels = self._free.get_nowait()
+		except queue.Empty:
+			self.dropped_count += 1
+			return False
+		framebuffer.to_array(out=pixels)
+		self._queue.put((number, timestamp, pixels))
+		return True
+
+	def stop(self):
+		""" Writes the remaining frames and closes the recording. Raises an
+		exception if frames could not be written. """
+		if self._writer is None:
+			return
+		# The writer keeps taking frames from the queue, so this only times 
+		# out if it got stuck
+		try:
+			self._queue.put(None, timeout=STOP_TIMEOUT)
+		except queue.Full:
+			pass
+		else:
+			self._writer.join(STOP_TIMEOUT)
+		self._writer = None
+		for fp in (self._index, self._raw):
+			if not fp is None:
+				try:
+					fp.close()
+				except (IOError, OSError):
+					pass
+		if self.error_count:
+			raise Exception("Could not write {} frame(s) of the recording: "
+				"{}".format(self.error_count, self.error))
+
+	def stats(self):
+		""" Returns the number of captured, dropped and written frames. """
+		return {
+			"frames": self.frame_count,
+			"dropped": self.dropped_count,
+			"written": self.written_count,
+			"errors": self.error_count,
+		}
+
+	def _write_frames(self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				break
+			number, timestamp, pixels = item
+			try:
+				filename = self._write_frame(number, pixels)
+				self._index.write("{},{!r},{}\n".format(number, timestamp,
+					filename))
+				self.written_count += 1
+			except Exception as e:
+				# Keep taking frames, so that capture() and stop() never block
+				# on a full queue
+				self.error_count += 1
+				if self.error is None:
+					self.error = e
+			finally:
+				self._free.put(pixels)
+
+	def _write_frame(self, number, pixels):
+		""" Writes one frame and returns where it went. """
+		if self.format == 'raw':
+			offset = self._raw.tell()
+			self._raw.write(pixels.tobytes())
+			return "frames.raw@{}".format(offset)
+
+		filename = "frame_{:06d}.{}".format(number, self.format)
+		filepath = os.path.join(self.path, filename)
+		if self.format == 'npz':
+			np.savez_compressed(filepath, pixels=pixels)
+		else:
+			from sdl2 import sdlimage
+			height, width = pixels.shape[:2]
+			surface = sdl2.SDL_CreateRGBSurfaceWithFormatFrom(
+				ctypes.c_void_p(pixels.ctypes.data), width, height, 32, width*4,
+				sdl2.SDL_PIXELFORMAT_RGBA32)
+			if not surface:
+				raise Exception("Could not create surface for frame: "
+					"{}".format(sdl2.SDL_GetError()))
+			try:
+				if sdlimage.IMG_SavePNG(surface, 
+					sdl2.ext.compat.byteify(filepath, 'utf8')) != 0:
+					raise Exception("Could not save frame: "
+						"{}".format(sdl2.SDL_GetError()))
+			finally:
+				sdl2.SDL_FreeSurface(surface)
+		return filename
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of rendered textures.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+
+# misc
+import ctypes
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+# Default size limit of the cache directory: 512 MB
+DEFAULT_RENDER_CACHE_SIZE = 512*1024*1024
+
+# Blob layout: magic, format version, width, height, alpha mod and blend mode,
+# followed by the RGBA32 pixels without padding
+BLOB_HEADER = struct.Struct(str("<4sIIIII"))
+BLOB_MAGIC = b"LSDR"
+BLOB_VERSION = 1
+BLOB_EXTENSION = ".rgba"
+
+def default_cache_directory():
+	""" The directory the render cache uses if none is given. """
+	base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+		os.path.expanduser("~"), ".cache")
+	return os.path.join(base, "LSD", "render")
+
+class RenderCache(object):
+	""" Stores rendered textures as raw pixel files so that they do not need
+	to be rasterized again in later sessions.
+
+	Entries are identified by a hash of their (normalized) parameters, the
+	LSD and SDL2 versions and the renderer, so a change in any of these
+	never loads stale pixels. On a hit, the file is memory-mapped and its
+	pixels are uploaded straight into a texture. When the files take more
+	than max_bytes, the least recently used ones are deleted.
+
+	Enable it with SDL2Environment.enable_render_cache(); the drawing
+	functions then use it for the shapes they cache, and FrameBuffers can
+	be stored and restored with store_framebuffer() and load_framebuffer().
+
+	Parameters
+	----------
+	sdl2env: SDL2Environment
+		The environment the textures are created in.
+	directory: str, optional
+		The cache directory. Defaults to default_cache_directory().
+	max_bytes: int, optional
+		The maximum total size of the cached files.
+	"""
+
+	def __init__(self, sdl2env, directory=None, max_bytes=DEFAULT_RENDER_CACHE_SIZE):
+		self.environment = sdl2env
+		if directory is None:
+			directory = default_cache_directory()
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+		info = sdl2.SDL_RendererInfo()
+		sdl2.SDL_GetRendererInfo(sdl2env.renderer.sdlrenderer, info)
+		self._salt = [BLOB_VERSION, sdl2env.lsd_version, sdl2env.sdl2_version,
+			info.name.decode('utf8') if info.name else None]
+
+		# Size and time of last use of every file, by file name
+		self._files = {}
+		for name in os.listdir(directory):
+			if name.endswith(BLOB_EXTENSION):
+				stat = os.stat(os.path.join(directory, name))
+				self._files[name] = [stat.st_size, stat.st_mtime]
+		self._evict()
+
+	def __len__(self):
+		return len(self._files)
+
+	@property
+	def nbytes(self):
+		""" The total size of the cached files. """
+		return sum(size for size, _ in self._files.values())
+
+	def stats(self):
+		return {
+			"entries": len(self),
+			"bytes": self.nbytes,
+			"max_bytes": self.max_bytes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+		}
+
+	def hash_key(self, key):
+		""" The stable hash of a key (a JSON serializable tuple of parameters)
+		that names its file. """
+		data = json.dumps(self._salt + [key], sort_keys=True,
+			separators=(',', ':'))
+		return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+	def load(self, key):
+		""" Returns a new TextureSprite with the pixels stored under key, or
+		None if there are none. """
+		path = self._lookup(key)
+		if path is None:
+			return None
+		try:
+			with open(path, 'rb') as fp:
+				blob = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY)
+			try:
+				return self._upload(blob)
+			finally:
+				blob.close()
+		except (IOError, OSError, ValueError):
+			# A damaged or concurrently deleted file counts as a miss
+			self._remove(os.path.basename(path))
+			self.hits -= 1
+			self.misses += 1
+			return None
+
+	def store(self, key, sprite):
+		""" Writes the pixels of the (target) texture of sprite under key. """
+		width, height = sprite.size
+		pixels = (ctypes.c_uint8 * (width*height*4))()
+		sdlrenderer = self.environment.renderer.sdlrenderer
+		if sdl2.SDL_SetRenderTarget(sdlrenderer, sprite.texture) != 0:
+			raise Exception("Could not set texture as rendering target: "
+				"{}".format(sdl2.SDL_GetError()))
+		try:
+			if sdl2.SDL_RenderReadPixels(sdlrenderer, None,
+				sdl2.SDL_PIXELFORMAT_RGBA32, pixels, width*4) != 0:
+				raise Exception("Could not read texture pixels: "
+					"{}".format(sdl2.SDL_GetError()))
+		finally:
+			sdl2.SDL_SetRenderTarget(sdlrenderer, None)
+
+		alpha = ctypes.c_uint8()
+		sdl2.SDL_GetTextureAlphaMod(sprite.texture, ctypes.byref(alpha))
+		blend_mode = sdl2.SDL_BlendMode()
+		sdl2.SDL_GetTextureBlendMode(sprite.texture, ctypes.byref(blend_mode))
+		self._write(key, width, height, alpha.value, blend_mode.value, pixels)
+
+	def load_framebuffer(self, key, framebuffer):
+		""" Replaces the contents of framebuffer with those stored under key.
+		Returns False, leaving the buffer as it is, if there are none. """
+		sprite = self.load(key)
+		if sprite is None:
+			return False
+		if tuple(sprite.size) != tuple(framebuffer.environment.resolution):
+			return False
+		framebuffer._replace_contents(sprite)
+		return True
+
+	def store_framebuffer(self, key, framebuffer):
+		""" Writes the contents of framebuffer under key. """
+		width, height = framebuffer.environment.resolution
+		pixels = (ctypes.c_uint8 * (width*height*4))()
+		framebuffer._read_pixels(ctypes.addressof(pixels), width*4)
+		self._write(key, width, height, 255, sdl2.SDL_BLENDMODE_NONE, pixels)
+
+	def clear(self):
+		""" Deletes all cached files. """
+		for name in list(self._files):
+			self._remove(name)
+
+	def _lookup(self, key):
+		name = self.hash_key(key) + BLOB_EXTENSION
+		entry = self._files.get(name)
+		if entry is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		path = os.path.join(self.directory, name)
+		# The modification time records the last use across sessions
+		try:
+			os.utime(path, None)
+			entry[1] = os.path.getmtime(path)
+		except OSError:
+			pass
+		return path
+
+	def _upload(self, blob):
+		magic, version, width, height, alpha, blend_mode = \
+			BLOB_HEADER.unpack_from(blob)
+		if magic != BLOB_MAGIC or version != BLOB_VERSION or \
+			len(blob) != BLOB_HEADER.size + width*height*4:
+			raise ValueError("Invalid render cache file")
+		sprite = self.environment.texture_factory.create_sprite(
+			size=(width, height),
+			pformat=sdl2.SDL_PIXELFORMAT_RGBA32
+		)
+		pixels = (ctypes.c_uint8 * (width*height*4)).from_buffer(blob,
+			BLOB_HEADER.size)
+		try:
+			if sdl2.SDL_UpdateTexture(sprite.texture, None, pixels, width*4) != 0:
+				raise Exception("Could not upload cached pixels to texture: "
+					"{}".format(sdl2.SDL_GetError()))
+		finally:
+			# The mapping can only be closed when no ctypes object refers to it
+			del pixels
+		sdl2.SDL_SetTextureAlphaMod(sprite.texture, alpha)
+		sdl2.SDL_SetTextureBlendMode(sprite.texture, blend_mode)
+		return sprite
+
+	def _write(self, key, width, height, alpha, blend_mode, pixels):
+		name = self.hash_key(key) + BLOB_EXTENSION
+		path = os.path.join(self.directory, name)
+		# Write to a temporary file first, so that other processes never
+		# see a partially written file
+		tmp_path = "{}.{}.tmp".format(path, os.getpid())
+		with open(tmp_path, 'wb') as fp:
+			fp.write(BLOB_HEADER.pack(BLOB_MAGIC, BLOB_VERSION, width, height,
+				alpha, blend_mode))
+			fp.write(memoryview(pixels))
+		if os.path.exists(path):
+			os.remove(path)
+		os.rename(tmp_path, path)
+		stat = os.stat(path)
+		self._files[name] = [stat.st_size, stat.st_mtime]
+		self._evict()
+
+	def _remove(self, name):
+		self._files.pop(name, None)
+		try:
+			os.remove(os.path.join(self.directory, name))
+		except OSError:
+			pass
+
+	def _evict(self):
+		""" Deletes the least recently used files until the cache fits. """
+		total = self.nbytes
+		if total <= self.max_bytes:
+			return
+		for name, (size, _) in sorted(self._files.items(),
+			key=lambda item: item[1][1]):
+			if total <= self.max_bytes:
+				break
+			self._remove(name)
+			total -= size
+			self.evictions += 1
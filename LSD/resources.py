@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+Recycling of textures and surfaces.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+import sdl2.ext
+
+# LSD imports
+from . import profiling
+
+# misc
+from collections import OrderedDict
+import ctypes
+import warnings
+import weakref
+
+# ResourceWarning does not exist in Python 2
+try:
+	ResourceWarning
+except NameError:
+	ResourceWarning = RuntimeWarning
+
+# Default memory budget for the unused textures and surfaces a pool keeps:
+# 128 MB
+DEFAULT_POOL_SIZE = 128*1024*1024
+
+# Scratch resources are rounded up to multiples of this many pixels, so that
+# shapes of similar sizes can share them
+SCRATCH_GRANULARITY = 64
+
+def round_up_size(size, granularity=SCRATCH_GRANULARITY):
+	""" Rounds (width, height) up to multiples of granularity. """
+	return tuple(-(-int(v)//granularity)*granularity for v in size)
+
+class ResourcePool(object):
+	""" Keeps released textures and surfaces so they can be handed out again
+	instead of allocating new ones.
+
+	Resources are recycled by class: textures by (width, height, pixel
+	format, access) and surfaces by (width, height, pixel format). Scratch
+	resources, which are only used for a moment while drawing, can be 
+	rounded up in size (see round_up_size()) so that they are shared by
+	shapes of similar sizes; their users only use the top left part. A recycled
+	texture has its alpha mod, color mod and blend mode reset, but its
+	pixels are left as they were, so the caller needs to overwrite or clear
+	them. When the released resources take more than max_bytes, the ones
+	that were released the longest ago are freed.
+
+	Parameters
+	----------
+	sdl2env: SDL2Environment
+		The environment whose factories create the resources.
+	max_bytes: int, optional
+		The maximum size of the unused resources the pool keeps.
+	"""
+
+	def __init__(self, sdl2env, max_bytes=DEFAULT_POOL_SIZE):
+		self.environment = sdl2env
+		self.max_bytes = max_bytes
+		self.allocations = 0
+		self.reuses = 0
+		self.clear()
+
+	def __len__(self):
+		return len(self._free)
+
+	def stats(self):
+		return {
+			"free": len(self),
+			"bytes": self.nbytes,
+			"max_bytes": self.max_bytes,
+			"allocations": self.allocations,
+			"reuses": self.reuses,
+		}
+
+	def acquire_texture(self, size, pformat=sdl2.SDL_PIXELFORMAT_RGBA8888,
+		access=sdl2.SDL_TEXTUREACCESS_STATIC, round_up=False):
+		""" Returns a TextureSprite of this size, format and access, or of the
+		size rounded up if round_up is True. """
+		if round_up:
+			size = round_up_size(size)
+		key = ('texture', size[0], size[1], pformat, access)
+		sprite = self._take(key)
+		if sprite is None:
+			self.allocations += 1
+			return self.environment.texture_factory.create_sprite(size=size,
+				pformat=pformat, access=access)
+		sdl2.SDL_SetTextureAlphaMod(sprite.texture, 255)
+		sdl2.SDL_SetTextureColorMod(sprite.texture, 255, 255, 255)
+		sdl2.SDL_SetTextureBlendMode(sprite.texture, sdl2.SDL_BLENDMODE_BLEND if
+			sdl2.SDL_ISPIXELFORMAT_ALPHA(pformat) else sdl2.SDL_BLENDMODE_NONE)
+		return sprite
+
+	def release_texture(self, sprite):
+		""" Hands a texture from acquire_texture() back to the pool. """
+		pformat, access = sdl2.Uint32(), ctypes.c_int()
+		if sdl2.SDL_QueryTexture(sprite.texture, ctypes.byref(pformat),
+			ctypes.byref(access), None, None) != 0:
+			return
+		width, height = sprite.size
+		self._put(('texture', width, height, pformat.value, access.value),
+			sprite, width*height*sdl2.SDL_BYTESPERPIXEL(pformat.value))
+
+	def acquire_scratch(self, size):
+		""" Returns a (SoftwareSprite, software Renderer) pair to draw on in 
+		system memory, of at least this size (rounded up). """
+		size = round_up_size(size)
+		key = ('scratch', size[0], size[1])
+		scratch = self._take(key)
+		if scratch is None:
+			self.allocations += 1
+			sprite = self.environment.texture_factory.create_software_sprite(
+				size=size)
+			scratch = (sprite, sdl2.ext.Renderer(sprite))
+		return scratch
+
+	def release_scratch(self, scratch):
+		""" Hands a pair from acquire_scratch() back to the pool. """
+		sprite = scratch[0]
+		surface = sprite.surface
+		sdl2.SDL_SetColorKey(surface, sdl2.SDL_FALSE, 0)
+		sdl2.SDL_SetSurfaceRLE(surface, 0)
+		self._put(('scratch', surface.w, surface.h), scratch,
+			surface.pitch*surface.h)
+
+	def acquire_surface(self, size, pformat=sdl2.SDL_PIXELFORMAT_ARGB8888,
+		round_up=False):
+		""" Returns a SoftwareSprite of this size and pixel format, or of the
+		size rounded up if round_up is True. """
+		if round_up:
+			size = round_up_size(size)
+		key = ('surface', size[0], size[1], pformat)
+		sprite = self._take(key)
+		if sprite is None:
+			self.allocations += 1
+			surface = sdl2.SDL_CreateRGBSurfaceWithFormat(0, size[0], size[1],
+				sdl2.SDL_BITSPERPIXEL(pformat), pformat)
+			if not surface:
+				raise Exception("Could not create surface: "
+					"{}".format(sdl2.SDL_GetError()))
+			sprite = sdl2.ext.SoftwareSprite(surface.contents, True)
+		return sprite
+
+	def release_surface(self, sprite):
+		""" Hands a surface from acquire_surface() back to the pool. """
+		surface = sprite.surface
+		self._put(('surface', surface.w, surface.h, surface.format.contents.format),
+			sprite, surface.pitch*surface.h)
+
+	@property
+	def nbytes(self):
+		""" The size of the unused resources. """
+		return self._nbytes
+
+	def clear(self):
+		""" Frees all unused resources. Needs to be called before the renderer
+		is destroyed. """
+		self._free = OrderedDict()
+		self._by_key = {}
+		self._nbytes = 0
+		self._serial = 0
+
+	def forget(self, sprite):
+		""" Removes a released resource from the pool without freeing it. """
+		for serial, (key, resource, nbytes) in list(self._free.items()):
+			if resource is sprite or (isinstance(resource, tuple) and 
+				resource[0] is sprite):
+				del self._free[serial]
+				self._by_key[key].remove(serial)
+				self._nbytes -= nbytes
+
+	def _take(self, key):
+		serials = self._by_key.get(key)
+		if not serials:
+			return None
+		key, resource, nbytes = self._free.pop(serials.pop())
+		self._nbytes -= nbytes
+		self.reuses += 1
+		return resource
+
+	def _put(self, key, resource, nbytes):
+		self._serial += 1
+		self._free[self._serial] = (key, resource, nbytes)
+		self._by_key.setdefault(key, []).append(self._serial)
+		self._nbytes += nbytes
+		# Free the resources that were released the longest ago
+		while self._nbytes > self.max_bytes and self._free:
+			serial, (key, _, nbytes) = self._free.popitem(last=False)
+			self._by_key[key].remove(serial)
+			self._nbytes -= nbytes
+
+class TrackingSpriteFactory(sdl2.ext.SpriteFactory):
+	""" SpriteFactory that registers every texture it creates with a
+	ResourceTracker. The environment sets the tracker. """
+
+	tracker = None
+
+	def from_surface(self, tsurface, free=False):
+		# Converting a surface uploads its pixels to a new texture
+		return self._track(profiling.timed('upload', super(
+			TrackingSpriteFactory, self).from_surface, tsurface, free))
+
+	def create_texture_sprite(self, renderer, size,
+		pformat=sdl2.SDL_PIXELFORMAT_RGBA8888,
+		access=sdl2.SDL_TEXTUREACCESS_STATIC):
+		return self._track(super(TrackingSpriteFactory, self
+			).create_texture_sprite(renderer, size, pformat, access))
+
+	def _track(self, sprite):
+		if not self.tracker is None and isinstance(sprite, 
+			sdl2.ext.TextureSprite):
+			self.tracker.track(sprite)
+		return sprite
+
+def texture_size(sprite):
+	""" The number of bytes the texture of a TextureSprite takes. """
+	pformat = sdl2.Uint32()
+	if sdl2.SDL_QueryTexture(sprite.texture, ctypes.byref(pformat), None, None,
+		None) != 0:
+		return 0
+	width, height = sprite.size
+	return width*height*sdl2.SDL_BYTESPERPIXEL(pformat.value)
+
+class ResourceTracker(object):
+	""" Keeps count of the live textures LSD has created and their size, and
+	enforces a budget for their total size.
+
+	The environment's texture factory registers every texture it creates,
+	and a texture is unregistered as soon as its sprite is garbage 
+	collected. If a new texture brings the total over the budget, the 
+	eviction hooks are called in order with (tracker, excess bytes) until 
+	the total fits again; the environment installs hooks that empty its
+	resource pool and drop the least recently used shapes and images from
+	its caches. If that does not suffice, a ResourceWarning is issued.
+
+	Parameters
+	----------
+	sdl2env: SDL2Environment
+		The environment whose textures are tracked.
+	budget: int, optional
+		The maximum total size of the textures in bytes, or None for no limit.
+	"""
+
+	def __init__(self, sdl2env, budget=None):
+		self.environment = sdl2env
+		self.budget = budget
+		self.eviction_hooks = []
+		# (weakref, nbytes) of every live texture, by id of its sprite
+		self._live = {}
+		self._scopes = []
+		self.nbytes = 0
+		self.peak_bytes = 0
+		self.created = 0
+		self.released = 0
+		self._warned = False
+
+	def __len__(self):
+		return len(self._live)
+
+	def stats(self):
+		return {
+			"textures": len(self),
+			"bytes": self.nbytes,
+			"peak_bytes": self.peak_bytes,
+			"budget": self.budget,
+			"created": self.created,
+			"released": self.released,
+		}
+
+	def live(self):
+		""" Returns (sprite, nbytes) for every live texture. """
+		result = []
+		for ref, nbytes in list(self._live.values()):
+			sprite = ref()
+			if not sprite is None:
+				result.append((sprite, nbytes))
+		return result
+
+	def track(self, sprite):
+		""" Registers a TextureSprite. """
+		key = id(sprite)
+		if key in self._live:
+			return sprite
+		nbytes = texture_size(sprite)
+		# The callback runs when the sprite is collected, which also frees 
+		# its texture
+		ref = weakref.ref(sprite, lambda ref, key=key: self._forget(key))
+		self._live[key] = (ref, nbytes)
+		self.nbytes += nbytes
+		self.peak_bytes = max(self.peak_bytes, self.nbytes)
+		self.created += 1
+		profiling.record_bytes(nbytes)
+		for scope in self._scopes:
+			scope.append(ref)
+		self._check_budget()
+		return sprite
+
+	def release(self, obj):
+		""" Destroys the texture of obj right away: a TextureSprite, or the 
+		sprite of a TextureHandle. The texture is removed from the caches of 
+		the environment first, but anything else that still uses it becomes
+		invalid. FrameBuffers are handed back to the resource pool. """
+		from .screen import FrameBuffer
+		if isinstance(obj, FrameBuffer):
+			obj.release()
+			return
+		sprite = getattr(obj, 'sprite', obj)
+		self.environment.forget_texture(sprite)
+		if not sprite.texture is None:
+			sdl2.SDL_DestroyTexture(sprite.texture)
+			# Keep the sprite from destroying the texture again
+			sprite.texture = None
+		self._forget(id(sprite))
+
+	def scope(self, destroy=False):
+		""" Returns a context manager that releases the textures created 
+		within it when it exits.
+
+		By default, the environment only drops its own references to them 
+		(from its caches and resource pool), so that they are freed as soon as
+		the objects that still use them are gone. With destroy=True they are 
+		destroyed right away, as with release().
+		"""
+		return TrackingScope(self, destroy)
+
+	def _forget(self, key):
+		entry = self._live.pop(key, None)
+		if not entry is None:
+			self.nbytes -= entry[1]
+			self.released += 1
+
+	def _check_budget(self):
+		if self.budget is None or self.nbytes <= self.budget:
+			self._warned = False
+			return
+		for hook in self.eviction_hooks:
+			hook(self, self.nbytes - self.budget)
+			if self.nbytes <= self.budget:
+				self._warned = False
+				return
+		if not self._warned:
+			self._warned = True
+			warnings.warn("LSD textures take {} bytes, which exceeds the budget "
+				"of {} bytes".format(self.nbytes, self.budget), ResourceWarning)
+
+class TrackingScope(object):
+	""" Context manager returned by ResourceTracker.scope(). """
+
+	def __init__(self, tracker, destroy=False):
+		self.tracker = tracker
+		self.destroy = destroy
+		self._refs = []
+
+	def __enter__(self):
+		self.tracker._scopes.append(self._refs)
+		return self
+
+	def __exit__(self, *args):
+		self.tracker._scopes.remove(self._refs)
+		self.release()
+
+	def release(self):
+		""" Releases the textures created in the scope so far. """
+		for ref in self._refs:
+			sprite = ref()
+			if sprite is None:
+				continue
+			if self.destroy:
+				self.tracker.release(sprite)
+			else:
+				self.tracker.environment.forget_texture(sprite)
+		del self._refs[:]
@@ -16,22 +16,67 @@ from __future__ import unicode_literals
 # SDL2 libraries
 import sdl2
 import sdl2.ext
-from sdl2 import sdlgfx
 
 # LSD package libraries
 from .util import *
 
 # misc
 from functools import wraps
+import ctypes
+import math
 import time
+import weakref
+
+# The number of separate damaged rectangles a FrameBuffer tracks before they
+# are merged into their bounding box
+MAX_DAMAGE_RECTS = 32
+
+def command_bounds(command):
+	""" The (x, y, w, h) rect a draw command covers, including rotation. """
+	x, y, w, h = command[3]
+	angle, center = command[4], command[5]
+	if angle:
+		# The bounding box of the rotated rect
+		cx, cy = center if not center is None else (w/2.0, h/2.0)
+		cos_a = math.cos(math.radians(angle))
+		sin_a = math.sin(math.radians(angle))
+		xs, ys = [], []
+		for px, py in ((0, 0), (w, 0), (w, h), (0, h)):
+			px, py = px - cx, py - cy
+			xs.append(x + cx + px*cos_a - py*sin_a)
+			ys.append(y + cy + px*sin_a + py*cos_a)
+		x, y = int(math.floor(min(xs))) - 1, int(math.floor(min(ys))) - 1
+		w = int(math.ceil(max(xs))) - x + 2
+		h = int(math.ceil(max(ys))) - y + 2
+	return (x, y, w, h)
+
+def union_bounds(rects):
+	""" The bounding box of (x, y, w, h) rects, or None if there are none. """
+	rects = list(rects)
+	if not rects:
+		return None
+	x1 = min(r[0] for r in rects)
+	y1 = min(r[1] for r in rects)
+	x2 = max(r[0] + r[2] for r in rects)
+	y2 = max(r[1] + r[3] for r in rects)
+	return (x1, y1, x2 - x1, y2 - y1)
+
+def _check_released(sprite):
+	""" Raises an error if the texture of sprite has been destroyed with
+	ResourceTracker.release(). """
+	if getattr(sprite, 'texture', None) is None:
+		raise ValueError("The texture was released and cannot be drawn "
+			"anymore")
 
 class FrameBuffer(object):
 
-	def __init__(self, sdl2env=None, background_color=0):
+	def __init__(self, sdl2env=None, background_color=0, deferred=False,
+		incremental=False):
 		self.environment = check_sdl2env(sdl2env)
 		
-		self.surface = self.environment.texture_factory.create_sprite(
-			size=self.environment.resolution,
+		# A recycled texture is fine, as it is cleared below
+		self.surface = self.environment.resource_pool.acquire_texture(
+			self.environment.resolution,
 			access=sdl2.SDL_TEXTUREACCESS_TARGET
 		)
 
@@ -40,15 +85,46 @@ class FrameBuffer(object):
 		# Low-level SDL renderer (needs to be passed to all sdlgfx functions)
 		self.sdl_renderer = self.renderer.sdlrenderer
 
-		# Renderer for images (sprites) as textures
-		self.spriterenderer = self.environment.texture_factory.create_sprite_render_system()
+		# In deferred mode, add() only records the draw commands and flush()
+		# submits them all at once under a single render target bind.
+		self.deferred = deferred
+		self._commands = []
+		self._pending_clear = None
+
+		# In incremental mode, show() only copies the regions that changed
+		# since the last show() if the backbuffer still holds this buffer.
+		# The damaged regions are tracked as (x, y, w, h); None means all of it.
+		self.incremental = incremental
+		self._damage = None
 
 		# Renderer for images (sprites) as surfaces (software mode)
 		self.background_color = sdl2.ext.convert_to_color(background_color)
 		self.clear()
 
 		# Add this buffer to the list of active framebuffers in the environment
-		self.environment.active_framebuffers.append(self)
+		self.environment.active_framebuffers.add(self)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.release()
+
+	@property
+	def spriterenderer(self):
+		""" Renderer for images (sprites) as textures. """
+		return self.environment.sprite_renderer
+
+	def release(self):
+		""" Hands the texture of the buffer back to the environment's resource
+		pool, so that a new FrameBuffer can reuse it. The buffer cannot be 
+		used anymore afterwards. """
+		if getattr(self, 'surface', None) is None:
+			return
+		self.environment.active_framebuffers.discard(self)
+		self.environment.resource_pool.release_texture(self.surface)
+		self.surface = None
+		del self._commands[:]
 
 	# Decorator
 	def to_texture(function):
@@ -66,16 +142,242 @@ class FrameBuffer(object):
 			return result
 		return wrapped
 
-	@to_texture
 	def clear(self, color=None):
 		if color is None:
 			color = self.background_color
 		color = sdl2.ext.convert_to_color(color)
-		self.renderer.clear(color)
+		self._damage = None
+		if self.deferred:
+			# Everything recorded before the clear would be overwritten anyway
+			del self._commands[:]
+			self._pending_clear = color
+			return self
+		self._submit([], color)
+		return self
+
+	def clear_rect(self, rect, color=None):
+		""" Fills rect (x, y, w, h) with the background color, or with color.
+		Unlike clear(), this only damages the rect, so it is the way to erase
+		e.g. a moving cursor from an incremental buffer. """
+		if color is None:
+			color = self.background_color
+		color = sdl2.ext.convert_to_color(color)
+		if self.deferred:
+			self.flush()
+		self._fill_rect(tuple(int(v) for v in rect), color)
+		self.mark_damaged(rect)
 		return self
 
 	@to_texture
+	def _fill_rect(self, rect, color):
+		sdl2.SDL_SetRenderDrawBlendMode(self.sdl_renderer, sdl2.SDL_BLENDMODE_NONE)
+		self.renderer.fill([rect], color)
+
 	def add(self, texture, **kwargs):
+		command = self._placement(texture, **kwargs)
+		self._damage_command(command)
+		if self.deferred:
+			self._commands.append(command)
+		else:
+			self._submit([command])
+		return self
+
+	def add_placements(self, placements):
+		""" Adds all items of a PlacementSet, as returned by the batch drawing
+		functions, in one go. """
+		for sprite in placements.sprites:
+			_check_released(sprite)
+		commands = placements.commands()
+		for command in commands:
+			self._damage_command(command)
+		if self.deferred:
+			self._commands.extend(commands)
+		else:
+			self._submit(commands)
+		return self
+
+	def add_array(self, pixels, x=0, y=0, opacity=1.0):
+		""" Uploads a NumPy array with drawing.array() and adds it at (x, y).
+
+		The array goes through the streaming texture that is reused for all 
+		arrays of the same size and format, so it is copied right away, even
+		in deferred mode (after the commands that were recorded before it).
+		"""
+		from .drawing import array
+		handle = array(pixels, x=x, y=y, opacity=opacity, 
+			sdl2env=self.environment)
+		if self.deferred:
+			self.flush()
+		command = self._placement(handle)
+		self._damage_command(command)
+		self._submit([command])
+		return self
+
+	def add_geometry(self, batch):
+		""" Draws a GeometryBatch on the buffer with a single 
+		SDL_RenderGeometry call.
+
+		In deferred mode, the commands recorded before it are flushed first so
+		that the batch ends up on top of them.
+		"""
+		if self.deferred:
+			self.flush()
+		vertices, _ = batch.vertices()
+		if len(vertices):
+			x, y = vertices['x'], vertices['y']
+			x1, y1 = int(math.floor(x.min())), int(math.floor(y.min()))
+			self.mark_damaged((x1, y1, int(math.ceil(x.max())) - x1 + 1,
+				int(math.ceil(y.max())) - y1 + 1))
+		self._render_geometry(batch)
+		return self
+
+	@to_texture
+	def _render_geometry(self, batch):
+		batch.render()
+
+	def add_text(self, text):
+		""" Draws a TextHandle (see drawing.ttf_text()) on the buffer.
+
+		In deferred mode, the commands recorded before it are flushed first so
+		that the text ends up on top of them.
+		"""
+		if self.deferred:
+			self.flush()
+		self.mark_damaged((int(text.x), int(text.y), text.size[0]+1,
+			text.size[1]+1))
+		self._render_text(text)
+		return self
+
+	@to_texture
+	def _render_text(self, text):
+		text.render(self.sdl_renderer)
+
+	def replay(self, display_list):
+		""" Performs the recorded operations of a DisplayList on this buffer.
+
+		The commands of the list were validated and converted when they were
+		recorded, so replaying only submits them (or, in deferred mode, 
+		appends them to the pending commands).
+		"""
+		if not display_list.environment is self.environment:
+			raise ValueError("The display list was recorded for a different "
+				"environment")
+		for kind, value, bounds in display_list.operations():
+			if kind == 'copy':
+				if not bounds is None:
+					self.mark_damaged(bounds)
+				if self.deferred:
+					self._commands.extend(value)
+				else:
+					self._submit(value)
+			elif kind == 'clear':
+				self.clear(value)
+			elif kind == 'text':
+				self.add_text(value)
+			elif kind == 'geometry':
+				self.add_geometry(value)
+		return self
+
+	@property
+	def damage(self):
+		""" The regions that changed since the last show(), as a list of 
+		(x, y, w, h) rects, or None if the whole buffer needs to be copied. """
+		return None if self._damage is None else list(self._damage)
+
+	def mark_damaged(self, rect=None):
+		""" Marks rect (x, y, w, h), or the whole buffer, as changed, so that
+		an incremental show() copies it. Call this after drawing on the
+		buffer's texture by other means than the methods of this class. """
+		if rect is None:
+			self._damage = None
+			return self
+		if self._damage is None:
+			return self
+		width, height = self.environment.resolution
+		x, y, w, h = rect
+		x1, y1 = max(0, int(x)), max(0, int(y))
+		x2, y2 = min(width, int(x) + int(w)), min(height, int(y) + int(h))
+		if x2 <= x1 or y2 <= y1:
+			return self
+		self._damage.append((x1, y1, x2 - x1, y2 - y1))
+		if len(self._damage) > MAX_DAMAGE_RECTS:
+			self._damage = [union_bounds(self._damage)]
+		return self
+
+	def _damage_command(self, command):
+		""" Marks the destination of a draw command as damaged. """
+		if not self._damage is None:
+			self.mark_damaged(command_bounds(command))
+
+	def _presented(self):
+		""" Checks if the backbuffer holds the contents of this buffer. """
+		presented = self.environment.presented_framebuffer
+		return not presented is None and presented() is self
+
+	@property
+	def pending(self):
+		""" The number of recorded draw commands that are not flushed yet. """
+		return len(self._commands)
+
+	def flush(self, sort=False):
+		""" Submits all recorded draw commands under a single render target bind.
+
+		Parameters
+		----------
+		sort: bool, optional
+			Sort the commands by blend mode, texture and opacity before they are
+			submitted, so that the renderer can batch the copies and texture state
+			only changes when needed. The sort is stable, so placements of the 
+			same texture keep their order, but overlapping placements of 
+			different textures may end up in a different stacking order. Only
+			pass True if the commands do not overlap or their order does not
+			matter; by default they are drawn in the order they were added.
+		"""
+		if self._pending_clear is None and not self._commands:
+			return self
+		commands = self._commands
+		if sort and len(commands) > 1:
+			blend_modes = {}
+			def state_key(command):
+				texture, alpha = command[0].texture, command[1]
+				address = ctypes.addressof(texture)
+				if not address in blend_modes:
+					blend_mode = sdl2.SDL_BlendMode()
+					sdl2.SDL_GetTextureBlendMode(texture, ctypes.byref(blend_mode))
+					blend_modes[address] = blend_mode.value
+				return (blend_modes[address], address, 
+					-1 if alpha is None else alpha)
+			commands = sorted(commands, key=state_key)
+		self._submit(commands, self._pending_clear)
+		self._commands = []
+		self._pending_clear = None
+		return self
+
+	@to_texture
+	def _submit(self, commands, clear_color=None):
+		""" Performs the clear (if any) and the draw commands on the texture. """
+		if not clear_color is None:
+			self.renderer.clear(clear_color)
+		current_alpha = {}
+		for source, alpha, srcrect, dest_rect, angle, center, flip in commands:
+			texture = source.texture
+			if texture is None:
+				_check_released(source)
+			# Only change the texture's alpha mod when it differs from the 
+			# value that was set for this texture the last time
+			address = ctypes.addressof(texture)
+			if not alpha is None and current_alpha.get(address) != alpha:
+				sdl2.SDL_SetTextureAlphaMod(texture, alpha)
+				current_alpha[address] = alpha
+			self.renderer.copy(texture, srcrect=srcrect, dstrect=dest_rect, 
+				angle=angle, center=center, flip=flip)
+
+	@staticmethod
+	def _placement(texture, **kwargs):
+		""" Converts the arguments of add() to a draw command tuple. """
+		sprite = getattr(texture, 'sprite', texture)
+		_check_released(sprite)
+
 		# Fails if x or y = 0, which is a valid use case. FIX!
 		x = kwargs.get('x', None)
 		if type(x) != int:
@@ -89,10 +391,13 @@ class FrameBuffer(object):
 			if type(y) != int:
 				raise ValueError("y coordinate not specified")
 		
-		# Set the desired transparency value to the texture
+		# Determine the transparency value for this copy. Textures can be
+		# shared by several placements, so it is set again for every copy.
 		alpha = kwargs.get('opacity', None)
-		if alpha:
-			sdl2.SDL_SetTextureAlphaMod(texture.texture, self.opacity(alpha))
+		if alpha is None:
+			alpha = getattr(texture, 'opacity', None)
+		if not alpha is None:
+			alpha = convert_opacity(alpha)
 
 		angle = kwargs.get('angle', None) 
 		if type(angle) != int:
@@ -110,18 +415,109 @@ class FrameBuffer(object):
 			flip = sdl2.SDL_FLIP_NONE
 
 		rotation_center = kwargs.get('rotation_center', None)
-		if not type(rotation_center) in [tuple,list] or len(rotation_center) == 2:
+		if not type(rotation_center) in [tuple,list] or len(rotation_center) != 2:
 			rotation_center = texture.center
+		if not type(rotation_center) in [tuple,list]:
+			rotation_center = None
+
+		# Only a part of the texture is drawn for handles with a source rect
+		srcrect = getattr(texture, 'srcrect', None)
 
 		# Calculate the dest_rect and copy the texture
 		dest_rect = (x, y, texture.size[0], texture.size[1])
 
-		self.renderer.copy(texture, dstrect=dest_rect, angle=angle, flip=flip)
+		# The command refers to the sprite rather than to its SDL_Texture,
+		# which keeps the texture alive until the command is submitted (the
+		# sprite of an atlas handle is the page the srcrect is on)
+		return (sprite, alpha, srcrect, dest_rect, angle, rotation_center, flip)
+
+	def _replace_contents(self, sprite):
+		""" Overwrites the whole buffer with the texture of sprite, dropping
+		the recorded commands. """
+		del self._commands[:]
+		self._pending_clear = None
+		sdl2.SDL_SetTextureBlendMode(sprite.texture, sdl2.SDL_BLENDMODE_NONE)
+		self._submit([(sprite, None, None, (0, 0) + tuple(sprite.size),
+			0, None, sdl2.SDL_FLIP_NONE)])
+		self._damage = None
+
+	def to_array(self, out=None):
+		""" Returns the contents of the buffer as a (height, width, 4) uint8
+		NumPy array with RGBA values.
+
+		Parameters
+		----------
+		out: numpy.ndarray, optional
+			A preallocated C-contiguous array of that shape and type to read 
+			the pixels into, so that repeated readbacks do not allocate.
+		"""
+		require_numpy("FrameBuffer.to_array")
+		width, height = self.environment.resolution
+		if out is None:
+			out = np.empty((height, width, 4), dtype=np.uint8)
+		elif out.shape != (height, width, 4) or out.dtype != np.uint8 or \
+			not out.flags['C_CONTIGUOUS']:
+			raise ValueError("out needs to be a C-contiguous uint8 array with "
+				"shape {}".format((height, width, 4)))
+		self._read_pixels(out.ctypes.data, width*4)
+		return out
+
+	def save(self, path):
+		""" Saves the contents of the buffer to an image file. Files ending in
+		.png are saved as PNG (requires SDL2_image), others as BMP. """
+		width, height = self.environment.resolution
+		surface = sdl2.SDL_CreateRGBSurfaceWithFormat(0, width, height, 32,
+			sdl2.SDL_PIXELFORMAT_RGBA32)
+		if not surface:
+			raise Exception("Could not create surface to save FrameBuffer: "
+				"{}".format(sdl2.SDL_GetError()))
+		try:
+			self._read_pixels(surface.contents.pixels, surface.contents.pitch)
+			path = sdl2.ext.compat.byteify(path, 'utf8')
+			if path.lower().endswith(b'.png'):
+				from sdl2 import sdlimage
+				result = sdlimage.IMG_SavePNG(surface, path)
+			else:
+				result = sdl2.SDL_SaveBMP(surface, path)
+			if result != 0:
+				raise Exception("Could not save FrameBuffer: "
+					"{}".format(sdl2.SDL_GetError()))
+		finally:
+			sdl2.SDL_FreeSurface(surface)
 		return self
 
+	def _read_pixels(self, pixels, pitch):
+		""" Copies the contents of the buffer in RGBA format to pixels (an
+		address). The alpha values are set to 255: the buffer is shown as an
+		opaque image, but its texture keeps the alpha of the background color
+		(which is 0 for RGB colors). """
+		self.flush()
+		self._read_target_pixels(pixels, pitch)
+		width, height = self.environment.resolution
+		data = (ctypes.c_uint8 * (pitch*height)).from_address(
+			getattr(pixels, 'value', pixels))
+		if not np is None:
+			rows = np.frombuffer(data, dtype=np.uint8).reshape(height, pitch)
+			rows[:, 3:width*4:4] = 255
+		else:
+			opaque = [255]*width
+			for row in range(height):
+				start = row*pitch
+				data[start+3:start+width*4:4] = opaque
+
+	@to_texture
+	def _read_target_pixels(self, pixels, pitch):
+		if sdl2.SDL_RenderReadPixels(self.sdl_renderer, None, 
+			sdl2.SDL_PIXELFORMAT_RGBA32, pixels, pitch) != 0:
+			raise Exception("Could not read FrameBuffer pixels: "
+				"{}".format(sdl2.SDL_GetError()))
+
 	def show(self):
 		t1 = sdl2.SDL_GetTicks()
 
+		# Draw everything that has been recorded in deferred mode
+		self.flush()
+
 		# The destination rectangle on the surface
 		# Only calculate if the drawing frame dimensions are different from the window size
 		if self.environment.resolution == self.environment.window.size:
@@ -136,14 +532,48 @@ class FrameBuffer(object):
 			y = int(w_h/2 - f_h/2)
 			dest_rect = (x, y, w, h)
 
-		self.renderer.clear(0)
-		self.renderer.copy(self.surface, dstrect=dest_rect)
-		self.renderer.present()
+		timer = self.environment.frame_timer
+		if not timer is None:
+			pre_copy = sdl2.SDL_GetPerformanceCounter()
+		if self.incremental and not self._damage is None and \
+			self.environment.persistent_backbuffer and self._presented():
+			# Only copy what changed onto what is still on the backbuffer. The
+			# rects are cleared first, as the full copy is drawn on black.
+			x, y = dest_rect[:2] if not dest_rect is None else (0, 0)
+			rects = [(x+r[0], y+r[1], r[2], r[3]) for r in self._damage]
+			if rects:
+				sdl2.SDL_SetRenderDrawBlendMode(self.sdl_renderer,
+					sdl2.SDL_BLENDMODE_NONE)
+				self.renderer.fill(rects, 0)
+			for rect in self._damage:
+				self.renderer.copy(self.surface, srcrect=rect, 
+					dstrect=(x+rect[0], y+rect[1], rect[2], rect[3]))
+		else:
+			self.renderer.clear(0)
+			self.renderer.copy(self.surface, dstrect=dest_rect)
+		if timer is None:
+			self.renderer.present()
+		else:
+			post_copy = sdl2.SDL_GetPerformanceCounter()
+			self.renderer.present()
+			timer.record(pre_copy, post_copy, sdl2.SDL_GetPerformanceCounter())
+		self.environment.presented_framebuffer = weakref.ref(self)
+		self._damage = []
 		drawing_delay = sdl2.SDL_GetTicks() - t1
-		return (time.time(), drawing_delay)
+		timestamp = time.time()
+
+		# Archive what has been shown (this only blocks for the readback)
+		recorder = self.environment.frame_recorder
+		if not recorder is None:
+			recorder.capture(self, timestamp)
+
+		# Use the time after the flip to upload images that have been
+		# decoded in the background
+		self.environment.upload_prefetched(
+			self.environment.prefetch_uploads_per_show)
+		return (timestamp, drawing_delay)
 
 	def __del__(self):
-		sdl2.SDL_DestroyTexture(self.surface.texture)
-		del([self.renderer, self.surface, self.sdl_renderer, self.spriterenderer])
-		# Remove this buffer from lists of active buffers in environment!
+		# A collected buffer gives its texture back to the pool
+		self.release()
 
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Playback of pre-rendered FrameBuffers with frame-count scheduling.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+
+# LSD package imports
+from .util import *
+
+class FrameSequence(object):
+	""" Presents a list of FrameBuffers, each for an exact number of frames.
+
+	This is meant for RSVP-like paradigms in which every display needs to be
+	shown for a fixed duration. Instead of timing the displays with delays,
+	the sequence presents every buffer once per refresh, so with a vsynced
+	renderer the duration of a display is exactly its number of frames,
+	unless frames are dropped. Dropped frames are detected from the
+	intervals between the presents and listed in the report play() returns.
+
+	Parameters
+	----------
+	frames: list of (FrameBuffer, int)
+		The buffers to show and the number of frames to show each of them.
+	sdl2env: SDL2Environment, optional
+		The environment to present in. Defaults to that of the first buffer.
+	tolerance: float, optional
+		The fraction of a frame period an interval may be too long before a
+		frame counts as dropped.
+	"""
+
+	def __init__(self, frames, sdl2env=None, tolerance=0.5):
+		self.frames = []
+		for framebuffer, duration in frames:
+			duration = check_int_value(duration, min_value=1, varname="duration")
+			self.frames.append((framebuffer, duration))
+		if sdl2env is None and self.frames:
+			sdl2env = self.frames[0][0].environment
+		self.environment = check_sdl2env(sdl2env)
+		self.tolerance = tolerance
+		self.prepared = False
+
+	def __len__(self):
+		return len(self.frames)
+
+	@property
+	def frame_count(self):
+		""" The total number of frames the sequence takes. """
+		return sum(duration for _, duration in self.frames)
+
+	def prepare(self):
+		""" Performs all pending draw commands of the buffers and copies every
+		buffer once to the backbuffer, so that the textures are uploaded
+		before playback starts. """
+		renderer = self.environment.renderer
+		for framebuffer, _ in self.frames:
+			framebuffer.flush()
+			renderer.copy(framebuffer.surface)
+		renderer.clear(0)
+		self.environment.presented_framebuffer = None
+		self.prepared = True
+		return self
+
+	def play(self):
+		""" Presents the sequence.
+
+		Returns
+		-------
+		dict: with
+			onsets: the performance counter time (in seconds) of the first
+				present of every buffer
+			durations: the measured duration of every buffer in seconds
+			frames: the measured duration of every buffer in frames (only if
+				the refresh rate is known)
+			dropped_frames: the total number of dropped frames
+			dropped: a list of (index, expected frames, measured frames) for
+				every buffer that was shown longer than requested
+		"""
+		if not self.prepared:
+			self.prepare()
+
+		counter = sdl2.SDL_GetPerformanceCounter
+		to_seconds = 1.0/sdl2.SDL_GetPerformanceFrequency()
+		pump_events = sdl2.SDL_PumpEvents
+
+		# Present every buffer once per refresh in a tight loop
+		onsets = []
+		for framebuffer, duration in self.frames:
+			framebuffer.show()
+			onsets.append(counter())
+			pump_events()
+			for _ in range(duration-1):
+				framebuffer.show()
+				pump_events()
+		# The end of the last buffer is the start of the next refresh
+		if self.frames:
+			self.frames[-1][0].show()
+			onsets.append(counter())
+
+		onsets = [onset*to_seconds for onset in onsets]
+		durations = [end - start for start, end in zip(onsets, onsets[1:])]
+		report = {
+			"onsets": onsets[:-1],
+			"durations": durations,
+			"dropped_frames": 0,
+			"dropped": [],
+		}
+
+		refresh_rate = self.environment.refresh_rate
+		if refresh_rate:
+			period = 1.0/refresh_rate
+			measured = []
+			for i, ((_, expected), duration) in enumerate(zip(self.frames,
+				durations)):
+				frames = int(round(duration/period))
+				if duration > (expected + self.tolerance)*period:
+					frames = max(frames, expected+1)
+					report["dropped"].append((i, expected, frames))
+					report["dropped_frames"] += frames - expected
+				measured.append(frames)
+			report["frames"] = measured
+		return report
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Procedural stimuli for psychophysics: gratings, Gabor patches and noise.
+
+The patterns are computed with NumPy broadcasting. The coordinate grids,
+envelopes and carriers they are built from are kept in the environment's
+stimulus cache, so changing only the phase of a grating or Gabor (e.g. to
+let it drift) does not compute any of them again.
+
+Conventions: sizes are in pixels, spatial frequencies in cycles per pixel,
+and orientations and phases in degrees. An orientation of 0 gives vertical
+bars, and larger orientations rotate the bars clockwise. Luminances are
+between 0 (black) and 1 (white); a pattern with contrast c around mean m
+ranges from m*(1-c) to m*(1+c). Values outside 0..255 after scaling (e.g.
+the tails of Gaussian noise) are clipped to 0..255.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+
+# LSD package imports
+from . import inject_sdl_environment, profiling
+from .util import *
+from .texture import TextureHandle
+
+# misc
+import ctypes
+import math
+import numbers
+
+NOISE_KINDS = ('white', 'gaussian', 'binary', 'pink')
+
+def _check_size(size):
+	""" Converts an int or a (width, height) pair to (width, height). """
+	if isinstance(size, numbers.Number):
+		size = (size, size)
+	if len(size) != 2:
+		raise ValueError("size needs to be an int or (width, height)")
+	return (check_int_value(size[0], min_value=1, varname="width"),
+		check_int_value(size[1], min_value=1, varname="height"))
+
+def _cached(sdl2env, key, compute, *args):
+	""" Returns the array stored under key in the stimulus cache, computing
+	it with compute(sdl2env, *args) if it is not there yet. """
+	value = sdl2env.stimulus_cache.get(key)
+	if value is None:
+		value = compute(sdl2env, *args)
+		nbytes = sum(a.nbytes for a in value) if type(value) == tuple else \
+			value.nbytes
+		sdl2env.stimulus_cache.put(key, value, nbytes)
+	return value
+
+def _grid(sdl2env, size):
+	""" x and y coordinates relative to the center, as a row and a column that
+	broadcast to (height, width). """
+	width, height = size
+	x = np.arange(width, dtype=np.float32) - (width - 1)/2.0
+	y = np.arange(height, dtype=np.float32) - (height - 1)/2.0
+	return x[np.newaxis, :], y[:, np.newaxis]
+
+def _envelope(sdl2env, size, sigma):
+	""" A Gaussian with standard deviation sigma, 1 in the center. """
+	x, y = _cached(sdl2env, ('grid', size), _grid, size)
+	return np.exp(-(x*x + y*y)/np.float32(2*sigma*sigma))
+
+def _carrier(sdl2env, size, frequency, orientation, sigma):
+	""" cos and sin of the phase angle of a grating at every pixel, multiplied
+	by the envelope if sigma is not None. A grating with phase p is then
+	cos*cos(p) - sin*sin(p), which needs no trigonometry per pixel. """
+	x, y = _cached(sdl2env, ('grid', size), _grid, size)
+	theta = math.radians(orientation)
+	angle = np.float32(2*math.pi*frequency*math.cos(theta))*x + \
+		np.float32(2*math.pi*frequency*math.sin(theta))*y
+	cos, sin = np.cos(angle), np.sin(angle)
+	if not sigma is None:
+		envelope = _cached(sdl2env, ('envelope', size, sigma), _envelope, size,
+			sigma)
+		cos *= envelope
+		sin *= envelope
+	return cos, sin
+
+def _pink_filter(sdl2env, size):
+	""" The 1/f amplitude spectrum that turns white noise into pink noise,
+	for numpy.fft.rfft2 of an image of size. """
+	width, height = size
+	fx = np.fft.rfftfreq(width).astype(np.float32)[np.newaxis, :]
+	fy = np.fft.fftfreq(height).astype(np.float32)[:, np.newaxis]
+	f = np.sqrt(fx*fx + fy*fy)
+	f[0, 0] = np.inf
+	return 1/f
+
+def _luminance(pattern, contrast, mean):
+	""" Converts patterns between -1 and 1 to uint8 luminances. """
+	pattern *= np.float32(255*mean*contrast)
+	pattern += np.float32(255*mean + 0.5)
+	np.clip(pattern, 0, 255, out=pattern)
+	return pattern.astype(np.uint8)
+
+def _texture(sdl2env, luminance, alpha=None):
+	""" Uploads a (height, width) luminance array, and optionally an alpha
+	channel, to a new texture. """
+	height, width = luminance.shape
+	pixels = np.empty((height, width, 4), dtype=np.uint8)
+	pixels[..., :3] = luminance[..., np.newaxis]
+	pixels[..., 3] = 255 if alpha is None else alpha
+	sprite = sdl2env.texture_factory.create_sprite(
+		size=(width, height),
+		pformat=sdl2.SDL_PIXELFORMAT_RGBA32
+	)
+	if sdl2.SDL_UpdateTexture(sprite.texture, None,
+		ctypes.c_void_p(pixels.ctypes.data), width*4) != 0:
+		raise Exception("Could not upload stimulus to texture: "
+			"{}".format(sdl2.SDL_GetError()))
+	sdl2.SDL_SetTextureBlendMode(sprite.texture, sdl2.SDL_BLENDMODE_BLEND)
+	return sprite
+
+def _alpha(sdl2env, size, sigma):
+	""" The envelope as uint8 alpha values. """
+	envelope = _cached(sdl2env, ('envelope', size, sigma), _envelope, size,
+		sigma)
+	return (envelope*255 + 0.5).astype(np.uint8)
+
+@inject_sdl_environment
+def grating_array(size, frequency, orientation=0, phase=0, contrast=1.0,
+	mean=0.5, sigma=None, **kwargs):
+	""" Computes a sine grating, or a Gabor patch if sigma is given.
+
+	Parameters
+	----------
+	size: int or (int, int)
+		The width and height of the patch.
+	frequency: float
+		The spatial frequency in cycles per pixel.
+	orientation: float, optional
+		The orientation of the bars.
+	phase: float or sequence of floats, optional
+		The phase of the grating at the center. For a sequence of phases, a
+		frame is computed for each one in a single pass.
+	contrast, mean: float, optional
+		The Michelson contrast and the mean luminance.
+	sigma: float, optional
+		The standard deviation of the Gaussian envelope in pixels. The
+		envelope fades the grating into the mean luminance.
+
+	Returns
+	-------
+	numpy.ndarray: a (height, width) uint8 array of luminances, or a
+	(len(phase), height, width) array for a sequence of phases.
+	"""
+	require_numpy("stimuli.grating_array")
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	return _grating(sdl2env, _check_size(size), frequency, orientation, phase,
+		contrast, mean, sigma)
+
+def _grating(sdl2env, size, frequency, orientation, phase, contrast, mean,
+	sigma):
+	frequency, orientation = float(frequency), float(orientation) % 360
+	if not sigma is None:
+		sigma = float(sigma)
+		if sigma <= 0:
+			raise ValueError("sigma needs to be larger than 0")
+
+	cos, sin = _cached(sdl2env, ('carrier', size, frequency, orientation,
+		sigma), _carrier, size, frequency, orientation, sigma)
+	phases = np.radians(np.asarray(phase, dtype=np.float32))
+	if phases.ndim == 0:
+		pattern = cos*np.cos(phases) - sin*np.sin(phases)
+	else:
+		pattern = cos*np.cos(phases)[:, np.newaxis, np.newaxis] - \
+			sin*np.sin(phases)[:, np.newaxis, np.newaxis]
+	return _luminance(pattern, contrast, mean)
+
+@inject_sdl_environment
+def noise_array(size, kind='white', contrast=1.0, mean=0.5, sigma=None,
+	seed=None, **kwargs):
+	""" Computes a noise field.
+
+	Parameters
+	----------
+	size: int or (int, int)
+		The width and height of the field.
+	kind: str, optional
+		'white' (uniform), 'gaussian' (with a standard deviation of a third of
+		the range, clipped), 'binary' (black and white pixels) or 'pink'
+		(1/f spectrum).
+	contrast, mean: float, optional
+		The contrast and the mean luminance.
+	sigma: float, optional
+		The standard deviation of a Gaussian envelope in pixels.
+	seed: int or numpy.random.RandomState, optional
+		The seed or the random number generator to use.
+
+	Returns
+	-------
+	numpy.ndarray: a (height, width) uint8 array of luminances
+	"""
+	require_numpy("stimuli.noise_array")
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	return _noise(sdl2env, _check_size(size), kind, contrast, mean, sigma,
+		seed)
+
+def _noise(sdl2env, size, kind, contrast, mean, sigma, seed):
+	width, height = size
+	if not kind in NOISE_KINDS:
+		raise ValueError("kind needs to be one of {}".format(
+			", ".join(NOISE_KINDS)))
+	rng = seed if isinstance(seed, np.random.RandomState) else \
+		np.random.RandomState(seed)
+
+	if kind == 'white':
+		pattern = rng.uniform(-1, 1, (height, width)).astype(np.float32)
+	elif kind == 'binary':
+		pattern = rng.randint(0, 2, (height, width)).astype(np.float32)*2 - 1
+	else:
+		pattern = rng.standard_normal((height, width)).astype(np.float32)
+		if kind == 'pink':
+			spectrum = np.fft.rfft2(pattern)
+			spectrum *= _cached(sdl2env, ('pink', size), _pink_filter, size)
+			pattern = np.fft.irfft2(spectrum, s=(height, width)).astype(
+				np.float32)
+			pattern /= max(pattern.std(), 1e-12)
+		pattern /= 3
+	if not sigma is None:
+		pattern *= _cached(sdl2env, ('envelope', size, float(sigma)),
+			_envelope, size, float(sigma))
+	return _luminance(pattern, contrast, mean)
+
+@inject_sdl_environment
+def grating(size, frequency, orientation=0, phase=0, contrast=1.0, mean=0.5,
+	x=0, y=0, opacity=1.0, **kwargs):
+	""" Creates a texture with a sine grating.
+
+	See grating_array() for the parameters.
+
+	Returns
+	-------
+	TextureHandle: placement of the texture at (x, y)
+	"""
+	require_numpy("stimuli.grating")
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	luminance = profiling.timed('rasterization', _grating, sdl2env,
+		_check_size(size), frequency, orientation, phase, contrast, mean, None)
+	return _handles(sdl2env, luminance, None, x, y, opacity)
+
+@inject_sdl_environment
+def gabor(size, frequency, sigma, orientation=0, phase=0, contrast=1.0,
+	mean=0.5, x=0, y=0, opacity=1.0, transparent=False, **kwargs):
+	""" Creates a texture with a Gabor patch: a sine grating in a Gaussian
+	envelope with standard deviation sigma.
+
+	See grating_array() for the other parameters.
+
+	Parameters
+	----------
+	transparent: bool, optional
+		Put the envelope in the alpha channel instead of fading the grating
+		into the mean luminance, so that the patch can be drawn on any
+		background.
+
+	Returns
+	-------
+	TextureHandle: placement of the texture at (x, y), or a list of them for
+	a sequence of phases.
+	"""
+	require_numpy("stimuli.gabor")
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	size = _check_size(size)
+	alpha = None
+	if transparent and not sigma is None:
+		alpha = profiling.timed('rasterization', _cached, sdl2env,
+			('alpha', size, float(sigma)), _alpha, size, float(sigma))
+		sigma = None
+	luminance = profiling.timed('rasterization', _grating, sdl2env, size,
+		frequency, orientation, phase, contrast, mean, sigma)
+	return _handles(sdl2env, luminance, alpha, x, y, opacity)
+
+@inject_sdl_environment
+def noise(size, kind='white', contrast=1.0, mean=0.5, sigma=None, seed=None,
+	x=0, y=0, opacity=1.0, **kwargs):
+	""" Creates a texture with a noise field.
+
+	See noise_array() for the parameters.
+
+	Returns
+	-------
+	TextureHandle: placement of the texture at (x, y)
+	"""
+	require_numpy("stimuli.noise")
+	sdl2env = check_sdl2env(kwargs.get('sdl2env', None))
+	luminance = profiling.timed('rasterization', _noise, sdl2env,
+		_check_size(size), kind, contrast, mean, sigma, seed)
+	return _handles(sdl2env, luminance, None, x, y, opacity)
+
+def _handles(sdl2env, luminance, alpha, x, y, opacity):
+	""" Uploads one luminance array, or each of a stack of them, and returns
+	the placements of the textures. """
+	x, y, opacity = int(x), int(y), convert_opacity(opacity)
+	if luminance.ndim == 2:
+		sprite = profiling.timed('upload', _texture, sdl2env, luminance, alpha)
+		return TextureHandle(sprite, x=x, y=y, opacity=opacity)
+	return [TextureHandle(profiling.timed('upload', _texture, sdl2env, frame,
+		alpha), x=x, y=y, opacity=opacity) for frame in luminance]
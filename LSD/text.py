@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Text rendering with TrueType fonts through a glyph atlas.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+import sdl2.ext
+
+# LSD package imports
+from .util import *
+from .atlas import TextureAtlas
+from .cache import TextureCache
+
+# misc
+import ctypes
+
+# Default memory budget for the cached string layouts of a font: 4 MB
+DEFAULT_LAYOUT_CACHE_SIZE = 4*1024*1024
+
+def init_ttf():
+	""" Initializes SDL_ttf if that has not been done yet. """
+	from sdl2 import sdlttf
+	if not sdlttf.TTF_WasInit():
+		if sdlttf.TTF_Init() != 0:
+			raise Exception("Could not initialize SDL_ttf: "
+				"{}".format(sdlttf.TTF_GetError()))
+	return sdlttf
+
+class TextLayout(object):
+	""" The glyph quads of a laid out string, relative to its top left corner.
+
+	Attributes
+	----------
+	pages: list of (sdl2.ext.TextureSprite, positions, uvs, indices)
+		For every atlas page that holds glyphs of the string, the quad
+		corners in pixels, their texture coordinates and the triangle
+		indices.
+	size: tuple
+		The (width, height) of the laid out text.
+	"""
+
+	__slots__ = ('pages', 'size', 'nbytes')
+
+	def __init__(self, pages, size):
+		self.pages = pages
+		self.size = size
+		self.nbytes = sum(positions.nbytes + uvs.nbytes + indices.nbytes
+			for _, positions, uvs, indices in pages)
+
+class Font(object):
+	""" A TrueType font of one size whose glyphs are rasterized into an atlas.
+
+	Every glyph is rasterized only once, in white, into the pages of a
+	TextureAtlas that belongs to the font. Laid out strings are cached as
+	lists of quads, so drawing a string again only costs building its
+	vertices and one SDL_RenderGeometry call per atlas page (normally one).
+	The color is applied through the vertex colors.
+
+	Get fonts with SDL2Environment.font() rather than creating them directly,
+	so they are shared. Requires SDL2_ttf and SDL 2.0.18 or newer.
+
+	Parameters
+	----------
+	sdl2env: SDL2Environment
+		The environment to draw in.
+	font_path: str
+		The path to the TrueType font file.
+	size: int
+		The point size.
+	"""
+
+	def __init__(self, sdl2env, font_path, size):
+		require_numpy("Font")
+		self.environment = check_sdl2env(sdl2env)
+		self.path = font_path
+		self.size = check_int_value(size, min_value=1, varname="size")
+		self._ttf = init_ttf()
+		self._font = self._ttf.TTF_OpenFont(
+			sdl2.ext.compat.byteify(font_path, 'utf8'), self.size)
+		if not self._font:
+			raise IOError("Could not open font {}: {}".format(font_path,
+				self._ttf.TTF_GetError()))
+		self.height = self._ttf.TTF_FontHeight(self._font)
+		self.line_skip = self._ttf.TTF_FontLineSkip(self._font)
+
+		self.atlas = TextureAtlas(sdl2env, page_size=(1024, 1024))
+		# Glyph metrics and atlas regions, by character
+		self._glyphs = {}
+		self.layouts = TextureCache(DEFAULT_LAYOUT_CACHE_SIZE)
+
+	def close(self):
+		""" Releases the font and its atlas. """
+		if self._font:
+			self._ttf.TTF_CloseFont(self._font)
+			self._font = None
+		self.atlas.clear()
+		self.layouts.invalidate()
+		self._glyphs.clear()
+
+	def glyph(self, char):
+		""" Returns (advance, x offset, atlas region) of a character,
+		rasterizing it into the atlas the first time. The region is None for
+		glyphs without pixels, such as spaces. """
+		glyph = self._glyphs.get(char)
+		if glyph is None:
+			codepoint = ord(char)
+			minx, maxx, miny, maxy, advance = [ctypes.c_int() for _ in range(5)]
+			self._ttf.TTF_GlyphMetrics32(self._font, codepoint,
+				*[ctypes.byref(v) for v in (minx, maxx, miny, maxy, advance)])
+			region = None
+			if not char.isspace():
+				surface = self._ttf.TTF_RenderGlyph32_Blended(self._font,
+					codepoint, sdl2.SDL_Color(255, 255, 255, 255))
+				if not surface:
+					raise Exception("Could not render glyph {!r}: {}".format(
+						char, self._ttf.TTF_GetError()))
+				try:
+					sprite = self.environment.texture_factory.from_surface(
+						surface.contents)
+				finally:
+					sdl2.SDL_FreeSurface(surface)
+				region = self.atlas.add(sprite, key=char).region
+			# Rendered glyphs start at the leftmost pixel if that lies to the
+			# left of the pen position
+			glyph = (advance.value, min(0, minx.value), region)
+			self._glyphs[char] = glyph
+		return glyph
+
+	def layout(self, text, wrap_width=None):
+		""" Lays out text, breaking lines at newlines and, if wrap_width is
+		given, between words so that lines are not wider than wrap_width.
+
+		Returns
+		-------
+		TextLayout: the (cached) layout
+		"""
+		key = (text, wrap_width)
+		layout = self.layouts.get(key)
+		if layout is None:
+			layout = self._layout(text, wrap_width)
+			self.layouts.put(key, layout, layout.nbytes)
+		return layout
+
+	def width(self, text):
+		""" The width of a single line of text in pixels, including kerning. """
+		width, previous = 0, None
+		for char in text:
+			width += self._kerning(previous, char) + self.glyph(char)[0]
+			previous = char
+		return width
+
+	def _kerning(self, previous, char):
+		if previous is None:
+			return 0
+		return self._ttf.TTF_GetFontKerningSizeGlyphs32(self._font,
+			ord(previous), ord(char))
+
+	def _wrap(self, text, wrap_width):
+		""" Splits text into lines. """
+		lines = []
+		for paragraph in text.split('\n'):
+			if wrap_width is None:
+				lines.append(paragraph)
+				continue
+			line = ''
+			for word in paragraph.split(' '):
+				candidate = word if not line else line + ' ' + word
+				if line and self.width(candidate) > wrap_width:
+					lines.append(line)
+					line = word
+				else:
+					line = candidate
+			lines.append(line)
+		return lines
+
+	def _layout(self, text, wrap_width):
+		lines = self._wrap(text, wrap_width)
+		quads = {}
+		width = 0
+		for line_number, line in enumerate(lines):
+			pen_x, y, previous = 0, line_number*self.line_skip, None
+			for char in line:
+				pen_x += self._kerning(previous, char)
+				advance, offset, region = self.glyph(char)
+				if not region is None:
+					quads.setdefault(id(region.page), (region.page, []))[1].append(
+						(pen_x + offset, y, region.rect))
+				pen_x += advance
+				previous = char
+			width = max(width, pen_x)
+		height = self.line_skip*(len(lines)-1) + self.height
+
+		pages = []
+		for page, page_quads in quads.values():
+			page_w, page_h = page.sprite.size
+			n = len(page_quads)
+			positions = np.empty((n, 4, 2), dtype=np.float32)
+			uvs = np.empty((n, 4, 2), dtype=np.float32)
+			for i, (x, y, (sx, sy, w, h)) in enumerate(page_quads):
+				positions[i] = ((x, y), (x+w, y), (x+w, y+h), (x, y+h))
+				uvs[i] = ((sx, sy), (sx+w, sy), (sx+w, sy+h), (sx, sy+h))
+			uvs[..., 0] /= page_w
+			uvs[..., 1] /= page_h
+			corners = (np.arange(n, dtype=np.int32)*4)[:, np.newaxis]
+			indices = (corners + np.array([0, 1, 2, 0, 2, 3],
+				dtype=np.int32)).reshape(-1)
+			pages.append((page.sprite, positions.reshape(-1, 2),
+				uvs.reshape(-1, 2), indices))
+		return TextLayout(pages, (width, height))
+
+class TextHandle(object):
+	""" A laid out string placed at a position with a color. Add it to a
+	FrameBuffer with FrameBuffer.add_text(). """
+
+	__slots__ = ('layout', 'x', 'y', 'color', '_vertices')
+
+	def __init__(self, layout, x, y, color):
+		self.layout = layout
+		self.x = x
+		self.y = y
+		self.color = color
+		self._vertices = None
+
+	@property
+	def size(self):
+		return self.layout.size
+
+	def render(self, sdlrenderer):
+		""" Draws the text on the current render target, with one
+		SDL_RenderGeometry call per atlas page. """
+		from .geometry import VERTEX_DTYPE
+		if self._vertices is None:
+			self._vertices = []
+			for sprite, positions, uvs, indices in self.layout.pages:
+				vertices = np.empty(len(positions), dtype=VERTEX_DTYPE)
+				vertices['x'] = positions[:, 0] + self.x
+				vertices['y'] = positions[:, 1] + self.y
+				for channel, value in zip('rgba', self.color):
+					vertices[channel] = value
+				vertices['u'] = uvs[:, 0]
+				vertices['v'] = uvs[:, 1]
+				self._vertices.append((sprite, vertices, indices))
+		for sprite, vertices, indices in self._vertices:
+			if sdl2.SDL_RenderGeometry(sdlrenderer, sprite.texture,
+				vertices.ctypes.data_as(ctypes.POINTER(sdl2.SDL_Vertex)),
+				len(vertices), indices.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+				len(indices)) != 0:
+				raise Exception("Could not render text: "
+					"{}".format(sdl2.SDL_GetError()))
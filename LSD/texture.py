@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Texture handles that are returned by the drawing functions.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+
+class TextureHandle(object):
+	""" Lightweight placement of a (possibly shared) texture.
+
+	The drawing functions return these instead of the raw sprite, so that one
+	rasterized texture can be placed many times with different positions,
+	opacities and rotations without the placements overwriting each other.
+	FrameBuffer.add() accepts them in the same way as a TextureSprite.
+
+	Parameters
+	----------
+	sprite: sdl2.ext.TextureSprite
+		The sprite holding the texture that is drawn.
+	srcrect: tuple, optional
+		(x, y, w, h) region of the sprite to draw. Defaults to the whole sprite.
+	"""
+
+	__slots__ = ('sprite', 'srcrect', 'x', 'y', 'opacity', 'center', 'angle',
+		'flip')
+
+	def __init__(self, sprite, srcrect=None, x=None, y=None, opacity=255,
+		center=None, angle=0, flip=sdl2.SDL_FLIP_NONE):
+		self.sprite = sprite
+		self.srcrect = srcrect
+		self.x = x
+		self.y = y
+		self.opacity = opacity
+		self.center = center
+		self.angle = angle
+		self.flip = flip
+
+	@property
+	def texture(self):
+		""" The underlying SDL_Texture. """
+		return self.sprite.texture
+
+	@property
+	def size(self):
+		""" The (width, height) of the drawn region. """
+		if self.srcrect is None:
+			return self.sprite.size
+		return self.srcrect[2], self.srcrect[3]
+
+	def __repr__(self):
+		return "TextureHandle(size={}, x={}, y={}, opacity={})".format(
+			self.size, self.x, self.y, self.opacity)
+
+class PlacementSet(object):
+	""" Compact set of placements of a small number of shared textures.
+
+	The batch drawing functions (circles, ellipses, rects) return these. Every
+	distinct shape is rasterized only once and each item refers to its texture
+	by index. Pass the set to FrameBuffer.add_placements() to add all items in
+	one go.
+
+	Parameters
+	----------
+	sprites: list of sdl2.ext.TextureSprite
+		The distinct textures that are placed.
+	index: numpy.ndarray
+		For every item, the index of its texture in sprites.
+	x, y: numpy.ndarray
+		The coordinates of the top left corner of every item.
+	opacity: numpy.ndarray
+		The opacity (0 - 255) of every item.
+	"""
+
+	def __init__(self, sprites, index, x, y, opacity):
+		self.sprites = sprites
+		self.index = index
+		self.x = x
+		self.y = y
+		self.opacity = opacity
+
+	def __len__(self):
+		return len(self.index)
+
+	def __getitem__(self, i):
+		return TextureHandle(self.sprites[self.index[i]], x=int(self.x[i]), 
+			y=int(self.y[i]), opacity=int(self.opacity[i]))
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def commands(self):
+		""" Returns the placements as FrameBuffer draw command tuples. """
+		sizes = [sprite.size for sprite in self.sprites]
+		return [(self.sprites[i], opacity, None, (x, y) + sizes[i], 0, None,
+			sdl2.SDL_FLIP_NONE) for i, x, y, opacity in zip(self.index.tolist(),
+			self.x.tolist(), self.y.tolist(), self.opacity.tolist())]
+
+	def __repr__(self):
+		return "PlacementSet(items={}, textures={})".format(len(self), 
+			len(self.sprites))
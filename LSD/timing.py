@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+High-resolution timing of presented frames.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+
+# LSD package imports
+from .util import np, require_numpy
+
+# Default number of frames that a FrameTimer remembers
+DEFAULT_TIMING_CAPACITY = 3600
+
+# Fields of the records in FrameTimer.to_array()
+FRAME_TIMING_FIELDS = ('pre_copy', 'post_copy', 'post_present', 'interval',
+	'missed', 'paused')
+
+class FrameTimer(object):
+	""" Records the timing of every FrameBuffer.show() in a ring buffer.
+
+	For every flip, the moment before the framebuffer is copied to the
+	backbuffer, the moment after the copy and the moment after the present
+	are stamped with SDL_GetPerformanceCounter. The interval between two
+	consecutive presents is compared with the refresh period of the display:
+	an interval that is more than `tolerance` frames longer than expected
+	means one or more vsyncs were missed. Call pause() before presenting
+	after a deliberate delay (e.g. an inter-trial interval or waiting for a
+	response), so that its interval is recorded as a pause instead of as
+	missed vsyncs.
+
+	Parameters
+	----------
+	refresh_rate: int, optional
+		The refresh rate of the display in Hz. If this is 0 (SDL reports 0 for
+		an unknown refresh rate), missed vsyncs are not detected.
+	capacity: int, optional
+		The number of frames to remember. Older frames are overwritten.
+	tolerance: float, optional
+		The fraction of a frame period an interval may be too long before the
+		frame counts as missed.
+	max_gap: float, optional
+		If given, intervals of more than this many frame periods are also
+		recorded as pauses. By default, only intervals marked with pause() are.
+	"""
+
+	def __init__(self, refresh_rate=0, capacity=DEFAULT_TIMING_CAPACITY,
+		tolerance=0.5, max_gap=None):
+		if type(capacity) != int or capacity < 1:
+			raise ValueError("capacity needs to be a positive int")
+		self.frequency = sdl2.SDL_GetPerformanceFrequency()
+		self.refresh_rate = refresh_rate
+		self.frame_period = 1.0/refresh_rate if refresh_rate else None
+		self.capacity = capacity
+		self.tolerance = tolerance
+		self.max_gap = max_gap
+		self.reset()
+
+	def __len__(self):
+		return min(self.frame_count, self.capacity)
+
+	def reset(self):
+		""" Forgets all recorded frames. """
+		self._records = [None]*self.capacity
+		self._next = 0
+		self._last_present = None
+		self._paused = False
+		self.frame_count = 0
+		self.missed_count = 0
+		self.pause_count = 0
+
+	def pause(self):
+		""" Marks the interval up to the next present as a deliberate pause,
+		which does not count as missed vsyncs. """
+		self._paused = True
+
+	def record(self, pre_copy, post_copy, post_present, paused=False):
+		""" Stores the performance counter values of a single flip. If paused
+		is True, the interval since the previous flip is recorded as a
+		pause. """
+		to_seconds = 1.0/self.frequency
+		pre_copy *= to_seconds
+		post_copy *= to_seconds
+		post_present *= to_seconds
+
+		missed = 0
+		paused = paused or self._paused
+		self._paused = False
+		if self._last_present is None:
+			interval = 0.0
+			paused = False
+		else:
+			interval = post_present - self._last_present
+			if self.frame_period and not self.max_gap is None and \
+				interval > self.frame_period*self.max_gap:
+				paused = True
+			# Only presents that were meant to be back to back can miss vsyncs
+			if not paused and self.frame_period and \
+				interval > self.frame_period*(1.0 + self.tolerance):
+				missed = max(1, int(round(interval/self.frame_period)) - 1)
+		self._last_present = post_present
+
+		self._records[self._next] = (pre_copy, post_copy, post_present, interval,
+			missed, int(paused))
+		self._next = (self._next + 1) % self.capacity
+		self.frame_count += 1
+		self.missed_count += missed
+		self.pause_count += int(paused)
+
+	def records(self):
+		""" Returns the remembered frames in chronological order, as tuples of
+		(pre_copy, post_copy, post_present, interval, missed, paused). Times
+		are in seconds. """
+		if self.frame_count < self.capacity:
+			return self._records[:self._next]
+		return self._records[self._next:] + self._records[:self._next]
+
+	def to_array(self):
+		""" Returns the remembered frames as a NumPy record array with the
+		fields in FRAME_TIMING_FIELDS. """
+		require_numpy("FrameTimer.to_array")
+		dtype = [(field, np.float64) for field in FRAME_TIMING_FIELDS[:-2]]
+		dtype += [(field, np.int32) for field in FRAME_TIMING_FIELDS[-2:]]
+		return np.array(self.records(), dtype=dtype).view(np.recarray)
+
+	def summary(self):
+		""" Returns a dict with statistics of the remembered frames. The mean
+		and maximum interval leave out pauses, which are reported separately
+		as their number and the longest pause. """
+		records = self.records()[1:]
+		intervals = [r[3] for r in records if not r[5]]
+		pauses = [r[3] for r in records if r[5]]
+		return {
+			"frames": self.frame_count,
+			"missed_vsyncs": self.missed_count,
+			"pauses": self.pause_count,
+			"max_pause": max(pauses) if pauses else None,
+			"refresh_rate": self.refresh_rate,
+			"mean_interval": sum(intervals)/len(intervals) if intervals else None,
+			"max_interval": max(intervals) if intervals else None,
+		}
@@ -1,7 +1,15 @@
+import numbers
+
 import sdl2
 import sdl2.ext
 from .env import SDL2Environment
 
+# NumPy is only needed for the batch and array functions
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
 def convert_opacity(value):
 	""" Convert float values to opacity range between 0 and 255. """
 	if type(value) == float and 0.0 <= value <= 1.0:
@@ -62,14 +70,14 @@ def determine_optimal_colorkey(drawing_color, dev_offset=5):
 		return drawing_color - offset_color
 
 def check_sdl2env(sdl2env):
-	if type(sdl2env) != SDL2Environment:
+	if not isinstance(sdl2env, SDL2Environment):
 		raise TypeError("Required sdl2env parameter is not a SDL2Environment object")
 	else:
 		return sdl2env
 
 def check_int_value(value, min_value=None, varname="variable"):
-	# Check if value is an int or float
-	if type(value) not in [int, float]:
+	# Check if value is an int or float (NumPy scalars included)
+	if not isinstance(value, numbers.Real) or isinstance(value, bool):
 		raise TypeError("{} needs to be int or float".format(varname))
 	if min_value and value < min_value:
 		raise ValueError("{} cannot be smaller than {}".format(varname, min_value))
@@ -83,6 +91,98 @@ def get_sdl_flip_value(flip):
 	elif flip == "ver":
 		return sdl2.SDL_FLIP_VERTICAL
 	else:
-		raise ValueError("Unrecognized value for flip")	
+		raise ValueError("Unrecognized value for flip")
+
+def require_numpy(feature="This function"):
+	""" Raises an ImportError if NumPy is not available. """
+	if np is None:
+		raise ImportError("{} requires NumPy to be installed".format(feature))
+
+def check_int_array(values, n, min_value=None, varname="variable"):
+	""" Vectorized counterpart of check_int_value.
+
+	Converts a scalar or a sequence of n numbers to an int array of length n.
+	"""
+	values = np.asarray(values)
+	if values.dtype.kind not in 'iuf':
+		raise TypeError("{} needs to contain ints or floats".format(varname))
+	if values.ndim == 0:
+		values = np.repeat(values, n)
+	if values.shape != (n,):
+		raise ValueError("{} needs to contain {} values".format(varname, n))
+	if not min_value is None and n and values.min() < min_value:
+		raise ValueError("{} cannot be smaller than {}".format(varname, min_value))
+	return values.astype(np.int64)
+
+def convert_to_colors(colors, n):
+	""" Vectorized counterpart of sdl2.ext.convert_to_color.
+
+	Parameters
+	----------
+	colors: color, sequence of colors or array
+		A single color in any format accepted by sdl2.ext.convert_to_color, a
+		sequence of n such colors, or an (n, 3) or (n, 4) array of RGB(A)
+		values between 0 and 255.
+	n: int
+		The number of items that are drawn.
 
-		
+	Returns
+	-------
+	numpy.ndarray: an (n, 4) uint8 array with RGBA values
+	"""
+	arr = None
+	if not isinstance(colors, (str, bytes, sdl2.ext.Color)):
+		try:
+			arr = np.asarray(colors)
+		except ValueError:
+			arr = None
+	# RGB(A) arrays can be converted in one go
+	if not arr is None and arr.ndim == 2 and arr.shape[1] in (3, 4) and \
+		arr.dtype.kind in 'iuf':
+		if arr.shape[0] != n:
+			raise ValueError("colors needs to contain {} values".format(n))
+		if n and (arr.min() < 0 or arr.max() > 255):
+			raise ValueError("Color values need to be between 0 and 255")
+		result = np.full((n, 4), 255, dtype=np.uint8)
+		result[:, :arr.shape[1]] = arr
+		return result
+	# A single color for all items. Note that a flat sequence of 3 or 4 numbers
+	# is always interpreted as a single RGB(A) color.
+	if arr is None or arr.ndim == 0 or (arr.ndim == 1 and arr.dtype.kind in 'iuf' \
+		and arr.shape[0] in (3, 4)):
+		c = sdl2.ext.convert_to_color(colors)
+		return np.tile(np.array([c.r, c.g, c.b, c.a], dtype=np.uint8), (n, 1))
+	# A sequence of colors; only convert each distinct value once
+	if len(colors) != n:
+		raise ValueError("colors needs to contain {} values".format(n))
+	converted = {}
+	result = np.empty((n, 4), dtype=np.uint8)
+	for i, color in enumerate(colors):
+		key = color if isinstance(color, (int, str, bytes)) else tuple(color)
+		if not key in converted:
+			c = sdl2.ext.convert_to_color(color)
+			converted[key] = (c.r, c.g, c.b, c.a)
+		result[i] = converted[key]
+	return result
+
+def convert_opacities(values, n):
+	""" Vectorized counterpart of convert_opacity.
+
+	As with convert_opacity, the scale is decided per value: values of float 
+	arrays between 0.0 and 1.0 are scaled to the 0 to 255 range, all other
+	values need to be within 0 to 255 already.
+	"""
+	values = np.asarray(values)
+	if values.dtype.kind not in 'iuf':
+		raise TypeError("Incorrect type or value passed for opacity.")
+	if values.ndim == 0:
+		values = np.repeat(values, n)
+	if values.shape != (n,):
+		raise ValueError("opacity needs to contain {} values".format(n))
+	if not n:
+		return values.astype(np.int64)
+	if values.min() < 0 or values.max() > 255:
+		raise ValueError("Invalid opacity value")
+	if values.dtype.kind == 'f':
+		values = np.where(values <= 1.0, values*255, values)
+	return values.astype(np.int64)
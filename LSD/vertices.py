@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Vertex buffers for the polygon drawing functions.
+"""
+# Python 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# SDL2 libraries
+import sdl2
+
+# LSD package imports
+from .util import *
+
+# misc
+import ctypes
+
+class VertexBuffer(object):
+	""" Persistent int16 vertex arrays that can be passed to sdlgfx directly.
+
+	drawing.polygon() and drawing.bezier_curve() normally convert their
+	coordinates to ctypes arrays on every call. A VertexBuffer holds them in
+	int16 NumPy arrays whose pointers are handed to sdlgfx as they are, and
+	can be updated in place for animated shapes.
+
+	Parameters
+	----------
+	vx, vy: sequence or numpy.ndarray
+		The x and y coordinates of the vertices.
+	capacity: int, optional
+		The maximum number of vertices, if later updates may contain more 
+		vertices than the initial coordinates. 
+	"""
+
+	def __init__(self, vx, vy, capacity=None):
+		require_numpy("VertexBuffer")
+		n = len(vx)
+		if capacity is None:
+			capacity = n
+		self.capacity = check_int_value(capacity, min_value=1, 
+			varname="capacity")
+		self._vx = np.zeros(self.capacity, dtype=np.int16)
+		self._vy = np.zeros(self.capacity, dtype=np.int16)
+		# The pointers stay valid as the arrays are never reallocated
+		self.vx_pointer = self._vx.ctypes.data_as(ctypes.POINTER(sdl2.Sint16))
+		self.vy_pointer = self._vy.ctypes.data_as(ctypes.POINTER(sdl2.Sint16))
+		self.n = 0
+		self.update(vx, vy)
+
+	def __len__(self):
+		return self.n
+
+	@property
+	def vx(self):
+		""" Writable view on the x coordinates. """
+		return self._vx[:self.n]
+
+	@property
+	def vy(self):
+		""" Writable view on the y coordinates. """
+		return self._vy[:self.n]
+
+	def update(self, vx, vy):
+		""" Replaces the coordinates in place. """
+		n = len(vx)
+		if len(vy) != n:
+			raise ValueError('vx and vy do not have the same number of items')
+		if n > self.capacity:
+			raise ValueError("VertexBuffer can hold at most {} vertices".format(
+				self.capacity))
+		self._vx[:n] = vx
+		self._vy[:n] = vy
+		self.n = n
+		return self
+
+	def translate(self, dx, dy):
+		""" Moves all vertices by (dx, dy) in place. """
+		self._vx[:self.n] += dx
+		self._vy[:self.n] += dy
+		return self
+
+def vertex_pointers(vx, vy=None):
+	""" Converts coordinates to the pointers sdlgfx expects.
+
+	Parameters
+	----------
+	vx: VertexBuffer, numpy.ndarray or sequence
+		A VertexBuffer (vy is then ignored) or the x coordinates. C-contiguous
+		int16 arrays are passed without copying.
+	vy: numpy.ndarray or sequence
+		The y coordinates.
+
+	Returns
+	-------
+	tuple: (vx pointer, vy pointer, n, objects that need to stay alive while
+		the pointers are used)
+	"""
+	if isinstance(vx, VertexBuffer):
+		return vx.vx_pointer, vx.vy_pointer, vx.n, vx
+	if vy is None or len(vx) != len(vy):
+		raise ValueError('vx and vy do not have the same number of items')
+	n = len(vx)
+
+	if not np is None and isinstance(vx, np.ndarray) and \
+		isinstance(vy, np.ndarray):
+		# Only convert if the arrays are not int16 and contiguous already
+		vx = np.ascontiguousarray(vx, dtype=np.int16)
+		vy = np.ascontiguousarray(vy, dtype=np.int16)
+		pointer = ctypes.POINTER(sdl2.Sint16)
+		return vx.ctypes.data_as(pointer), vy.ctypes.data_as(pointer), n, \
+			(vx, vy)
+
+	# Cast the list to the appropriate ctypes vectors readable by
+	# the polygon functions
+	vx = (sdl2.Sint16*n)(*map(int,vx))
+	vy = (sdl2.Sint16*n)(*map(int,vy))
+	return ctypes.cast(vx, ctypes.POINTER(sdl2.Sint16)), \
+		ctypes.cast(vy, ctypes.POINTER(sdl2.Sint16)), n, (vx, vy)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Headless benchmark suite for the drawing functions and FrameBuffers.
+
+Runs with SDL's dummy video driver and a software renderer, so it needs no
+display. Every benchmark reports the number of calls per second; the results
+are written as JSON and can be compared with a stored baseline:
+
+	python benchmark.py --output baseline.json
+	python benchmark.py --compare baseline.json --threshold 0.2
+
+The exit status is 1 if a benchmark raised an error or, with --compare, if a
+benchmark got more than threshold (a fraction) slower than in the baseline or
+is missing from the current run.
+"""
+from __future__ import print_function
+from __future__ import division
+
+# Make sure LSD from parent folder is imported
+import os
+import sys
+sys.path.insert(0,os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import gc
+import glob
+import json
+import platform
+import timeit
+
+import numpy as np
+
+import LSD
+import LSD.drawing as drawing
+import LSD.stimuli as stimuli
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	"resources")
+
+def measure(function, min_time=0.2, rounds=3):
+	""" Calls function repeatedly for at least min_time seconds per round and
+	returns the best rate of the rounds in calls per second. """
+	clock = timeit.default_timer
+	best = 0.0
+	for _ in range(rounds):
+		calls, start = 0, clock()
+		batch = 1
+		while True:
+			for _ in range(batch):
+				function()
+			calls += batch
+			elapsed = clock() - start
+			if elapsed >= min_time:
+				break
+			batch = min(batch*2, 1024)
+		best = max(best, calls/elapsed)
+	return best
+
+def shape_variants():
+	""" (label, kwargs) of the fill, aa and penwidth combinations. """
+	variants = [("fill", dict(fill=True, aa=False)),
+		("fill,aa", dict(fill=True, aa=True))]
+	for penwidth in (1, 3):
+		variants.append(("outline,pw={}".format(penwidth),
+			dict(fill=False, aa=False, penwidth=penwidth)))
+		variants.append(("outline,aa,pw={}".format(penwidth),
+			dict(fill=False, aa=True, penwidth=penwidth)))
+	return variants
+
+def benchmarks(sdl2env, font=None):
+	""" Yields (name, function) for every benchmark. """
+	fb = LSD.create_framebuffer(sdl2env=sdl2env, background_color="#202020")
+
+	# Single shapes, rasterized every call and taken from the shape cache
+	for label, kwargs in shape_variants():
+		yield ("circle[{}]".format(label),
+			lambda kwargs=kwargs: drawing.circle(50, "#FF8000", x=100, y=100,
+			cache=False, **kwargs))
+		yield ("circle[{},cached]".format(label),
+			lambda kwargs=kwargs: drawing.circle(50, "#FF8000", x=100, y=100,
+			**kwargs))
+		yield ("ellipse[{}]".format(label),
+			lambda kwargs=kwargs: drawing.ellipse(60, 30, "#0080FF", x=100,
+			y=100, cache=False, **kwargs))
+		yield ("ellipse[{},cached]".format(label),
+			lambda kwargs=kwargs: drawing.ellipse(60, 30, "#0080FF", x=100,
+			y=100, **kwargs))
+
+	# Batches of 1000 shapes with 10 distinct sizes
+	n = 1000
+	rng = np.random.RandomState(0)
+	xs, ys = rng.randint(0, 800, n), rng.randint(0, 600, n)
+	sizes = rng.randint(1, 11, n)*5
+	yield ("circles[n=1000]", lambda: drawing.circles(xs, ys, sizes, "#FFFFFF"))
+	yield ("ellipses[n=1000]", lambda: drawing.ellipses(xs, ys, sizes, sizes//2+1,
+		"#FFFFFF"))
+	yield ("rects[n=1000]", lambda: drawing.rects(xs, ys, sizes, sizes,
+		"#FFFFFF"))
+
+	# Functions that draw directly on the current render target
+	vx, vy = [100, 300, 200, 50], [100, 120, 300, 250]
+	for label, kwargs in [("fill", dict(fill=True)), ("outline",
+		dict(fill=False)), ("outline,aa", dict(fill=False, aa=True))]:
+		yield ("polygon[{}]".format(label), lambda kwargs=kwargs:
+			drawing.polygon(vx, vy, "#FFFFFF", **kwargs))
+	yield ("bezier_curve", lambda: drawing.bezier_curve(vx, vy, 20, "#FFFFFF"))
+	yield ("rect", lambda: drawing.rect(10, 10, 100, 50, "#FFFFFF"))
+	yield ("line", lambda: drawing.line(10, 10, 100, 50, "#FFFFFF"))
+	yield ("text", lambda: drawing.text(10, 10, "LSD", "#FFFFFF"))
+	yield ("arc", lambda: drawing.arc(100, 100, 50, 0, 90, "#FFFFFF"))
+	yield ("pie", lambda: drawing.pie(100, 100, 50, 0, 90, "#FFFFFF"))
+	yield ("trigon", lambda: drawing.trigon(10, 10, 100, 10, 50, 80, "#FFFFFF"))
+
+	images = glob.glob(os.path.join(RESOURCES, "*.jp*g")) + \
+		glob.glob(os.path.join(RESOURCES, "*.png"))
+	if images:
+		yield ("image[cached]", lambda: drawing.image(0, 0, images[0]))
+		yield ("image", lambda: drawing.image(0, 0, images[0], cache=False))
+
+	pixels = rng.randint(0, 256, (256, 256, 4)).astype(np.uint8)
+	yield ("array[256x256 RGBA]", lambda: drawing.array(pixels))
+	yield ("FrameBuffer.add_array[256x256 RGBA]", lambda: fb.add_array(pixels))
+
+	if not font is None:
+		yield ("ttf_text[cached layout]", lambda: drawing.ttf_text(
+			"The quick brown fox", font, 24, "#FFFFFF"))
+		handle = drawing.ttf_text("The quick brown fox", font, 24, "#FFFFFF")
+		yield ("FrameBuffer.add_text", lambda: fb.add_text(handle))
+
+	# Procedural stimuli; after the first call only the phase is computed
+	yield ("stimuli.gabor[256x256]", lambda: stimuli.gabor(256, 0.05, 30,
+		phase=90))
+	phases = np.arange(100)*3.6
+	yield ("stimuli.grating_array[256x256,100 phases]", lambda:
+		stimuli.grating_array(256, 0.05, 30, phases, sigma=30))
+	yield ("stimuli.noise[256x256,pink]", lambda: stimuli.noise(256, "pink"))
+
+	batch = LSD.create_geometry_batch(sdl2env=sdl2env)
+	for i in range(100):
+		batch.circle(int(xs[i]), int(ys[i]), int(sizes[i]), "#FFFFFF")
+	yield ("FrameBuffer.add_geometry[100 circles]",
+		lambda: fb.add_geometry(batch))
+
+	# Adding to FrameBuffers
+	circle = drawing.circle(20, "#FF0000", x=10, y=10)
+	yield ("FrameBuffer.add", lambda: fb.add(circle))
+	placements = drawing.circles(xs, ys, sizes, "#FFFFFF")
+	yield ("FrameBuffer.add_placements[n=1000]",
+		lambda: fb.add_placements(placements))
+	deferred = LSD.create_framebuffer(sdl2env=sdl2env, deferred=True)
+	def add_deferred():
+		for _ in range(100):
+			deferred.add(circle)
+		deferred.flush()
+	yield ("FrameBuffer.add[deferred,100]+flush", add_deferred)
+
+	display_list = LSD.create_display_list(sdl2env=sdl2env)
+	display_list.clear()
+	display_list.draw("circles", xs, ys, sizes, "#FFFFFF")
+	yield ("FrameBuffer.replay[1000 placements]",
+		lambda: fb.replay(display_list))
+
+	# Presenting
+	yield ("FrameBuffer.show", fb.show)
+	incremental = LSD.create_framebuffer(sdl2env=sdl2env, incremental=True)
+	incremental.show()
+	def show_incremental():
+		incremental.add(circle)
+		incremental.show()
+	yield ("FrameBuffer.show[incremental]", show_incremental)
+	yield ("FrameBuffer.to_array", fb.to_array)
+
+	# Creating FrameBuffers
+	def create_framebuffer():
+		LSD.create_framebuffer(sdl2env=sdl2env).release()
+	yield ("create_framebuffer", create_framebuffer)
+
+def peak_rss_kb():
+	""" The peak resident memory of the process in kB, if it is known. """
+	try:
+		import resource
+	except ImportError:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# macOS reports bytes, Linux kB
+	return peak//1024 if sys.platform == "darwin" else peak
+
+def run(resolution, min_time, name_filter=None, font=None):
+	sdl2env = LSD.create_headless_environment(resolution)
+	results = {}
+	try:
+		for name, function in benchmarks(sdl2env, font):
+			if name_filter and not name_filter in name:
+				continue
+			gc.collect()
+			try:
+				function()
+			except Exception as e:
+				results[name] = {"error": "{}: {}".format(type(e).__name__, e)}
+				print("{:<45} {}".format(name, results[name]["error"]))
+				continue
+			rate = measure(function, min_time)
+			results[name] = {"calls_per_second": rate, "mean_us": 1e6/rate}
+			print("{:<45} {:>12.1f} calls/s {:>12.1f} us".format(name, rate,
+				1e6/rate))
+		meta = {
+			"lsd_version": LSD.__version__,
+			"pysdl2_version": sdl2env.pysdl2_version,
+			"sdl2_version": sdl2env.sdl2_version,
+			"python_version": platform.python_version(),
+			"platform": platform.platform(),
+			"resolution": list(resolution),
+			"min_time": min_time,
+			"peak_rss_kb": peak_rss_kb(),
+			"peak_texture_bytes": sdl2env.resources.peak_bytes,
+		}
+	finally:
+		LSD.destroy_window(sdl2env)
+	return {"meta": meta, "results": results}
+
+def compare(report, baseline, threshold, name_filter=None):
+	""" Prints the change of every benchmark relative to the baseline and
+	returns the names of those that got slower than the threshold, that
+	raised an error or that are in the baseline but missing from the report
+	(and not excluded by name_filter). """
+	regressions = []
+	print("\n{:<45} {:>12} {:>12} {:>8}".format("benchmark", "baseline",
+		"current", "change"))
+	names = set(report["results"]) | set(name for name in baseline["results"]
+		if name_filter is None or name_filter in name)
+	for name in sorted(names):
+		result = report["results"].get(name)
+		base = baseline["results"].get(name)
+		if result is None or "error" in result:
+			regressions.append(name)
+			print("{:<45} {}".format(name, "MISSING" if result is None else
+				"ERROR: " + result["error"]))
+			continue
+		if base is None or not "calls_per_second" in base:
+			continue
+		ratio = result["calls_per_second"]/base["calls_per_second"]
+		flag = ""
+		if ratio < 1.0 - threshold:
+			regressions.append(name)
+			flag = "  REGRESSION"
+		print("{:<45} {:>12.1f} {:>12.1f} {:>+7.1f}%{}".format(name,
+			base["calls_per_second"], result["calls_per_second"],
+			(ratio - 1.0)*100, flag))
+	return regressions
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--output", help="write the results to this JSON file")
+	parser.add_argument("--compare", help="compare with this JSON file")
+	parser.add_argument("--threshold", type=float, default=0.2,
+		help="fraction a benchmark may be slower than the baseline")
+	parser.add_argument("--filter", help="only run benchmarks whose name "
+		"contains this")
+	parser.add_argument("--min-time", type=float, default=0.2,
+		help="seconds to run every benchmark for, per round")
+	parser.add_argument("--resolution", type=int, nargs=2, default=(1024, 768))
+	parser.add_argument("--font", help="TrueType font for the text benchmarks")
+	args = parser.parse_args()
+
+	report = run(tuple(args.resolution), args.min_time, args.filter, args.font)
+	print("\nPeak RSS: {} kB, peak texture memory: {} bytes".format(
+		report["meta"]["peak_rss_kb"], report["meta"]["peak_texture_bytes"]))
+	if args.output:
+		with open(args.output, "w") as fp:
+			json.dump(report, fp, indent=1, sort_keys=True)
+
+	if args.compare:
+		with open(args.compare) as fp:
+			baseline = json.load(fp)
+		regressions = compare(report, baseline, args.threshold, args.filter)
+		if regressions:
+			print("\n{} benchmark(s) regressed by more than {:.0f}%, failed "
+				"or are missing".format(len(regressions), args.threshold*100))
+			sys.exit(1)
+
+	errors = [name for name, result in report["results"].items()
+		if "error" in result]
+	if errors:
+		print("\n{} benchmark(s) failed: {}".format(len(errors),
+			", ".join(sorted(errors))))
+		sys.exit(1)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Measures how long importing LSD and creating a headless environment take in
+fresh processes, and optionally fails if that is slower than a limit.
+
+	python benchmark_startup.py --runs 10 --max-import-ms 50
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs in a new interpreter, so nothing is imported or initialized yet
+CHILD = """
+import sys, time, json
+sys.path.insert(0, {package_dir!r})
+t0 = time.time()
+import LSD
+t1 = time.time()
+env = LSD.create_headless_environment((800, 600))
+t2 = time.time()
+fb = LSD.create_framebuffer(sdl2env=env)
+t3 = time.time()
+print(json.dumps({{"import": t1 - t0, "environment": t2 - t1,
+	"framebuffer": t3 - t2, "sdl2_imported": "sdl2.ext" in sys.modules}}))
+"""
+
+def measure():
+	output = subprocess.check_output([sys.executable, "-c",
+		CHILD.format(package_dir=PACKAGE_DIR)])
+	return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+def median(values):
+	values = sorted(values)
+	middle = len(values)//2
+	if len(values) % 2:
+		return values[middle]
+	return (values[middle-1] + values[middle])/2.0
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--runs", type=int, default=5)
+	parser.add_argument("--max-import-ms", type=float, default=None,
+		help="exit with status 1 if the median import time is slower")
+	parser.add_argument("--max-startup-ms", type=float, default=None,
+		help="exit with status 1 if the median time to the first framebuffer "
+		"is slower")
+	args = parser.parse_args()
+
+	results = [measure() for _ in range(args.runs)]
+	import_ms = median([r["import"] for r in results])*1000
+	environment_ms = median([r["environment"] for r in results])*1000
+	framebuffer_ms = median([r["framebuffer"] for r in results])*1000
+	startup_ms = median([r["import"] + r["environment"] + r["framebuffer"]
+		for r in results])*1000
+
+	print("Median of {} runs:".format(args.runs))
+	print("	import LSD:                  {:8.1f} ms".format(import_ms))
+	print("	create_headless_environment: {:8.1f} ms".format(environment_ms))
+	print("	create_framebuffer:          {:8.1f} ms".format(framebuffer_ms))
+	print("	total:                       {:8.1f} ms".format(startup_ms))
+
+	failed = False
+	if not args.max_import_ms is None and import_ms > args.max_import_ms:
+		print("Import is slower than {} ms".format(args.max_import_ms))
+		failed = True
+	if not args.max_startup_ms is None and startup_ms > args.max_startup_ms:
+		print("Startup is slower than {} ms".format(args.max_startup_ms))
+		failed = True
+	sys.exit(1 if failed else 0)
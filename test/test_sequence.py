@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Shows a short RSVP stream with a FrameSequence and prints its timing report
+"""
+
+# Make sure LSD from parent folder is imported
+import sys, os
+sys.path.insert(0,os.path.join(os.path.dirname(__file__), '..'))
+
+import LSD
+import LSD.drawing
+
+import sdl2.ext
+from random import randint
+
+c = LSD.create_window((800,600), title="Test frame sequence", fullscreen=False)
+print(c)
+
+frames = []
+for i in range(20):
+	fb = LSD.create_framebuffer(background_color="#222222", deferred=True)
+	circle = LSD.drawing.circle(randint(20,100), randint(0, 0xFFFFFFFF), 
+		x=400, y=300)
+	fb.add(circle)
+	# Show every display for 6 frames, with a blank of 3 frames in between
+	frames.append((fb, 6))
+	frames.append((LSD.create_framebuffer(background_color="#222222"), 3))
+
+sequence = LSD.FrameSequence(frames)
+report = sequence.play()
+
+print("Onsets: {}".format(report["onsets"]))
+print("Dropped frames: {}".format(report["dropped_frames"]))
+
+processor = sdl2.ext.TestEventProcessor()
+processor.run(c.window)
+
+sdl2.ext.quit()